@@ -5,6 +5,7 @@ import importlib
 
 import click
 
+from minerva.backend.distributed import launch
 from minerva.utils import init_logger, setup_torch_multiprocessing, get_logger, SUBPROBLEM_INFERENCE, \
     get_available_problems
 
@@ -20,8 +21,12 @@ def action():
 @action.command()
 @click.option('-p', '--problem', type=PROBLEMS_CHOICE, help='problem to choose', required=True)
 @click.option('-d', '--dev_mode', help='dev mode on', is_flag=True)
-def dry_train(problem, dev_mode):
-    dry_run(problem, train_mode=True, dev_mode=dev_mode)
+@click.option('--procs', type=int, default=1, help='number of data-parallel training processes')
+def dry_train(problem, dev_mode, procs):
+    if procs > 1:
+        launch(dry_run, procs, problem, True, dev_mode)
+    else:
+        dry_run(problem, train_mode=True, dev_mode=dev_mode)
 
 
 @action.command()
@@ -33,7 +38,7 @@ def dry_eval(problem, dev_mode):
 
 def dry_run(problem, train_mode, dev_mode):
     if problem == 'whales':
-        setup_torch_multiprocessing()
+        setup_torch_multiprocessing(force=True)
 
     pm = importlib.import_module('minerva.{}.problem_manager'.format(problem))
     sub_problems = SUBPROBLEM_INFERENCE.get(problem, {0: None})
@@ -61,6 +66,18 @@ def submit(problem, task_nr, file_path, dev_mode):
     pm.submit_task(task_sub_problem, task_nr, file_path, dev_mode)
 
 
+@action.command()
+@click.option('-n', '--name', type=click.Choice(['precision', 'export', 'loader']), help='benchmark to run',
+              required=True)
+@click.option('-w', '--network', type=click.Choice(['localizer', 'aligner', 'classifier']), default='localizer',
+              help='whales network to benchmark')
+@click.option('-s', '--steps', type=int, default=20, help='number of steps per mode')
+def benchmark(name, network, steps):
+    setup_torch_multiprocessing()
+    benchmarks = importlib.import_module('minerva.whales.benchmarks')
+    getattr(benchmarks, 'benchmark_{}'.format(name))(network=network, steps=steps)
+
+
 if __name__ == "__main__":
     init_logger()
     action()
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import pprint
 
@@ -5,6 +6,9 @@ import numpy as np
 from sklearn.externals import joblib
 
 from minerva.utils import get_logger
+from .distributed import barrier, is_main_process
+from .executor import StepExecutor
+from . import storage
 from .utils import view_graph, plot_graph
 
 logger = get_logger()
@@ -12,13 +16,15 @@ logger = get_logger()
 
 class Step:
     def __init__(self, name, transformer, input_steps=[], input_data=[], adapter=None, cache_dirpath=None,
-                 save_outputs=[], save_graph=False):
+                 save_outputs=[], save_graph=False, max_workers=1, cache_output=False):
         self.name = name
         self.transformer = transformer
 
         self.input_steps = input_steps
         self.input_data = input_data
         self.adapter = adapter
+        self.max_workers = max_workers
+        self.cache_output = cache_output
 
         if save_graph:
             self._save_graph()
@@ -27,11 +33,12 @@ class Step:
         self._prep_cache(cache_dirpath, save_outputs)
 
     def _prep_cache(self, cache_dirpath, save_outputs):
-        for dirname in ['transformers', 'outputs']:
+        for dirname in ['transformers', 'outputs', 'output_cache']:
             os.makedirs(os.path.join(cache_dirpath, dirname), exist_ok=True)
 
         self.cache_dirpath_transformers = os.path.join(cache_dirpath, 'transformers')
         self.save_dirpath_outputs = os.path.join(cache_dirpath, 'outputs')
+        self.cache_dirpath_outputs = os.path.join(cache_dirpath, 'output_cache')
 
         self.cache_filepath_step_transformer = os.path.join(self.cache_dirpath_transformers, self.name)
 
@@ -65,53 +72,93 @@ class Step:
     def _can_load_transform(self):
         return self.is_cached
 
+    def get_fingerprint(self, data_fingerprints, input_fingerprints, fit):
+        """
+        Hash of everything the step output depends on: transformer params and persisted state,
+        fingerprints of the input steps and of the input data.
+        Returns None when the output cannot be known upfront, because this step or one of its ancestors will be fitted.
+        """
+        can_load = self._can_load_fit_transform if fit else self._can_load_transform
+        if not can_load or any(fingerprint is None for fingerprint in input_fingerprints.values()):
+            return None
+
+        return joblib.hash({'name': self.name,
+                            'transformer': type(self.transformer).__name__,
+                            'transformer_params': _get_plain_params(self.transformer),
+                            'transformer_state': _file_digest(self.cache_filepath_step_transformer),
+                            'input_steps': input_fingerprints,
+                            'input_data': {name: data_fingerprints[name] for name in self.input_data or []},
+                            })
+
+    def _cache_filepath_step_output(self, fingerprint):
+        return os.path.join(self.cache_dirpath_outputs, '{}_{}'.format(self.name, fingerprint))
+
+    def has_cached_output(self, fingerprint):
+        return storage.output_exists(self._cache_filepath_step_output(fingerprint))
+
+    def load_cached_output(self, fingerprint):
+        logger.info('step {} loading cached outputs...'.format(self.name))
+        return storage.load_output(self._cache_filepath_step_output(fingerprint))
+
+    def save_cached_output(self, fingerprint, output_data):
+        if not is_main_process():
+            return
+        logger.info('step {} caching outputs...'.format(self.name))
+        storage.save_output(output_data, self._cache_filepath_step_output(fingerprint))
+
     def fit_transform(self, data):
+        return StepExecutor(max_workers=self.max_workers).fit_transform(self, data)
+
+    def fit_transform_step(self, data, input_step_outputs):
+        step_inputs = self._get_step_inputs(data, input_step_outputs)
+        step_output_data = self._cached_fit_transform(step_inputs)
+        return step_output_data
+
+    def _get_step_inputs(self, data, input_step_outputs):
         step_inputs = {}
         if self.input_data is not None:
             for input_data_part in self.input_data:
                 step_inputs[input_data_part] = data[input_data_part]
 
         for input_step in self.input_steps:
-            step_inputs[input_step.name] = input_step.fit_transform(data)
+            step_inputs[input_step.name] = input_step_outputs[input_step.name]
 
         if self.adapter:
             step_inputs = self.adapt(step_inputs)
         else:
             step_inputs = self.unpack(step_inputs)
-        step_output_data = self._cached_fit_transform(step_inputs)
-        return step_output_data
+        return step_inputs
 
     def _cached_fit_transform(self, step_inputs):
-        if self._can_load_fit_transform:
+        can_load = self._can_load_fit_transform
+        # in distributed training every rank has to decide before the main process writes anything of this step
+        barrier()
+        if can_load:
             logger.info('step {} loading...'.format(self.name))
             self.transformer.load(self.cache_filepath_step_transformer)
             logger.info('step {} transforming...'.format(self.name))
             step_output_data = self.transformer.transform(**step_inputs)
         else:
             step_output_data = self.transformer.fit_transform(**step_inputs)
-            logger.info('step {} saving transformer...'.format(self.name))
-            self.transformer.save(self.cache_filepath_step_transformer)
-            logger.info('step {} saving outputs...'.format(self.name))
-            self._save_selected_outputs(step_output_data)
+            if is_main_process():
+                logger.info('step {} saving transformer...'.format(self.name))
+                self.transformer.save(self.cache_filepath_step_transformer)
+                logger.info('step {} saving outputs...'.format(self.name))
+                self._save_selected_outputs(step_output_data)
         return step_output_data
 
     def _save_selected_outputs(self, output_data):
         for name, filepath in self.save_filepath_step_outputs.items():
-            joblib.dump(output_data[name], filepath)
+            storage.save_output(output_data[name], filepath)
 
-    def transform(self, data):
-        step_inputs = {}
-        if self.input_data is not None:
-            for input_data_part in self.input_data:
-                step_inputs[input_data_part] = data[input_data_part]
+    def load_saved_output(self, name, mmap_mode='c', columns=None):
+        return storage.load_output(self.save_filepath_step_outputs[name], mmap_mode=mmap_mode, columns=columns)
 
-        for input_step in self.input_steps:
-            step_inputs[input_step.name] = input_step.transform(data)
+    def transform(self, data):
+        return StepExecutor(max_workers=self.max_workers).transform(self, data)
 
-        if self.adapter:
-            step_inputs = self.adapt(step_inputs)
-        else:
-            step_inputs = self.unpack(step_inputs)
+    def transform_step(self, data, input_step_outputs):
+        step_inputs = self._get_step_inputs(data, input_step_outputs)
         step_output_data = self._cached_transform(step_inputs)
         return step_output_data
 
@@ -265,6 +312,19 @@ class Dummy(BaseTransformer):
         joblib.dump({}, filepath)
 
 
+def _get_plain_params(transformer):
+    plain_types = (bool, int, float, str, tuple, list, dict, type(None))
+    return {name: value for name, value in sorted(vars(transformer).items()) if isinstance(value, plain_types)}
+
+
+def _file_digest(filepath, chunk_size=2 ** 20):
+    digest = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def identity_inputs(inputs):
     return inputs[0]
 
@@ -0,0 +1,131 @@
+import json
+import os
+import queue
+import threading
+
+from deepsense import neptune
+
+from minerva.utils import get_logger
+
+logger = get_logger()
+
+_STOP = object()
+
+
+class NeptuneSink:
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def send_numeric(self, points):
+        for channel_name, x, y in points:
+            self.ctx.channel_send(channel_name, x=x, y=y)
+
+    def send_image(self, channel_name, name, description, image):
+        self.ctx.channel_send(channel_name, neptune.Image(name=name, description=description, data=image))
+
+
+class FileSink:
+    """
+    Local stand-in for Neptune, numeric points go to a json lines file and images to png files.
+    """
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.numeric_filepath = os.path.join(dirpath, 'channels.jsonl')
+        os.makedirs(dirpath, exist_ok=True)
+
+    def send_numeric(self, points):
+        with open(self.numeric_filepath, 'a') as f:
+            for channel_name, x, y in points:
+                f.write(json.dumps({'channel': channel_name, 'x': float(x), 'y': float(y)}) + '\n')
+
+    def send_image(self, channel_name, name, description, image):
+        image_dirpath = os.path.join(self.dirpath, channel_name)
+        os.makedirs(image_dirpath, exist_ok=True)
+        image.save(os.path.join(image_dirpath, '{}.png'.format(name)))
+
+
+class ChannelSender:
+    """
+    Sends channel values from a background thread so that training never waits on the service.
+
+    Numeric points are batched, images are rendered by the worker from the render function passed with them.
+    When the bounded queue is full either the oldest queued item or the incoming one is dropped,
+    depending on drop_policy. flush blocks until everything queued so far has been sent.
+    """
+
+    def __init__(self, sink, max_queue_size=1000, batch_size=100, drop_policy='oldest'):
+        if drop_policy not in ('oldest', 'newest'):
+            raise ValueError('drop_policy must be one of oldest, newest, got {}'.format(drop_policy))
+        self.sink = sink
+        self.batch_size = batch_size
+        self.drop_policy = drop_policy
+        self.dropped_nr = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def send_numeric(self, channel_name, x, y):
+        self._put(('numeric', (channel_name, x, y)))
+
+    def send_image(self, channel_name, name, description, render):
+        self._put(('image', (channel_name, name, description, render)))
+
+    def flush(self):
+        self._queue.join()
+        if self.dropped_nr:
+            logger.warning('channel sender dropped {} values under backpressure'.format(self.dropped_nr))
+            self.dropped_nr = 0
+
+    def close(self):
+        self.flush()
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped_nr += 1
+                if self.drop_policy == 'newest':
+                    return
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._send([item for item in items if item is not _STOP])
+            except Exception:
+                logger.exception('channel sender failed to send values')
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+            if any(item is _STOP for item in items):
+                return
+
+    def _send(self, items):
+        points = [value for kind, value in items if kind == 'numeric']
+        if points:
+            self.sink.send_numeric(points)
+        for kind, value in items:
+            if kind == 'image':
+                channel_name, name, description, render = value
+                try:
+                    self.sink.send_image(channel_name, name, description, render())
+                except Exception:
+                    logger.exception('channel sender failed to send image {}'.format(name))
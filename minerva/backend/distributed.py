@@ -0,0 +1,89 @@
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from minerva.utils import get_logger, init_logger
+
+logger = get_logger()
+
+
+def launch(function, procs, *args):
+    """
+    Runs function(*args) in procs processes joined in a gloo process group on this node.
+    Intra-op threads are split evenly between the processes.
+    """
+    mp.spawn(_run_worker, args=(procs, _get_free_port(), function, args), nprocs=procs, join=True)
+
+
+def _run_worker(rank, world_size, port, function, args):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    if rank == 0:
+        # logging handlers are not inherited by spawned processes
+        init_logger()
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    logger.info('rank {} of {} started with {} threads'.format(rank, world_size, torch.get_num_threads()))
+    try:
+        function(*args)
+    finally:
+        dist.destroy_process_group()
+
+
+def _get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast_parameters(model, src=0):
+    """
+    Copies parameters and buffers of model from rank src to all other ranks.
+    """
+    if not is_distributed():
+        return
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        dist.broadcast(tensor.data, src=src)
+
+
+def all_reduce_gradients(model):
+    """
+    Averages gradients over ranks with a single all-reduce of one flat buffer.
+    """
+    if not is_distributed():
+        return
+    grads = [parameter.grad for parameter in model.parameters() if parameter.grad is not None]
+    if not grads:
+        return
+    flat_grads = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat_grads)
+    flat_grads /= get_world_size()
+
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat_grads[offset:offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
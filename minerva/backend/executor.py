@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sklearn.externals import joblib
+
+from minerva.utils import get_logger
+from .distributed import barrier, is_distributed
+
+logger = get_logger()
+
+
+class StepExecutor:
+    """
+    Runs a graph of steps in topological order and executes every step once per call.
+
+    With max_workers > 1 steps whose inputs are ready run concurrently on a thread pool.
+    The output of a step is released as soon as all of its dependants have consumed it.
+    Steps with cache_output reuse outputs stored under their fingerprint, and their ancestors are not run at all.
+    Fingerprinting hashes all input data of the graph on every run. Cached outputs are never evicted,
+    remove the output_cache directory of the experiment to reclaim the space.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+
+    def fit_transform(self, step, data):
+        return self._run(step, data, fit=True)
+
+    def transform(self, step, data):
+        return self._run(step, data, fit=False)
+
+    def _run(self, output_step, data, fit):
+        steps = output_step.all_steps
+        fingerprints = _get_output_fingerprints(steps, data, fit)
+        cached = {name for name, fingerprint in fingerprints.items()
+                  if fingerprint is not None and steps[name].has_cached_output(fingerprint)}
+        if fit:
+            # every rank has to see the same cached outputs before any of them is written
+            barrier()
+        steps = _get_required_steps(output_step, steps, cached)
+        dependants_nr = _count_dependants(steps, cached)
+
+        # steps synchronize ranks when fitting, so in distributed training they run in the same order everywhere
+        if (self.max_workers is None or self.max_workers > 1) and not is_distributed():
+            run_graph = self._run_parallel
+        else:
+            run_graph = self._run_sequential
+        return run_graph(output_step, steps, cached, fingerprints, dependants_nr, data, fit)
+
+    def _run_sequential(self, output_step, steps, cached, fingerprints, dependants_nr, data, fit):
+        step_outputs = {}
+        for name, step in steps.items():
+            step_outputs[name] = _run_step(step, data, _gather_inputs(step, step_outputs, cached), fit,
+                                           fingerprints[name], name in cached)
+            _release_inputs(step, step_outputs, cached, dependants_nr)
+        return step_outputs[output_step.name]
+
+    def _run_parallel(self, output_step, steps, cached, fingerprints, dependants_nr, data, fit):
+        step_outputs = {}
+        waiting = dict(steps)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while waiting or running:
+                for name, step in list(waiting.items()):
+                    if name in cached or all(input_step.name in step_outputs for input_step in step.input_steps):
+                        future = pool.submit(_run_step, step, data, _gather_inputs(step, step_outputs, cached), fit,
+                                             fingerprints[name], name in cached)
+                        running[future] = step
+                        del waiting[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    step_outputs[step.name] = future.result()
+                    _release_inputs(step, step_outputs, cached, dependants_nr)
+        return step_outputs[output_step.name]
+
+
+def _run_step(step, data, input_step_outputs, fit, fingerprint, is_cached):
+    if is_cached:
+        return step.load_cached_output(fingerprint)
+
+    if fit:
+        step_output_data = step.fit_transform_step(data, input_step_outputs)
+    else:
+        step_output_data = step.transform_step(data, input_step_outputs)
+
+    if fingerprint is not None:
+        step.save_cached_output(fingerprint, step_output_data)
+    return step_output_data
+
+
+def _get_output_fingerprints(steps, data, fit):
+    """
+    Fingerprints of the steps that cache their outputs, None for all other steps.
+    """
+    output_fingerprints = {name: None for name in steps}
+    if not any(step.cache_output for step in steps.values()):
+        return output_fingerprints
+
+    data_fingerprints = {}
+    fingerprints = {}
+    for name, step in steps.items():
+        for input_data_part in step.input_data or []:
+            if input_data_part not in data_fingerprints:
+                data_fingerprints[input_data_part] = joblib.hash(data[input_data_part])
+        input_fingerprints = {input_step.name: fingerprints[input_step.name] for input_step in step.input_steps}
+        fingerprints[name] = step.get_fingerprint(data_fingerprints, input_fingerprints, fit)
+        if step.cache_output:
+            output_fingerprints[name] = fingerprints[name]
+    return output_fingerprints
+
+
+def _get_required_steps(output_step, steps, cached):
+    required = {output_step.name}
+    for name, step in reversed(list(steps.items())):
+        if name in required and name not in cached:
+            required.update(input_step.name for input_step in step.input_steps)
+    return {name: step for name, step in steps.items() if name in required}
+
+
+def _gather_inputs(step, step_outputs, cached):
+    if step.name in cached:
+        return {}
+    return {input_step.name: step_outputs[input_step.name] for input_step in step.input_steps}
+
+
+def _count_dependants(steps, cached):
+    dependants_nr = {name: 0 for name in steps}
+    for name, step in steps.items():
+        if name in cached:
+            continue
+        for input_step_name in {input_step.name for input_step in step.input_steps}:
+            dependants_nr[input_step_name] += 1
+    return dependants_nr
+
+
+def _release_inputs(step, step_outputs, cached, dependants_nr):
+    if step.name in cached:
+        return
+    for input_step_name in {input_step.name for input_step in step.input_steps}:
+        dependants_nr[input_step_name] -= 1
+        if dependants_nr[input_step_name] == 0:
+            del step_outputs[input_step_name]
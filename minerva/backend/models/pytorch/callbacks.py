@@ -1,13 +1,17 @@
 import os
 import shutil
 from datetime import datetime, timedelta
+from functools import partial
 
 import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
 from torch.optim.lr_scheduler import ExponentialLR
 
-from minerva.backend.models.pytorch.utils import overlay_box, overlay_keypoints, Averager, save_model
+from minerva.backend.channels import ChannelSender, NeptuneSink, FileSink
+from minerva.backend.distributed import is_main_process
+from minerva.backend.models.pytorch.utils import overlay_box, overlay_keypoints, Averager, save_model, \
+    TRAINING_STATE_FILENAME
 from minerva.backend.models.pytorch.validation import score_model_multi_output, predict_on_batch_multi_output
 from minerva.backend.utils import get_unique_channel_name
 from minerva.utils import get_logger
@@ -25,6 +29,7 @@ class Callback:
         self.optimizer = None
         self.loss_function = None
         self.validation_datagen = None
+        self.validation_context = None
         self.lr_scheduler = None
 
     def set_params(self, transformer, validation_datagen):
@@ -33,10 +38,21 @@ class Callback:
         self.loss_function = transformer.loss_function
         self.validation_datagen = validation_datagen
 
+    def get_validation_metrics(self):
+        if self.validation_context is None:
+            return ValidationContext(self.model, self.loss_function, self.validation_datagen).get_metrics()
+        return self.validation_context.get_metrics()
+
     def on_train_begin(self, *args, **kwargs):
         self.epoch_id = 0
         self.batch_id = 0
 
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state):
+        pass
+
     def on_train_end(self, *args, **kwargs):
         pass
 
@@ -54,6 +70,32 @@ class Callback:
         self.batch_id += 1
 
 
+class ValidationContext:
+    """
+    Validation metrics shared by all callbacks of a CallbackList.
+
+    Metrics are computed lazily on the first request after a trigger, so a single validation pass
+    serves every callback reading them at that epoch or batch end.
+    """
+
+    def __init__(self, model, loss_function, validation_datagen):
+        self.model = model
+        self.loss_function = loss_function
+        self.validation_datagen = validation_datagen
+        self.metrics = None
+
+    def invalidate(self):
+        self.metrics = None
+
+    def get_metrics(self):
+        if self.metrics is None:
+            self.model.eval()
+            val_loss, val_acc = score_model_multi_output(self.model, self.loss_function, self.validation_datagen)
+            self.model.train()
+            self.metrics = {'val_loss': val_loss, 'val_acc': val_acc}
+        return self.metrics
+
+
 class CallbackList:
     def __init__(self, callbacks=None):
         if callbacks is None:
@@ -62,13 +104,36 @@ class CallbackList:
             self.callbacks = [callbacks]
         else:
             self.callbacks = callbacks
+        self.validation_context = None
 
     def __len__(self):
         return len(self.callbacks)
 
-    def set_params(self, *args, **kwargs):
+    def set_params(self, transformer, validation_datagen):
+        self.validation_context = ValidationContext(transformer.model, transformer.loss_function, validation_datagen)
+        for callback in self.callbacks:
+            callback.set_params(transformer, validation_datagen=validation_datagen)
+            callback.validation_context = self.validation_context
+
+    def state_dict(self):
+        return {key: callback.state_dict() for key, callback in self._get_keyed_callbacks()}
+
+    def load_state_dict(self, state, epoch_id):
+        """
+        Restores callback states and sets every callback to the start of epoch epoch_id.
+        Callbacks are matched by class, so ranks that only run some of the callbacks load their part.
+        """
+        for key, callback in self._get_keyed_callbacks():
+            callback.epoch_id = epoch_id
+            callback.batch_id = 0
+            callback.load_state_dict(state.get(key, {}))
+
+    def _get_keyed_callbacks(self):
+        counts = {}
         for callback in self.callbacks:
-            callback.set_params(*args, **kwargs)
+            name = type(callback).__name__
+            counts[name] = counts.get(name, -1) + 1
+            yield '{}_{}'.format(name, counts[name]), callback
 
     def on_train_begin(self, *args, **kwargs):
         for callback in self.callbacks:
@@ -83,6 +148,7 @@ class CallbackList:
             callback.on_epoch_begin(*args, **kwargs)
 
     def on_epoch_end(self, *args, **kwargs):
+        self._invalidate_validation()
         for callback in self.callbacks:
             callback.on_epoch_end(*args, **kwargs)
 
@@ -91,15 +157,22 @@ class CallbackList:
             callback.on_batch_begin(*args, **kwargs)
 
     def on_batch_end(self, *args, **kwargs):
+        self._invalidate_validation()
         for callback in self.callbacks:
             callback.on_batch_end(*args, **kwargs)
 
+    def _invalidate_validation(self):
+        if self.validation_context is not None:
+            self.validation_context.invalidate()
+
 
 class TrainingMonitor(Callback):
     def __init__(self, epoch_every=None, batch_every=None):
         super().__init__()
         self.epoch_loss_averager = Averager()
         self.epoch_acc_averager = Averager()
+        self.epoch_start = datetime.now()
+        self.epoch_data_wait_time = 0.
         if epoch_every == 0:
             self.epoch_every = False
         else:
@@ -115,20 +188,28 @@ class TrainingMonitor(Callback):
         self.epoch_id = 0
         self.batch_id = 0
 
+    def on_epoch_begin(self, *args, **kwargs):
+        self.epoch_start = datetime.now()
+        self.epoch_data_wait_time = 0.
+
     def on_epoch_end(self, *args, **kwargs):
         epoch_avg_loss = self.epoch_loss_averager.value
         epoch_avg_acc = self.epoch_acc_averager.value
         self.epoch_loss_averager.reset()
         self.epoch_acc_averager.reset()
         if self.epoch_every and ((self.epoch_id % self.epoch_every) == 0):
+            epoch_time = (datetime.now() - self.epoch_start).total_seconds()
             logger.info('epoch {0} loss:     {1:.5f}'.format(self.epoch_id, epoch_avg_loss))
             logger.info('epoch {0} accuracy: {1:.5f}'.format(self.epoch_id, epoch_avg_acc))
+            logger.info('epoch {0} data wait: {1:.1f}s of {2:.1f}s'.format(
+                self.epoch_id, self.epoch_data_wait_time, epoch_time))
         self.epoch_id += 1
         self.batch_id = 0
 
     def on_batch_end(self, metrics, *args, **kwargs):
         batch_loss = metrics['batch_loss']
         batch_acc = metrics['batch_acc']
+        self.epoch_data_wait_time += metrics.get('data_wait_time', 0.)
         self.epoch_loss_averager.send(batch_loss)
         self.epoch_acc_averager.send(batch_acc)
         if self.batch_every and ((self.batch_id % self.batch_every) == 0):
@@ -151,9 +232,8 @@ class ValidationMonitor(Callback):
 
     def on_epoch_end(self, *args, **kwargs):
         if self.epoch_every and ((self.epoch_id % self.epoch_every) == 0):
-            self.model.eval()
-            val_loss, val_acc = score_model_multi_output(self.model, self.loss_function, self.validation_datagen)
-            self.model.train()
+            val_metrics = self.get_validation_metrics()
+            val_loss, val_acc = val_metrics['val_loss'], val_metrics['val_acc']
             logger.info('epoch {0} validation loss:     {1:.5f}'.format(self.epoch_id, val_loss))
             logger.info('epoch {0} validation accuracy: {1:.5f}'.format(self.epoch_id, val_acc))
         self.epoch_id += 1
@@ -161,9 +241,8 @@ class ValidationMonitor(Callback):
 
     def on_batch_end(self, metrics, *args, **kwargs):
         if self.batch_every and ((self.batch_id % self.batch_every) == 0):
-            self.model.eval()
-            val_loss, val_acc = score_model_multi_output(self.model, self.loss_function, self.validation_datagen)
-            self.model.train()
+            val_metrics = self.get_validation_metrics()
+            val_loss, val_acc = val_metrics['val_loss'], val_metrics['val_acc']
             logger.info('epoch {0} batch {1} validation loss:     {2:.5f}'.format(self.epoch_id,
                                                                                   self.batch_id,
                                                                                   val_loss))
@@ -277,6 +356,13 @@ class ExponentialLRScheduler(Callback):
         self.batch_id = 0
         logger.info('initial lr: {0}'.format(self.optimizer.state_dict()['param_groups'][0]['initial_lr']))
 
+    def state_dict(self):
+        return {'lr_scheduler': self.lr_scheduler.state_dict()}
+
+    def load_state_dict(self, state):
+        if 'lr_scheduler' in state:
+            self.lr_scheduler.load_state_dict(state['lr_scheduler'])
+
     def on_epoch_end(self, *args, **kwargs):
         if self.epoch_every and (((self.epoch_id + 1) % self.epoch_every) == 0):
             self.lr_scheduler.step()
@@ -294,12 +380,17 @@ class ExponentialLRScheduler(Callback):
 
 
 class ModelCheckpoint(Callback):
+    """
+    Besides the model weights, the full training state is kept in training_state.torch at the start of
+    every epoch and at the end of training, Model.fit resumes from it.
+    """
+
     def __init__(self, checkpoint_dir, best_only=False, epoch_every=1, batch_every=None):
         super().__init__()
         self.checkpoint_dir = checkpoint_dir
-        if best_only:
-            self.best_only = best_only
-            raise NotImplementedError
+        self.best_only = best_only
+        self.best_loss = None
+        self.transformer = None
         if epoch_every == 0:
             self.epoch_every = False
         else:
@@ -312,32 +403,86 @@ class ModelCheckpoint(Callback):
     def on_train_begin(self, *args, **kwargs):
         self.epoch_id = 0
         self.batch_id = 0
+        self.best_loss = None
         os.makedirs(self.checkpoint_dir, exist_ok=True)
 
+    def set_params(self, transformer, validation_datagen):
+        super().set_params(transformer, validation_datagen)
+        self.transformer = transformer
+
+    def state_dict(self):
+        return {'best_loss': self.best_loss}
+
+    def load_state_dict(self, state):
+        self.best_loss = state.get('best_loss')
+
+    def on_train_end(self, *args, **kwargs):
+        # a later fit in the same checkpoint_dir must not pick up a finished run
+        self._save_training_state(complete=True)
+
+    def on_epoch_begin(self, *args, **kwargs):
+        # at epoch begin every callback has finished the previous epoch, so the saved state is consistent
+        if self.epoch_id > 0:
+            self._save_training_state()
+
+    def _save_training_state(self, complete=False):
+        if is_main_process():
+            self.transformer.save_training_state(os.path.join(self.checkpoint_dir, TRAINING_STATE_FILENAME),
+                                                 self.epoch_id, complete=complete)
+
     def on_epoch_end(self, *args, **kwargs):
         if self.epoch_every and ((self.epoch_id % self.epoch_every) == 0):
-            full_path = os.path.join(self.checkpoint_dir, 'model_epoch{0}.torch'.format(self.epoch_id))
-            save_model(self.model, full_path)
-            logger.info('epoch {0} model saved to {1}'.format(self.epoch_id, full_path))
+            full_path = self._get_checkpoint_path('model_epoch{0}.torch'.format(self.epoch_id))
+            if full_path is not None:
+                save_model(self.model, full_path)
+                logger.info('epoch {0} model saved to {1}'.format(self.epoch_id, full_path))
         self.epoch_id += 1
         self.batch_id = 0
 
     def on_batch_end(self, *args, **kwargs):
         if self.batch_every and ((self.batch_id % self.batch_every) == 0):
-            full_path = os.path.join(self.checkpoint_dir,
-                                     'model_epoch{0}_batch{1}.torch'.format(self.epoch_id, self.batch_id))
-            save_model(self.model, full_path)
-            logger.info('epoch {0} batch {1} model saved to {2}'.format(self.epoch_id, self.batch_id, full_path))
+            full_path = self._get_checkpoint_path('model_epoch{0}_batch{1}.torch'.format(self.epoch_id, self.batch_id))
+            if full_path is not None:
+                save_model(self.model, full_path)
+                logger.info('epoch {0} batch {1} model saved to {2}'.format(self.epoch_id, self.batch_id, full_path))
         self.batch_id += 1
 
+    def _get_checkpoint_path(self, filename):
+        """
+        With best_only the model is saved to best_model.torch only when the validation loss improved.
+        In distributed training only the main process saves.
+        """
+        if not is_main_process():
+            return None
+        if not self.best_only:
+            return os.path.join(self.checkpoint_dir, filename)
+
+        val_loss = self.get_validation_metrics()['val_loss']
+        if self.best_loss is not None and val_loss >= self.best_loss:
+            return None
+        self.best_loss = val_loss
+        return os.path.join(self.checkpoint_dir, 'best_model.torch')
+
 
 class NeptuneMonitor(Callback):
-    def __init__(self, name=None):
+    """
+    Values are sent by a background ChannelSender, local_sink_dirpath replaces Neptune with a FileSink.
+    The sender is started on train begin and closed, after sending everything queued, on train end.
+    """
+
+    def __init__(self, name=None, max_queue_size=1000, drop_policy='oldest', local_sink_dirpath=None):
         super().__init__()
         self.ctx = neptune.Context()
         self.name = name
         self.epoch_loss_averager = Averager()
         self.epoch_acc_averager = Averager()
+        if local_sink_dirpath is None:
+            self.sink = NeptuneSink(self.ctx)
+        else:
+            self.sink = FileSink(local_sink_dirpath)
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.sender = None
 
     def _get_channel_name(self, base_name):
         if base_name not in self._channel_names:
@@ -350,6 +495,11 @@ class NeptuneMonitor(Callback):
         self.epoch_id = 0
         self.batch_id = 0
         self._channel_names = {}
+        self.sender = ChannelSender(self.sink, max_queue_size=self.max_queue_size, drop_policy=self.drop_policy)
+
+    def on_train_end(self, *args, **kwargs):
+        self.sender.close()
+        self.sender = None
 
     def on_batch_end(self, metrics, *args, **kwargs):
         batch_loss = metrics['batch_loss']
@@ -361,8 +511,8 @@ class NeptuneMonitor(Callback):
         logs = {'epoch_id': self.epoch_id, 'batch_id': self.batch_id, 'batch_loss': batch_loss,
                 'batch_acc': batch_acc}
 
-        self.ctx.channel_send(self._get_channel_name('batch_loss'), x=logs['batch_id'], y=logs['batch_loss'])
-        self.ctx.channel_send(self._get_channel_name('batch_acc'), x=logs['batch_id'], y=logs['batch_acc'])
+        self.sender.send_numeric(self._get_channel_name('batch_loss'), x=logs['batch_id'], y=logs['batch_loss'])
+        self.sender.send_numeric(self._get_channel_name('batch_acc'), x=logs['batch_id'], y=logs['batch_acc'])
 
         self.batch_id += 1
 
@@ -372,9 +522,8 @@ class NeptuneMonitor(Callback):
         self.epoch_loss_averager.reset()
         self.epoch_acc_averager.reset()
 
-        self.model.eval()
-        val_loss, val_acc = score_model_multi_output(self.model, self.loss_function, self.validation_datagen)
-        self.model.train()
+        val_metrics = self.get_validation_metrics()
+        val_loss, val_acc = val_metrics['val_loss'], val_metrics['val_acc']
 
         logs = {'epoch_id': self.epoch_id, 'batch_id': self.batch_id,
                 'epoch_loss': epoch_avg_loss,
@@ -384,15 +533,15 @@ class NeptuneMonitor(Callback):
         self.epoch_id += 1
 
     def _send_numeric_channels(self, logs):
-        self.ctx.channel_send(self._get_channel_name('epoch_loss'), x=logs['epoch_id'], y=logs['epoch_loss'])
-        self.ctx.channel_send(self._get_channel_name('epoch_acc'), x=logs['epoch_id'], y=logs['epoch_acc'])
-        self.ctx.channel_send(self._get_channel_name('epoch_val_loss'), x=logs['epoch_id'], y=logs['epoch_val_loss'])
-        self.ctx.channel_send(self._get_channel_name('epoch_val_acc'), x=logs['epoch_id'], y=logs['epoch_val_acc'])
+        self.sender.send_numeric(self._get_channel_name('epoch_loss'), x=logs['epoch_id'], y=logs['epoch_loss'])
+        self.sender.send_numeric(self._get_channel_name('epoch_acc'), x=logs['epoch_id'], y=logs['epoch_acc'])
+        self.sender.send_numeric(self._get_channel_name('epoch_val_loss'), x=logs['epoch_id'], y=logs['epoch_val_loss'])
+        self.sender.send_numeric(self._get_channel_name('epoch_val_acc'), x=logs['epoch_id'], y=logs['epoch_val_acc'])
 
 
 class NeptuneMonitorLocalizer(NeptuneMonitor):
-    def __init__(self, bins_nr, img_nr, name=None):
-        super().__init__(name=name)
+    def __init__(self, bins_nr, img_nr, name=None, **kwargs):
+        super().__init__(name=name, **kwargs)
         self.bins_nr = bins_nr
         self.img_nr = img_nr
 
@@ -402,9 +551,8 @@ class NeptuneMonitorLocalizer(NeptuneMonitor):
         self.epoch_loss_averager.reset()
         self.epoch_acc_averager.reset()
 
-        self.model.eval()
-        val_loss, val_acc = score_model_multi_output(self.model, self.loss_function, self.validation_datagen)
-        self.model.train()
+        val_metrics = self.get_validation_metrics()
+        val_loss, val_acc = val_metrics['val_loss'], val_metrics['val_acc']
 
         logs = {'epoch_id': self.epoch_id, 'batch_id': self.batch_id,
                 'epoch_loss': epoch_avg_loss,
@@ -414,12 +562,10 @@ class NeptuneMonitorLocalizer(NeptuneMonitor):
 
         for i, (image, y_pred, y_true) in enumerate(
                 predict_on_batch_multi_output(self.model, self.validation_datagen)):
-            image_with_box = overlay_box(image, y_pred, y_true, self.bins_nr)
-            pill_image = Image.fromarray((image_with_box * 255.).astype(np.uint8))
-            self.ctx.channel_send(self._get_channel_name("plotted bbox"), neptune.Image(
-                name='epoch{}_batch{}_idx{}'.format(self.epoch_id, self.batch_id, i),
-                description="true and prediction bbox",
-                data=pill_image))
+            self.sender.send_image(self._get_channel_name("plotted bbox"),
+                                   name='epoch{}_batch{}_idx{}'.format(self.epoch_id, self.batch_id, i),
+                                   description="true and prediction bbox",
+                                   render=partial(render_overlay, overlay_box, image, y_pred, y_true, self.bins_nr))
 
             if i == self.img_nr:
                 break
@@ -427,8 +573,8 @@ class NeptuneMonitorLocalizer(NeptuneMonitor):
 
 
 class NeptuneMonitorKeypoints(NeptuneMonitor):
-    def __init__(self, bins_nr, img_nr, name=None):
-        super().__init__(name=name)
+    def __init__(self, bins_nr, img_nr, name=None, **kwargs):
+        super().__init__(name=name, **kwargs)
         self.bins_nr = bins_nr
         self.img_nr = img_nr
 
@@ -438,9 +584,8 @@ class NeptuneMonitorKeypoints(NeptuneMonitor):
         self.epoch_loss_averager.reset()
         self.epoch_acc_averager.reset()
 
-        self.model.eval()
-        val_loss, val_acc = score_model_multi_output(self.model, self.loss_function, self.validation_datagen)
-        self.model.train()
+        val_metrics = self.get_validation_metrics()
+        val_loss, val_acc = val_metrics['val_loss'], val_metrics['val_acc']
 
         logs = {'epoch_id': self.epoch_id, 'batch_id': self.batch_id,
                 'epoch_loss': epoch_avg_loss,
@@ -450,12 +595,11 @@ class NeptuneMonitorKeypoints(NeptuneMonitor):
 
         for i, (image, y_pred, y_true) in enumerate(
                 predict_on_batch_multi_output(self.model, self.validation_datagen)):
-            image_with_keypoints = overlay_keypoints(image, y_pred, y_true, self.bins_nr)
-            pill_image = Image.fromarray((image_with_keypoints * 255.).astype(np.uint8))
-            self.ctx.channel_send(self._get_channel_name("plotted key points"), neptune.Image(
-                name='epoch{}_batch{}_idx{}'.format(self.epoch_id, self.batch_id, i),
-                description="true and prediction key points",
-                data=pill_image))
+            self.sender.send_image(self._get_channel_name("plotted key points"),
+                                   name='epoch{}_batch{}_idx{}'.format(self.epoch_id, self.batch_id, i),
+                                   description="true and prediction key points",
+                                   render=partial(render_overlay, overlay_keypoints, image, y_pred, y_true,
+                                                  self.bins_nr))
 
             if i == self.img_nr:
                 break
@@ -479,7 +623,7 @@ class ExperimentTiming(Callback):
         logger.info('training finished...')
 
     def on_epoch_begin(self, *args, **kwargs):
-        if self.epoch_id > 0:
+        if self.epoch_id > 0 and self.epoch_start is not None:
             epoch_time = datetime.now() - self.epoch_start
             logger.info('epoch {0} time {1}'.format(self.epoch_id - 1, str(epoch_time)[:-7]))
         self.epoch_start = datetime.now()
@@ -509,3 +653,8 @@ class CallbackEarlyStopping(Callback):  # thank you keras
     def __init__(self):
         super().__init__()
         pass
+
+
+def render_overlay(overlay_function, image, y_pred, y_true, bins_nr):
+    image_with_overlay = overlay_function(image, y_pred, y_true, bins_nr)
+    return Image.fromarray((image_with_overlay * 255.).astype(np.uint8))
@@ -0,0 +1,75 @@
+import torch
+import torch.nn as nn
+
+from minerva.utils import get_logger
+
+logger = get_logger()
+
+RUNTIMES = ['eager', 'torchscript']
+
+
+class TargetOutputs(nn.Module):
+    """
+    Exposes forward_target of a multi output network as forward with a tuple output, as tracing requires.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return tuple(self.model.forward_target(x))
+
+
+def export_torchscript(model, input_shape, filepath, batch_size=1):
+    """
+    Traces forward_target and freezes the module for inference.
+    Freezing inlines the weights, which folds batch norms into the preceding convolutions.
+    The frozen module is saved, the optimizations for the local device are applied again on load.
+    """
+    frozen_model = freeze_torchscript(model, input_shape, batch_size)
+    torch.jit.save(frozen_model, filepath)
+    logger.info('torchscript model saved to {}'.format(filepath))
+    return torch.jit.optimize_for_inference(frozen_model)
+
+
+def compile_torchscript(model, input_shape, batch_size=1):
+    return torch.jit.optimize_for_inference(freeze_torchscript(model, input_shape, batch_size))
+
+
+def freeze_torchscript(model, input_shape, batch_size=1):
+    was_training = model.training
+    model.eval()
+    example = torch.zeros(batch_size, *input_shape, device=_get_device(model))
+    with torch.no_grad():
+        traced_model = torch.jit.trace(TargetOutputs(model).eval(), example)
+        frozen_model = torch.jit.freeze(traced_model)
+    model.train(was_training)
+    return frozen_model
+
+
+def load_torchscript(filepath):
+    map_location = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return torch.jit.optimize_for_inference(torch.jit.load(filepath, map_location=map_location))
+
+
+def export_onnx(model, input_shape, filepath, batch_size=1):
+    """
+    Exports forward_target to ONNX with a dynamic batch dimension, requires the onnx package from requirements-onnx.txt.
+    """
+    was_training = model.training
+    model.eval()
+    example = torch.zeros(batch_size, *input_shape, device=_get_device(model))
+    wrapped_model = TargetOutputs(model).eval()
+    with torch.no_grad():
+        outputs_nr = len(wrapped_model(example))
+    output_names = ['output_{}'.format(i) for i in range(outputs_nr)]
+    dynamic_axes = {name: {0: 'batch'} for name in ['input'] + output_names}
+    torch.onnx.export(wrapped_model, example, filepath, input_names=['input'], output_names=output_names,
+                      dynamic_axes=dynamic_axes, dynamo=False)
+    model.train(was_training)
+    logger.info('onnx model saved to {}'.format(filepath))
+
+
+def _get_device(model):
+    return next(model.parameters()).device
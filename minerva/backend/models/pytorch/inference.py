@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+REDUCTIONS = ['none', 'argmax']
+
+
+class InferenceEngine:
+    """
+    Runs forward_target of a multi output model, or of a compiled module returning its outputs, over a datagen
+    without autograd and streams every batch into a preallocated numpy buffer, so only one batch of logits
+    is ever held on the device.
+
+    reduction 'none' keeps the stacked log probabilities (N, outputs, classes), 'argmax' keeps only
+    the best class per output (N, outputs) computed on the device.
+
+    hflip_outputs enables test time augmentation with horizontal flips: the batch is concatenated with
+    its flipped copy and run in a single forward pass. For every output it holds (source_output, reverse_bins),
+    the output of the flipped image that predicts it and whether its bins are mirrored by the flip.
+    Probabilities of the original and the flipped prediction are averaged.
+    """
+
+    def __init__(self, model, reduction='none', hflip_outputs=None):
+        if reduction not in REDUCTIONS:
+            raise ValueError('reduction must be one of {}, got {}'.format(REDUCTIONS, reduction))
+        self.model = model
+        self.reduction = reduction
+        self.hflip_outputs = hflip_outputs
+
+    def run(self, datagen, input_transform=None):
+        batch_gen, steps = datagen
+        self.model.eval()
+
+        buffer, filled = None, 0
+        with torch.no_grad():
+            for batch_id, data in enumerate(tqdm(batch_gen, total=steps)):
+                X = data[0]
+                if torch.cuda.is_available():
+                    X = X.cuda(non_blocking=True)
+                if input_transform is not None:
+                    X = input_transform(X)
+
+                batch_outputs = self._predict(X).cpu().numpy()
+                batch_size = batch_outputs.shape[0]
+                if buffer is None:
+                    buffer = np.empty((_get_capacity(batch_gen, steps, batch_size),) + batch_outputs.shape[1:],
+                                      dtype=batch_outputs.dtype)
+                if filled + batch_size > len(buffer):
+                    buffer = np.concatenate([buffer, np.empty_like(buffer[:max(len(buffer), batch_size)])])
+                buffer[filled:filled + batch_size] = batch_outputs
+                filled += batch_size
+
+                if batch_id == steps:
+                    break
+
+        if buffer is None:
+            return np.empty((0,))
+        return buffer[:filled]
+
+    def _predict(self, X):
+        if self.hflip_outputs is None:
+            outputs = self._forward(X)
+        else:
+            outputs = self._predict_hflip(X)
+
+        if self.reduction == 'argmax':
+            return torch.stack([output.argmax(dim=1) for output in outputs], dim=1)
+        return torch.stack([output.float() for output in outputs], dim=1)
+
+    def _forward(self, X):
+        forward = getattr(self.model, 'forward_target', self.model)
+        return forward(X)
+
+    def _predict_hflip(self, X):
+        batch_size = X.size(0)
+        outputs = self._forward(torch.cat([X, X.flip(3)]))
+        original_outputs = [output[:batch_size].float() for output in outputs]
+        flipped_outputs = [output[batch_size:].float() for output in outputs]
+
+        averaged_outputs = []
+        for original_output, (source_output, reverse_bins) in zip(original_outputs, self.hflip_outputs):
+            flipped_output = flipped_outputs[source_output]
+            if reverse_bins:
+                flipped_output = flipped_output.flip(1)
+            # log of the mean probability
+            averaged_outputs.append(torch.logaddexp(original_output, flipped_output) - math.log(2.))
+        return averaged_outputs
+
+
+def _get_capacity(batch_gen, steps, batch_size):
+    dataset = getattr(batch_gen, 'dataset', None)
+    if dataset is not None:
+        return len(dataset)
+    return (steps + 1) * batch_size
@@ -0,0 +1,357 @@
+import os
+import queue
+import tempfile
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, RandomSampler, SequentialSampler
+from torch.utils.data.dataloader import default_collate
+
+_END = object()
+
+
+class LoaderWrapper:
+    def __init__(self, loader):
+        self.loader = loader
+        self.epoch_id = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def _start_epoch(self):
+        # distributed samplers shuffle differently only when told about the new epoch
+        sampler = getattr(self.loader, 'sampler', None)
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(self.epoch_id)
+        # so do iterable datasets ordering their items themselves
+        dataset = getattr(self.loader, 'dataset', None)
+        if hasattr(dataset, 'set_epoch'):
+            dataset.set_epoch(self.epoch_id)
+        self.epoch_id += 1
+
+
+class BatchTransformLoader(LoaderWrapper):
+    """
+    Applies batch_transform to every collated batch in the main process.
+    """
+
+    def __init__(self, loader, batch_transform):
+        super().__init__(loader)
+        self.batch_transform = batch_transform
+
+    def __iter__(self):
+        self._start_epoch()
+        for batch in self.loader:
+            yield self.batch_transform(batch)
+
+
+class PrefetchLoader(LoaderWrapper):
+    """
+    Iterates a DataLoader on a background thread keeping up to prefetch_depth batches staged ahead.
+
+    With cuda available the staged batches are copied to the device on a side stream,
+    so with pinned memory the transfer of the next batch overlaps the current training step.
+    batch_transform is applied to the staged batch after the transfer.
+    """
+
+    def __init__(self, loader, prefetch_depth=2, batch_transform=None):
+        super().__init__(loader)
+        self.prefetch_depth = prefetch_depth
+        self.batch_transform = batch_transform
+
+    def __iter__(self):
+        self._start_epoch()
+        batches = queue.Queue(maxsize=self.prefetch_depth)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch, copied = item
+                if copied is not None:
+                    torch.cuda.current_stream().wait_event(copied)
+                    _record_stream(batch, torch.cuda.current_stream())
+                yield batch
+        finally:
+            stop.set()
+            while producer.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    producer.join(timeout=0.1)
+
+    def _produce(self, batches, stop):
+        stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+        try:
+            for batch in self.loader:
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = self._stage(_to_device(batch))
+                        copied = torch.cuda.Event()
+                        copied.record(stream)
+                else:
+                    batch = self._stage(batch)
+                    copied = None
+                if not _put(batches, (batch, copied), stop):
+                    return
+            _put(batches, _END, stop)
+        except Exception as e:
+            _put(batches, e, stop)
+
+    def _stage(self, batch):
+        if self.batch_transform is None:
+            return batch
+        return self.batch_transform(batch)
+
+
+def _put(batches, item, stop):
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _to_device(batch):
+    if torch.is_tensor(batch):
+        return batch.cuda(non_blocking=True)
+    elif isinstance(batch, (list, tuple)):
+        return type(batch)(_to_device(item) for item in batch)
+    else:
+        return batch
+
+
+def _record_stream(batch, stream):
+    # tensors allocated on the side stream must not be reused before the consuming stream is done with them
+    if torch.is_tensor(batch):
+        batch.record_stream(stream)
+    elif isinstance(batch, (list, tuple)):
+        for item in batch:
+            _record_stream(item, stream)
+
+
+class CachedLoader(LoaderWrapper):
+    """
+    Replays the collated batches of a deterministic loader from a TensorCache.
+
+    The first complete pass fills the cache, every later pass reads from it without touching the loader.
+    Replayed tensors are shared between passes, consumers must not modify them in place.
+    """
+
+    def __init__(self, loader, cache):
+        super().__init__(loader)
+        self.cache = cache
+
+    def __iter__(self):
+        self._start_epoch()
+        if self.cache.is_complete:
+            yield from self.cache
+        else:
+            yield from self.cache.record(self.loader)
+
+
+class TensorCache:
+    """
+    Batches of (nested) tuples of cpu tensors, kept in memory while their size stays under max_memory_bytes.
+    Beyond that all batches are moved to a file in dirpath which is memory mapped once the pass is complete.
+    Batches are stored as unpinned copies, when the recorded batches were pinned the replayed ones are pinned again.
+    """
+
+    def __init__(self, max_memory_bytes, dirpath=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.dirpath = dirpath
+        self.batches = None
+        self.nbytes = 0
+        self.pin_memory = False
+        self._data = None
+
+    @property
+    def is_complete(self):
+        return self.batches is not None
+
+    def __iter__(self):
+        for batch in self.batches:
+            batch = self._load(batch)
+            yield _pin_memory(batch) if self.pin_memory else batch
+
+    def record(self, batches):
+        """
+        Yields the batches while storing them, the cache is complete only if the pass is not interrupted.
+        """
+        stored_batches, stored_bytes, pin_memory = [], 0, False
+        data_file, data_filepath = None, None
+        try:
+            for batch in batches:
+                stored_bytes += _get_nbytes(batch)
+                pin_memory = pin_memory or _is_pinned(batch)
+                if data_file is None and stored_bytes > self.max_memory_bytes:
+                    os.makedirs(self.dirpath or tempfile.gettempdir(), exist_ok=True)
+                    fd, data_filepath = tempfile.mkstemp(prefix='tensor_cache', dir=self.dirpath)
+                    data_file = os.fdopen(fd, 'wb')
+                    stored_batches = [_write(stored_batch, data_file) for stored_batch in stored_batches]
+                stored_batches.append(_clone(batch) if data_file is None else _write(batch, data_file))
+                yield batch
+
+            if data_file is not None:
+                data_file.close()
+                self._data = np.memmap(data_filepath, dtype=np.uint8, mode='c') if stored_bytes else None
+            self.nbytes = stored_bytes
+            self.pin_memory = pin_memory
+            self.batches = stored_batches
+        finally:
+            if data_file is not None:
+                data_file.close()
+                # the mapping stays valid after the file is unlinked
+                os.remove(data_filepath)
+
+    def _load(self, batch):
+        if isinstance(batch, _StoredTensor):
+            array = self._data[batch.offset:batch.offset + batch.nbytes].view(batch.dtype).reshape(batch.shape)
+            return torch.from_numpy(array)
+        elif isinstance(batch, (list, tuple)):
+            return type(batch)(self._load(item) for item in batch)
+        else:
+            return batch
+
+
+_StoredTensor = namedtuple('_StoredTensor', ['offset', 'nbytes', 'dtype', 'shape'])
+
+_TENSOR_CACHES = OrderedDict()
+_TENSOR_CACHES_LOCK = threading.Lock()
+
+
+def get_tensor_cache(key, max_memory_bytes, dirpath=None):
+    """
+    Caches are shared in the process by key, so loaders rebuilt over the same data reuse the stored batches.
+
+    max_memory_bytes is also the budget of all shared caches together: the least recently requested caches
+    are dropped from the registry until the others fit in it. A dropped cache is freed with the last loader using it.
+    """
+    with _TENSOR_CACHES_LOCK:
+        cache = _TENSOR_CACHES.pop(key, None)
+        if cache is None:
+            cache = TensorCache(max_memory_bytes, dirpath)
+        _TENSOR_CACHES[key] = cache
+        _evict_tensor_caches(max_memory_bytes)
+        return cache
+
+
+def _evict_tensor_caches(max_total_bytes):
+    total_bytes = sum(cache.nbytes for cache in _TENSOR_CACHES.values())
+    # the most recently requested cache is never dropped
+    while total_bytes > max_total_bytes and len(_TENSOR_CACHES) > 1:
+        _, cache = _TENSOR_CACHES.popitem(last=False)
+        total_bytes -= cache.nbytes
+
+
+def _write(batch, data_file):
+    if torch.is_tensor(batch):
+        array = batch.numpy()
+        # aligned offsets let the replayed arrays be used by torch without a copy
+        data_file.write(bytes(-data_file.tell() % 64))
+        stored_tensor = _StoredTensor(data_file.tell(), array.nbytes, array.dtype, array.shape)
+        data_file.write(np.ascontiguousarray(array).tobytes())
+        return stored_tensor
+    elif isinstance(batch, (list, tuple)):
+        return type(batch)(_write(item, data_file) for item in batch)
+    else:
+        return batch
+
+
+def _clone(batch):
+    # a clone is never pinned and is not affected by consumers modifying the recorded batch in place
+    if torch.is_tensor(batch):
+        return batch.clone()
+    elif isinstance(batch, (list, tuple)):
+        return type(batch)(_clone(item) for item in batch)
+    else:
+        return batch
+
+
+def _is_pinned(batch):
+    if torch.is_tensor(batch):
+        return batch.is_pinned()
+    elif isinstance(batch, (list, tuple)):
+        return any(_is_pinned(item) for item in batch)
+    else:
+        return False
+
+
+def _get_nbytes(batch):
+    if torch.is_tensor(batch):
+        return batch.element_size() * batch.nelement()
+    elif isinstance(batch, (list, tuple)):
+        return sum(_get_nbytes(item) for item in batch)
+    else:
+        return 0
+
+
+class ThreadPoolDataLoader:
+    """
+    DataLoader counterpart running dataset.__getitem__ on a pool of threads in the main process.
+
+    Nothing is pickled and no interpreter is started, which pays off when items are decoded and warped
+    by libraries releasing the GIL (turbojpeg, PIL, cv2). Items of up to prefetch_batches batches are in flight,
+    batches are collated and optionally pinned in the iterating thread.
+    """
+
+    def __init__(self, dataset, batch_size=1, shuffle=False, sampler=None, num_workers=0, collate_fn=None,
+                 pin_memory=False, drop_last=False, prefetch_batches=2):
+        if sampler is None:
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+        self.dataset = dataset
+        self.sampler = sampler
+        self.batch_sampler = BatchSampler(sampler, batch_size, drop_last)
+        self.num_workers = max(num_workers, 1)
+        self.collate_fn = default_collate if collate_fn is None else collate_fn
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch_batches = max(prefetch_batches, 1)
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        pool = ThreadPoolExecutor(self.num_workers)
+        try:
+            batch_indices = iter(self.batch_sampler)
+            pending = deque()
+            for indices in batch_indices:
+                pending.append([pool.submit(self.dataset.__getitem__, index) for index in indices])
+                if len(pending) == self.prefetch_batches:
+                    break
+
+            while pending:
+                items = [item.result() for item in pending.popleft()]
+                indices = next(batch_indices, None)
+                if indices is not None:
+                    pending.append([pool.submit(self.dataset.__getitem__, index) for index in indices])
+
+                batch = self.collate_fn(items)
+                if self.pin_memory:
+                    batch = _pin_memory(batch)
+                yield batch
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _pin_memory(batch):
+    if torch.is_tensor(batch):
+        return batch.pin_memory()
+    elif isinstance(batch, (list, tuple)):
+        return type(batch)(_pin_memory(item) for item in batch)
+    else:
+        return batch
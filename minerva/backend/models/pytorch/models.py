@@ -1,17 +1,27 @@
+import os
+import time
 from functools import partial
 
-import numpy as np
 import torch
 import torch.nn as nn
+from sklearn.externals import joblib
 from torch.autograd import Variable
 from tqdm import tqdm
 
 from minerva.backend.base import BaseTransformer
+from minerva.backend.distributed import broadcast_parameters, all_reduce_gradients
+from minerva.backend.models.pytorch.export import RUNTIMES, export_torchscript, export_onnx, load_torchscript
+from minerva.backend.models.pytorch.inference import InferenceEngine
+from minerva.backend.models.pytorch.utils import save_training_state, load_training_state, get_rng_state, \
+    set_rng_state, TRAINING_STATE_FILENAME
 from minerva.backend.models.pytorch.validation import torch_acc_score_multi_output, torch_acc_score
 from minerva.utils import get_logger
 
 logger = get_logger()
 
+PRECISIONS = {'fp32': torch.float32,
+              'bf16': torch.bfloat16}
+
 
 class Model(BaseTransformer):
     def __init__(self, architecture_config, training_config, callbacks_config):
@@ -19,6 +29,12 @@ class Model(BaseTransformer):
         self.architecture_config = architecture_config
         self.training_config = training_config
         self.callbacks_config = callbacks_config
+        self.precision = training_config.get('precision', 'fp32')
+        self.channels_last = training_config.get('channels_last', False)
+        self.accumulation_steps = training_config.get('accumulation_steps', 1)
+        self.resume = training_config.get('resume', False)
+        if self.precision not in PRECISIONS:
+            raise ValueError('precision must be one of {}, got {}'.format(list(PRECISIONS), self.precision))
 
         self.model = None
         self.optimizer = None
@@ -40,46 +56,139 @@ class Model(BaseTransformer):
 
     def fit(self, datagen, validation_datagen=None):
         self._initialize_model_weights()
+        training_state = self._load_training_state()
+        if training_state is not None:
+            self.model.load_state_dict(training_state['model'])
 
         if torch.cuda.is_available():
             self.model = self.model.cuda()
         else:
             self.model = self.model
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        broadcast_parameters(self.model)
 
         self.callbacks.set_params(self, validation_datagen=validation_datagen)
         self.callbacks.on_train_begin()
 
         batch_gen, steps = datagen
-        for epoch_id in range(self.training_config['epochs']):
+        start_epoch = 0
+        if training_state is not None:
+            start_epoch = self._restore_training_state(training_state, batch_gen)
+        for epoch_id in range(start_epoch, self.training_config['epochs']):
             self.callbacks.on_epoch_begin()
+            micro_batch_metrics = []
+            data_wait_time = 0.
+            batch_end = time.time()
             for batch_id, data in enumerate(batch_gen):
-                self.callbacks.on_batch_begin()
-                metrics = self._fit_loop(data)
-                self.callbacks.on_batch_end(metrics=metrics)
+                data_wait_time += time.time() - batch_end
+                if not micro_batch_metrics:
+                    self.callbacks.on_batch_begin()
+                    self.optimizer.zero_grad()
+                micro_batch_metrics.append(self._fit_loop(data, loss_scale=1. / self.accumulation_steps))
+                if len(micro_batch_metrics) == self.accumulation_steps:
+                    self._optimizer_step(micro_batch_metrics, data_wait_time)
+                    micro_batch_metrics = []
+                    data_wait_time = 0.
                 if batch_id == steps:
                     break
+                batch_end = time.time()
+            if micro_batch_metrics:
+                self._optimizer_step(micro_batch_metrics, data_wait_time)
             self.callbacks.on_epoch_end()
         self.callbacks.on_train_end()
         return self
 
-    def _fit_loop(self, data):
+    def save_training_state(self, filepath, epoch_id, complete=False):
+        """
+        Saves everything needed to continue training from the start of epoch epoch_id.
+        The state of a complete run is kept for inspection but never resumed.
+        """
+        save_training_state({'epoch_id': epoch_id,
+                             'complete': complete,
+                             'config': self._get_config_fingerprint(),
+                             'model': self.model.state_dict(),
+                             'optimizer': self.optimizer.state_dict(),
+                             'callbacks': self.callbacks.state_dict(),
+                             'rng': get_rng_state()}, filepath)
+
+    def _get_config_fingerprint(self):
+        training_config = {key: value for key, value in self.training_config.items() if key != 'resume'}
+        return joblib.hash((self.architecture_config, training_config))
+
+    def _load_training_state(self):
+        if not self.resume:
+            return None
+        checkpoint_dir = self.callbacks_config.get('model_checkpoint', {}).get('checkpoint_dir')
+        if checkpoint_dir is None:
+            return None
+        filepath = os.path.join(checkpoint_dir, TRAINING_STATE_FILENAME)
+        if not os.path.exists(filepath):
+            return None
+        training_state = load_training_state(filepath)
+        if training_state.get('complete', False):
+            logger.info('training state in {} is from a finished run, training from scratch'.format(filepath))
+            return None
+        if training_state.get('config') != self._get_config_fingerprint():
+            logger.info('training state in {} was saved with another config, training from scratch'.format(
+                filepath))
+            return None
+        logger.info('resuming training from {} at epoch {}'.format(filepath, training_state['epoch_id']))
+        return training_state
+
+    def _restore_training_state(self, training_state, batch_gen):
+        # the optimizer is restored after the lr scheduler was created, which resets the learning rates
+        self.optimizer.load_state_dict(training_state['optimizer'])
+        self.callbacks.load_state_dict(training_state['callbacks'], training_state['epoch_id'])
+        set_rng_state(training_state['rng'])
+        if hasattr(batch_gen, 'epoch_id'):
+            batch_gen.epoch_id = training_state['epoch_id']
+        return training_state['epoch_id']
+
+    def _optimizer_step(self, micro_batch_metrics, data_wait_time):
+        """
+        Steps the optimizer on gradients accumulated over micro-batches, callbacks see one batch per step.
+        """
+        micro_batches_nr = len(micro_batch_metrics)
+        if micro_batches_nr < self.accumulation_steps:
+            # the last step of an epoch may accumulate fewer micro-batches than the losses were scaled for
+            for parameter in self.model.parameters():
+                if parameter.grad is not None:
+                    parameter.grad.mul_(self.accumulation_steps / micro_batches_nr)
+        all_reduce_gradients(self.model)
+        self.optimizer.step()
+
+        metrics = {name: sum(metrics[name] for metrics in micro_batch_metrics) / micro_batches_nr
+                   for name in micro_batch_metrics[0]}
+        metrics['data_wait_time'] = data_wait_time
+        self.callbacks.on_batch_end(metrics=metrics)
+
+    def _fit_loop(self, data, loss_scale=1.):
         X, target_tensor = data
 
         if torch.cuda.is_available():
             X, target_var = Variable(X).cuda(), Variable(target_tensor).cuda()
         else:
             X, target_var = Variable(X), Variable(target_tensor)
-        self.optimizer.zero_grad()
-        output = self.model(X)
-        batch_loss = self.loss_function(output, target_var)
-        batch_loss.backward()
-        self.optimizer.step()
+        with self._autocast():
+            output = self.model(self._to_memory_format(X))
+            batch_loss = self.loss_function(output, target_var)
+        (batch_loss * loss_scale).backward()
 
-        batch_loss_ = batch_loss.data.cpu().numpy()[0]
+        batch_loss_ = batch_loss.item()
         batch_acc = torch_acc_score(output, target_tensor)
         return {'batch_loss': batch_loss_,
                 'batch_acc': batch_acc}
 
+    def _autocast(self):
+        device_type = 'cuda' if torch.cuda.is_available() else 'cpu'
+        return torch.autocast(device_type, dtype=PRECISIONS[self.precision], enabled=self.precision != 'fp32')
+
+    def _to_memory_format(self, X):
+        if self.channels_last:
+            return X.contiguous(memory_format=torch.channels_last)
+        return X
+
     def _transform(self, datagen, validation_datagen=None):
         self.model.eval()
         batch_gen, steps = datagen
@@ -125,7 +234,24 @@ class Model(BaseTransformer):
 
 
 class MultiOutputModel(Model):
-    def _fit_loop(self, data):
+    """
+    With inference_params runtime 'torchscript' the saved model is also exported to a frozen TorchScript
+    module next to it, and transform runs that module after load.
+    """
+
+    def __init__(self, architecture_config, training_config, callbacks_config):
+        super().__init__(architecture_config, training_config, callbacks_config)
+        self.inference_params = architecture_config.get('inference_params', {})
+        self.runtime = self.inference_params.get('runtime', 'eager')
+        if self.runtime not in RUNTIMES:
+            raise ValueError('runtime must be one of {}, got {}'.format(RUNTIMES, self.runtime))
+        self.compiled_model = None
+
+    def fit(self, datagen, validation_datagen=None):
+        self.compiled_model = None
+        return super().fit(datagen, validation_datagen)
+
+    def _fit_loop(self, data, loss_scale=1.):
         X, targets_tensor = data
 
         targets_tensor = targets_tensor.transpose(0, 1)
@@ -134,46 +260,45 @@ class MultiOutputModel(Model):
             X, targets_var = Variable(X).cuda(), Variable(targets_tensor).cuda()
         else:
             X, targets_var = Variable(X), Variable(targets_tensor)
-        self.optimizer.zero_grad()
-        outputs = self.model(X)
-        batch_loss = self.loss_function(outputs, targets_var)
-        batch_loss.backward()
-        self.optimizer.step()
+        with self._autocast():
+            outputs = self.model(self._to_memory_format(X))
+            batch_loss = self.loss_function(outputs, targets_var)
+        (batch_loss * loss_scale).backward()
 
-        batch_loss_ = batch_loss.data.cpu().numpy()[0]
+        batch_loss_ = batch_loss.item()
         batch_acc = torch_acc_score_multi_output(outputs, targets_tensor)
         return {'batch_loss': batch_loss_,
                 'batch_acc': batch_acc}
 
-    def _transform(self, datagen, validation_datagen=None):
-        self.model.eval()
-
-        batch_gen, steps = datagen
+    def _transform(self, datagen, validation_datagen=None, reduction='none'):
+        model = self.model if self.compiled_model is None else self.compiled_model
+        engine = InferenceEngine(model, reduction=reduction, hflip_outputs=self.inference_params.get('hflip_outputs'))
+        with self._autocast():
+            return engine.run(datagen, input_transform=self._to_memory_format)
 
-        outputs = []
-        for batch_id, data in enumerate(tqdm(batch_gen, total=steps)):
-            X, target = data
-
-            if torch.cuda.is_available():
-                X = Variable(X, volatile=True).cuda()
+    def load(self, filepath):
+        super().load(filepath)
+        if self.runtime == 'torchscript':
+            compiled_filepath = '{}.torchscript'.format(filepath)
+            # an artifact older than the weights was exported from another network
+            if os.path.exists(compiled_filepath) and os.path.getmtime(compiled_filepath) >= os.path.getmtime(filepath):
+                self.compiled_model = load_torchscript(compiled_filepath)
             else:
-                X = Variable(X, volatile=True)
-
-            batch_outputs = self.model.forward_target(X)
-            for i, batch_output in enumerate(batch_outputs):
-                batch_output_numpy = batch_output.data.cpu().numpy()
-                try:
-                    outputs[i].append(batch_output_numpy)
-                except Exception:
-                    outputs.append([])
-                    outputs[i].append(batch_output_numpy)
-
-            if batch_id == steps:
-                break
+                self.compiled_model = export_torchscript(self.model, self.inference_params['input_shape'],
+                                                         compiled_filepath)
+        return self
 
-        outputs = [np.vstack(output) for output in outputs]
-        outputs = np.stack(outputs, axis=1)
-        return outputs
+    def save(self, filepath):
+        super().save(filepath)
+        compiled_filepath, onnx_filepath = '{}.torchscript'.format(filepath), '{}.onnx'.format(filepath)
+        if self.runtime == 'torchscript':
+            export_torchscript(self.model, self.inference_params['input_shape'], compiled_filepath)
+        elif os.path.exists(compiled_filepath):
+            os.remove(compiled_filepath)
+        if self.inference_params.get('onnx', False):
+            export_onnx(self.model, self.inference_params['input_shape'], onnx_filepath)
+        elif os.path.exists(onnx_filepath):
+            os.remove(onnx_filepath)
 
 
 def init_weights_normal(model, mean, std_conv2d, std_linear):
@@ -1,7 +1,12 @@
+import os
+import random
+
 import cv2
 import numpy as np
 import torch
 
+TRAINING_STATE_FILENAME = 'training_state.torch'
+
 
 def denormalize_img(img):
     mean = [0.28201905, 0.37246801, 0.42341868]
@@ -69,6 +74,36 @@ def save_model(model, path):
     model.train()
 
 
+def save_training_state(state, path):
+    """
+    Writes to a temporary file first so that an interrupted save never leaves a truncated checkpoint behind.
+    """
+    tmp_path = '{}.tmp'.format(path)
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_training_state(path):
+    return torch.load(path, map_location=lambda storage, loc: storage, weights_only=False)
+
+
+def get_rng_state():
+    state = {'python': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if torch.cuda.is_available() and 'cuda' in state:
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
 class Averager:
     """
     Todo:
@@ -4,71 +4,75 @@ from sklearn.metrics import accuracy_score
 from torch.autograd import Variable
 
 
-def score_model(model, loss_function, datagen):
-    batch_gen, steps = datagen
+class StreamingMetrics:
+    """
+    Running sample-weighted loss and accuracy.
 
-    output_full, target_full = [], []
-    for batch_id, data in enumerate(batch_gen):
-        X, target = data
+    Sums are kept on the device and only read back when the values are requested,
+    so scoring memory does not grow with the dataset and batches are never synchronized.
+    Accuracy of multiple outputs is the average of per-output accuracies.
+    """
 
-        if torch.cuda.is_available():
-            X = Variable(X, volatile=True).cuda()
+    def __init__(self):
+        self.loss_total = None
+        self.correct = None
+        self.samples_nr = 0
+
+    def update(self, batch_loss, outputs, targets):
+        batch_size = targets[0].size(0)
+        batch_loss = batch_loss.detach() * batch_size
+        correct = torch.stack([(output.argmax(dim=1) == target).sum() for output, target in zip(outputs, targets)])
+        if self.samples_nr == 0:
+            self.loss_total, self.correct = batch_loss, correct
         else:
-            X = Variable(X, volatile=True)
-        output = model(X)
+            self.loss_total, self.correct = self.loss_total + batch_loss, self.correct + correct
+        self.samples_nr += batch_size
 
-        output_full.extend(output.data.cpu())
-        target_full.extend(target)
+    @property
+    def loss(self):
+        return self.loss_total.item() / self.samples_nr
 
-        if batch_id == steps:
-            break
+    @property
+    def accuracy(self):
+        return (self.correct.double() / self.samples_nr).mean().item()
 
-    output_full = torch.cat(output_full, 0)
-    target_full = torch.cat(target_full, 0)
 
-    if torch.cuda.is_available():
-        output_var = Variable(output_full).cuda()
-        target_var = Variable(target_full).cuda()
-    else:
-        output_var = Variable(output_full)
-        target_var = Variable(target_full)
+def score_model(model, loss_function, datagen):
+    batch_gen, steps = datagen
 
-    loss = loss_function(output_var, target_var).data.cpu().numpy()[0]
-    accuracy = accuracy_score(target_full.numpy(), np.argmax(output_full.numpy(), axis=1))
+    metrics = StreamingMetrics()
+    with torch.no_grad():
+        for batch_id, data in enumerate(batch_gen):
+            X, target = data
 
-    return loss, accuracy
+            if torch.cuda.is_available():
+                X, target = X.cuda(), target.cuda()
+            output = model(X)
+            metrics.update(loss_function(output, target), [output], [target])
+
+            if batch_id == steps:
+                break
+    return metrics.loss, metrics.accuracy
 
 
 def score_model_multi_output(model, loss_function, datagen):
-    """
-    Todo:
-    Refactor this ugglyness
-    """
     batch_gen, steps = datagen
 
-    total_loss, total_acc = [], []
-    for batch_id, data in enumerate(batch_gen):
-        X, targets = data
+    metrics = StreamingMetrics()
+    with torch.no_grad():
+        for batch_id, data in enumerate(batch_gen):
+            X, targets = data
 
-        targets = targets.transpose(0, 1)
+            targets = targets.transpose(0, 1)
 
-        if torch.cuda.is_available():
-            X, targets_var = Variable(X, volatile=True).cuda(), Variable(targets, volatile=True).cuda()
-        else:
-            X, targets_var = Variable(X, volatile=True), Variable(targets, volatile=True)
-        outputs = model(X)
-        batch_loss = loss_function(outputs, targets_var).data.cpu().numpy()[0]
-        batch_acc = torch_acc_score_multi_output(outputs, targets)
-
-        total_loss.append(batch_loss)
-        total_acc.append(batch_acc)
-
-        if batch_id == steps:
-            break
+            if torch.cuda.is_available():
+                X, targets = X.cuda(), targets.cuda()
+            outputs = model(X)
+            metrics.update(loss_function(outputs, targets), outputs, targets)
 
-    avg_loss = sum(total_loss) / steps
-    avg_acc = sum(total_acc) / steps
-    return avg_loss, avg_acc
+            if batch_id == steps:
+                break
+    return metrics.loss, metrics.accuracy
 
 
 def predict_on_batch_multi_output(model, datagen):
@@ -104,7 +108,7 @@ def predict_on_batch_multi_output(model, datagen):
 
 
 def torch_acc_score(output, target):
-    output = output.data.cpu().numpy()
+    output = output.data.float().cpu().numpy()
     y_true = target.numpy()
     y_pred = output.argmax(axis=1)
 
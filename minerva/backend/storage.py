@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.externals import joblib
+
+ARRAY_SUFFIX = '.npy'
+DATAFRAME_SUFFIX = '.columns'
+DICT_SUFFIX = '.dict'
+PICKLE_SUFFIX = '.pkl'
+SUFFIXES = [ARRAY_SUFFIX, DATAFRAME_SUFFIX, DICT_SUFFIX, PICKLE_SUFFIX]
+
+
+def save_output(output, filepath):
+    """
+    Saves step output so that it can be read back lazily.
+
+    Numpy arrays are written as raw .npy files and DataFrames as one .npy file per column,
+    both can be memory-mapped on load, DataFrames that would not come back exactly are pickled.
+    Dictionaries are saved entry by entry and everything else is pickled.
+    The suffix matching the format is appended to filepath.
+    Every format is written to a temporary path first and moved into place, so an interrupted save
+    never leaves an output that output_exists accepts.
+    """
+    _remove_output(filepath)
+    if isinstance(output, np.ndarray) and output.dtype != object:
+        _save_array(output, filepath + ARRAY_SUFFIX)
+    elif isinstance(output, pd.DataFrame) and _is_columnar(output):
+        _save_atomically(_save_dataframe, output, filepath + DATAFRAME_SUFFIX)
+    elif isinstance(output, dict) and all(isinstance(key, str) for key in output):
+        _save_atomically(_save_dict, output, filepath + DICT_SUFFIX)
+    else:
+        _save_atomically(joblib.dump, output, filepath + PICKLE_SUFFIX)
+
+
+def load_output(filepath, mmap_mode='c', columns=None):
+    """
+    Loads output saved with save_output.
+
+    mmap_mode is passed to np.load, the default 'c' maps arrays copy-on-write so they are read on first access
+    and can still be modified in memory. Use columns to read only a subset of DataFrame columns.
+    """
+    if os.path.exists(filepath + ARRAY_SUFFIX):
+        return np.load(filepath + ARRAY_SUFFIX, mmap_mode=mmap_mode)
+    elif os.path.exists(filepath + DATAFRAME_SUFFIX):
+        return _load_dataframe(filepath + DATAFRAME_SUFFIX, mmap_mode, columns)
+    elif os.path.exists(filepath + DICT_SUFFIX):
+        return _load_dict(filepath + DICT_SUFFIX, mmap_mode)
+    elif os.path.exists(filepath + PICKLE_SUFFIX):
+        output = joblib.load(filepath + PICKLE_SUFFIX)
+        if columns is not None and isinstance(output, pd.DataFrame):
+            return output[columns]
+        return output
+    elif os.path.isfile(filepath):
+        # outputs saved before the storage backend are joblib pickles without a suffix
+        return joblib.load(filepath)
+    else:
+        raise FileNotFoundError('No output saved in {}'.format(filepath))
+
+
+def output_exists(filepath):
+    return os.path.isfile(filepath) or any(os.path.exists(filepath + suffix) for suffix in SUFFIXES)
+
+
+def _remove_output(filepath):
+    if os.path.isfile(filepath):
+        os.remove(filepath)
+    for suffix in SUFFIXES:
+        _remove_path(filepath + suffix)
+
+
+def _save_atomically(save_function, output, path):
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    _remove_path(tmp_path)
+    try:
+        save_function(output, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        _remove_path(tmp_path)
+
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _save_array(array, filepath):
+    # np.save appends .npy to paths without it, so the temporary file keeps the suffix
+    tmp_filepath = '{}.tmp{}{}'.format(filepath[:-len(ARRAY_SUFFIX)], os.getpid(), ARRAY_SUFFIX)
+    np.save(tmp_filepath, np.ascontiguousarray(array))
+    os.replace(tmp_filepath, filepath)
+
+
+def _is_columnar(dataframe):
+    # extension dtypes (categorical etc.), MultiIndexes and duplicate column names do not survive the npy files
+    return (dataframe.columns.is_unique
+            and not isinstance(dataframe.columns, pd.MultiIndex)
+            and not isinstance(dataframe.index, pd.MultiIndex)
+            and all(isinstance(dtype, np.dtype) for dtype in list(dataframe.dtypes) + [dataframe.index.dtype]))
+
+
+def _save_dataframe(dataframe, dirpath):
+    os.makedirs(dirpath)
+    meta = {'columns': list(dataframe.columns),
+            'index_name': dataframe.index.name}
+    joblib.dump(meta, os.path.join(dirpath, 'meta.pkl'))
+    np.save(os.path.join(dirpath, 'index.npy'), dataframe.index.values, allow_pickle=True)
+    for i, column in enumerate(dataframe.columns):
+        np.save(os.path.join(dirpath, '{}.npy'.format(i)), dataframe[column].values, allow_pickle=True)
+
+
+def _load_dataframe(dirpath, mmap_mode, columns):
+    meta = joblib.load(os.path.join(dirpath, 'meta.pkl'))
+    if columns is None:
+        columns = meta['columns']
+
+    data = {}
+    for column in columns:
+        column_filepath = os.path.join(dirpath, '{}.npy'.format(meta['columns'].index(column)))
+        data[column] = _load_column(column_filepath, mmap_mode)
+    index = pd.Index(_load_column(os.path.join(dirpath, 'index.npy'), mmap_mode), name=meta['index_name'])
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def _load_column(filepath, mmap_mode):
+    try:
+        return np.load(filepath, mmap_mode=mmap_mode)
+    except ValueError:
+        # object columns (strings etc.) are pickled and cannot be memory-mapped
+        return np.load(filepath, allow_pickle=True)
+
+
+def _save_dict(output, dirpath):
+    os.makedirs(dirpath)
+    keys = list(output.keys())
+    joblib.dump(keys, os.path.join(dirpath, 'keys.pkl'))
+    for i, key in enumerate(keys):
+        save_output(output[key], os.path.join(dirpath, str(i)))
+
+
+def _load_dict(dirpath, mmap_mode):
+    keys = joblib.load(os.path.join(dirpath, 'keys.pkl'))
+    return {key: load_output(os.path.join(dirpath, str(i)), mmap_mode=mmap_mode) for i, key in enumerate(keys)}
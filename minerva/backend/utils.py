@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+import threading
 
 import pydot_ng as pydot
 from IPython.display import Image, display
@@ -29,9 +30,58 @@ def plot_graph(graph_info, filepath):
     graph.write(filepath, format='png')
 
 
+class ChannelRegistry:
+    """
+    Index of channel names of a Neptune experiment with a counter per base name.
+
+    Names are registered as soon as they are handed out, before the channel is created by the first send.
+    """
+
+    def __init__(self, channel_names=()):
+        self._last_ids = {}
+        self._lock = threading.Lock()
+        for channel_name in channel_names:
+            self._register(channel_name)
+
+    def get_unique_name(self, name, force_id=False):
+        with self._lock:
+            if name not in self._last_ids and not force_id:
+                self._last_ids[name] = 0
+                return name
+            last_id = self._last_ids.get(name, 0) + 1
+            self._last_ids[name] = last_id
+            return '{} {}'.format(name, last_id)
+
+    def _register(self, channel_name):
+        match = re.match(r'^(.*) (\d+)$', channel_name)
+        if match:
+            name, channel_id = match.group(1), int(match.group(2))
+        else:
+            name, channel_id = channel_name, 0
+        self._last_ids[name] = max(self._last_ids.get(name, 0), channel_id)
+
+
+_channel_registries = {}
+_channel_registries_lock = threading.Lock()
+
+
+def get_channel_registry(ctx):
+    """
+    Registry shared by every context of the same experiment in this process.
+    """
+    experiment = ctx._experiment
+    with _channel_registries_lock:
+        if id(experiment) not in _channel_registries:
+            channel_names = [channel.name for channel in experiment._channels]
+            _channel_registries[id(experiment)] = (experiment, ChannelRegistry(channel_names))
+        return _channel_registries[id(experiment)][1]
+
+
 def get_unique_channel_name(ctx, basename, *, suffix=None, force_id=False):
     """
     Get unique channel name for given Neptune context
+    Existing channels are matched on their exact base name, so e.g. 'loss' no longer counts 'batch_loss'
+    the way the former substring matching did.
     :param ctx: neptune context already containing channels
     :param basename: base name (ex. batch_loss)
     :param suffix: suffix to identify experiment step
@@ -41,14 +91,4 @@ def get_unique_channel_name(ctx, basename, *, suffix=None, force_id=False):
     name = basename
     if suffix:
         name += ' ({})'.format(suffix)
-    channels_with_name = [channel for channel in ctx._experiment._channels if name in channel.name]
-    if not channels_with_name and not force_id:
-        return name
-    else:
-        # obtain numeric suffix from channel name or '0' if filtered channels list is empty
-        channel_ids = [re.split('[^\d]', channel.name)[-1] for channel in channels_with_name] or ['0']
-        channel_ids = sorted([int(idx) if idx != '' else 0 for idx in channel_ids])
-        last_id = channel_ids[-1]
-
-    corrected_name = '{} {}'.format(name, last_id + 1)
-    return corrected_name
+    return get_channel_registry(ctx).get_unique_name(name, force_id=force_id)
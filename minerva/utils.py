@@ -10,9 +10,9 @@ from PIL import Image
 from imgaug import augmenters as iaa
 
 
-def setup_torch_multiprocessing():
+def setup_torch_multiprocessing(force=False):
     import torch.multiprocessing as mp
-    mp.set_start_method('spawn')
+    mp.set_start_method('spawn', force=force)
 
 
 def _welcome_message(fn):
@@ -188,6 +188,39 @@ def _decode_pil(img_path, *, scale: float = 1):
     return img
 
 
+# MCU (width, height) of the libjpeg-turbo subsampling modes 444, 422, 420, gray, 440 and 411
+_TURBO_MCU_SIZES = [(8, 8), (16, 8), (16, 16), (8, 8), (8, 16), (32, 8)]
+
+
+def _decode_turbo_roi(img_path, roi, *, scale: float = 1):
+    import turbojpeg
+    with Path(img_path).open('rb') as img_file:
+        jpeg_buf = img_file.read()
+    width, height, subsample, _ = _TURBO_DECODER.decode_header(jpeg_buf)
+    roi = get_aligned_roi(roi, (width, height), _TURBO_MCU_SIZES[subsample])
+    left, top, right, bottom = roi
+    if roi != (0, 0, width, height):
+        # lossless crop in the DCT domain, only the MCUs of the region are decoded afterwards
+        jpeg_buf = _TURBO_DECODER.crop(jpeg_buf, left, top, right - left, bottom - top)
+    img = _TURBO_DECODER.decode(jpeg_buf, scaling_factor=(1, int(1 / scale)), pixel_format=turbojpeg.TJPF_RGB)
+    return img, roi
+
+
+def get_aligned_roi(roi, img_size, block_size):
+    """
+    Expands roi (left, top, right, bottom) to the grid of block_size (width, height) and clips it to the image.
+    left and top stay on the grid, as lossless crops require, even when the image size is not a multiple of it.
+    """
+    width, height = img_size
+    block_width, block_height = block_size
+    left, top, right, bottom = roi
+    left = int(np.clip(np.floor(left / block_width), 0, (width - 1) // block_width) * block_width)
+    top = int(np.clip(np.floor(top / block_height), 0, (height - 1) // block_height) * block_height)
+    right = int(np.clip(np.ceil(right / block_width) * block_width, left + block_width, width))
+    bottom = int(np.clip(np.ceil(bottom / block_height) * block_height, top + block_height, height))
+    return left, top, right, bottom
+
+
 try:
     """
     install libturbojpeg. on Ubuntu 16.04 use:
@@ -197,26 +230,51 @@ try:
 
     _TURBO_DECODER = TurboJPEG(lib_path='/usr/lib/x86_64-linux-gnu/libturbojpeg.so.0')
     decode_jpeg = _decode_turbo
+    # releases without crop (before 1.4) have to decode the whole image, regions are not cheaper to decode
+    decode_jpeg_roi = _decode_turbo_roi if hasattr(_TURBO_DECODER, 'crop') else None
 except OSError:
     decode_jpeg = _decode_pil
+    decode_jpeg_roi = None
 except ImportError:
     decode_jpeg = _decode_pil
+    decode_jpeg_roi = None
 
 
-def decode_with_rescale(img_path, minimum_shape, *, max_scaling_factor=4):
-    img = Image.open(img_path)
-
+def get_rescale_factor(img_size, minimum_shape, *, max_scaling_factor=4):
     scale_factor = 0.5
     found = False
     while not found and scale_factor < max_scaling_factor:
         scale_factor = int(scale_factor * 2)
-        for img_dim, target_dim in zip(img.size, minimum_shape):
+        for img_dim, target_dim in zip(img_size, minimum_shape):
             found |= img_dim / scale_factor <= target_dim
+    return scale_factor
+
+
+def decode_with_rescale(img_path, minimum_shape, *, max_scaling_factor=4, img_size=None):
+    if img_size is None:
+        img_size = Image.open(img_path).size
+    scale_factor = get_rescale_factor(img_size, minimum_shape, max_scaling_factor=max_scaling_factor)
 
     scale = 1 / scale_factor
     return decode_jpeg(img_path, scale=scale)
 
 
+def is_roi_decoding_available():
+    return decode_jpeg_roi is not None
+
+
+def decode_roi_with_rescale(img_path, roi, minimum_shape, *, max_scaling_factor=4):
+    """
+    Decodes only the region roi (left, top, right, bottom) of the image, expanded to whole MCUs,
+    at the scale chosen for the region size. Returns the image and the decoded region in image coordinates.
+    Requires TurboJPEG with lossless crop, see is_roi_decoding_available.
+    """
+    left, top, right, bottom = roi
+    scale_factor = get_rescale_factor((right - left, bottom - top), minimum_shape,
+                                      max_scaling_factor=max_scaling_factor)
+    return decode_jpeg_roi(img_path, roi, scale=1 / scale_factor)
+
+
 SUBPROBLEM_INFERENCE = {'whales': {1: 'localization',
                                    2: 'alignment',
                                    3: 'classification',
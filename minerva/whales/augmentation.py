@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+
+def sample_affine_params(batch_size, *, rotate=(0, 0), scale=(1, 1), translate_px=(0, 0), fliplr=0., flipud=0.):
+    """
+    Samples augmentation parameters for the whole batch at once.
+    Ranges follow imgaug conventions: rotate in degrees, translate_px inclusive, flips as probabilities.
+    """
+    return {'rotate': np.random.uniform(rotate[0], rotate[1], size=batch_size),
+            'scale': np.random.uniform(scale[0], scale[1], size=batch_size),
+            'translate_x': np.random.randint(translate_px[0], translate_px[1] + 1, size=batch_size),
+            'translate_y': np.random.randint(translate_px[0], translate_px[1] + 1, size=batch_size),
+            'fliplr': np.random.rand(batch_size) < fliplr,
+            'flipud': np.random.rand(batch_size) < flipud,
+            }
+
+
+def get_identity_matrices(batch_size):
+    return np.tile(np.eye(3), (batch_size, 1, 1))
+
+
+def get_translation_matrices(translate_x, translate_y):
+    matrices = get_identity_matrices(len(translate_x))
+    matrices[:, 0, 2] = translate_x
+    matrices[:, 1, 2] = translate_y
+    return matrices
+
+
+def get_scale_matrices(src_shapes, dst_shape):
+    """
+    Matrices rescaling images of src_shapes (N, 2) given as (height, width) to a common dst_shape.
+    """
+    src_shapes = np.asarray(src_shapes, dtype=np.float64).reshape(-1, 2)
+    dst_height, dst_width = dst_shape
+    matrices = get_identity_matrices(src_shapes.shape[0])
+    matrices[:, 0, 0] = dst_width / src_shapes[:, 1]
+    matrices[:, 1, 1] = dst_height / src_shapes[:, 0]
+    return matrices
+
+
+def get_affine_matrices(params, shapes):
+    """
+    Rotation and scaling around the image center followed by translation, as imgaug Affine does.
+    """
+    shapes = np.asarray(shapes, dtype=np.float64).reshape(-1, 2)
+    center_y = (shapes[:, 0] - 1) / 2.
+    center_x = (shapes[:, 1] - 1) / 2.
+
+    angle = np.deg2rad(params['rotate'])
+    cos = params['scale'] * np.cos(angle)
+    sin = params['scale'] * np.sin(angle)
+
+    matrices = get_identity_matrices(shapes.shape[0])
+    matrices[:, 0, 0] = cos
+    matrices[:, 0, 1] = -sin
+    matrices[:, 1, 0] = sin
+    matrices[:, 1, 1] = cos
+    matrices[:, 0, 2] = center_x - cos * center_x + sin * center_y + params['translate_x']
+    matrices[:, 1, 2] = center_y - sin * center_x - cos * center_y + params['translate_y']
+    return matrices
+
+
+def get_flip_matrices(params, shapes):
+    shapes = np.asarray(shapes, dtype=np.float64).reshape(-1, 2)
+    matrices = get_identity_matrices(shapes.shape[0])
+    fliplr, flipud = params['fliplr'], params['flipud']
+    matrices[fliplr, 0, 0] = -1
+    matrices[fliplr, 0, 2] = shapes[fliplr, 1] - 1
+    matrices[flipud, 1, 1] = -1
+    matrices[flipud, 1, 2] = shapes[flipud, 0] - 1
+    return matrices
+
+
+def get_augmentation_matrices(params, shapes, flip_first=False):
+    affine = get_affine_matrices(params, shapes)
+    flips = get_flip_matrices(params, shapes)
+    if flip_first:
+        return affine @ flips
+    else:
+        return flips @ affine
+
+
+def warp_images(images, matrices, target_size, interpolation=cv2.INTER_LINEAR):
+    """
+    Resamples every image once with its own matrix straight to target_size.
+    """
+    height, width = target_size
+    warped = np.empty((len(images), height, width, images[0].shape[2]), dtype=np.uint8)
+    for i, (image, matrix) in enumerate(zip(images, matrices)):
+        warped[i] = cv2.warpAffine(np.asarray(image), matrix[:2], (width, height), flags=interpolation,
+                                   borderMode=cv2.BORDER_CONSTANT)
+    return warped
+
+
+def transform_keypoints(keypoints, matrices):
+    """
+    Applies matrices (N, 3, 3) to keypoints (N, K, 2) given as (x, y).
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    return np.einsum('nij,nkj->nki', matrices[:, :2, :2], keypoints) + matrices[:, np.newaxis, :2, 2]
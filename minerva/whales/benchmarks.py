@@ -0,0 +1,242 @@
+import os
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.optim as optim
+from PIL import Image
+
+from minerva.backend.models.pytorch.callbacks import CallbackList
+from minerva.backend.models.pytorch.export import compile_torchscript, export_onnx
+from minerva.backend.models.pytorch.models import MultiOutputModel
+from minerva.backend.models.pytorch.validation import score_model_multi_output
+from minerva.utils import get_logger
+from .config import SOLUTION_CONFIG, SHAPE_COLUMNS, LOCALIZER_COLUMNS, ALIGNER_COLUMNS, CLASSIFIER_COLUMNS
+from .preprocessing import DatasetLocalizer, DatasetAligner, DatasetClassifier, get_data_loader
+from .models import PyTorchLocalizer, PyTorchAligner, PyTorchClassifierMultiOutput, multi_output_cross_entropy, \
+    weight_regularization_localizer, weight_regularization_aligner, weight_regularization_classifier
+
+logger = get_logger()
+
+NETWORKS = {'localizer': (PyTorchLocalizer, weight_regularization_localizer),
+            'aligner': (PyTorchAligner, weight_regularization_aligner),
+            'classifier': (PyTorchClassifierMultiOutput, weight_regularization_classifier)}
+
+
+def benchmark_precision(network='localizer', steps=20, batch_size=8, valid_steps=5, seed=1234):
+    """
+    Trains the network on the same synthetic batches from the same initialization in fp32
+    and in bf16 autocast with channels-last tensors, then compares throughput and validation scores.
+    """
+    architecture_config = SOLUTION_CONFIG['{}_network'.format(network)]['architecture_config']
+    train_batches = get_synthetic_batches(network, steps, batch_size, seed)
+    valid_batches = get_synthetic_batches(network, valid_steps, batch_size, seed + 1)
+
+    results = []
+    for precision, channels_last in [('fp32', False), ('bf16', True)]:
+        model = build_model(network, architecture_config,
+                            {'epochs': 1, 'precision': precision, 'channels_last': channels_last})
+        # warm up kernels and allocators outside of the measurement, fit reinitializes the weights
+        model.fit((train_batches[:1], 1))
+
+        torch.manual_seed(seed)
+        start = time.time()
+        model.fit((train_batches, len(train_batches)))
+        train_time = time.time() - start
+
+        model.model.eval()
+        val_loss, val_acc = score_model_multi_output(model.model, model.loss_function,
+                                                     (valid_batches, len(valid_batches)))
+        results.append({'precision': precision,
+                        'channels_last': channels_last,
+                        'images_per_second': steps * batch_size / train_time,
+                        'val_loss': val_loss,
+                        'val_acc': val_acc})
+
+    results = pd.DataFrame(results)
+    results['speedup'] = results['images_per_second'] / results['images_per_second'].iloc[0]
+    results['val_loss_delta'] = results['val_loss'] - results['val_loss'].iloc[0]
+    logger.info('precision benchmark for {}:\n{}'.format(network, results.to_string(index=False)))
+    return results
+
+
+def benchmark_export(network='localizer', steps=20, batch_size=8, seed=1234):
+    """
+    Compares per image latency (batch of one) and throughput (batches of batch_size) on cpu of the eager
+    forward_target against the frozen TorchScript module, and against onnxruntime when it is installed.
+    """
+    architecture_config = SOLUTION_CONFIG['{}_network'.format(network)]['architecture_config']
+    input_shape = architecture_config['model_params']['input_shape']
+    network_class, _ = NETWORKS[network]
+
+    torch.manual_seed(seed)
+    model = network_class(**architecture_config['model_params']).eval()
+    runtimes = {'eager': model.forward_target,
+                'torchscript': compile_torchscript(model, input_shape)}
+    onnx_session = _get_onnx_session(model, input_shape)
+    if onnx_session is not None:
+        runtimes['onnxruntime'] = partial(_run_onnx_session, onnx_session)
+
+    generator = torch.Generator().manual_seed(seed)
+    single_images = [torch.randn(1, *input_shape, generator=generator) for _ in range(steps)]
+    batches = [torch.randn(batch_size, *input_shape, generator=generator) for _ in range(steps)]
+
+    results = []
+    with torch.no_grad():
+        reference_outputs = model.forward_target(batches[0])
+        for runtime, forward in runtimes.items():
+            # warm up, the first calls of a TorchScript module run the profiling executor
+            for _ in range(3):
+                forward(batches[0])
+                forward(single_images[0])
+
+            latencies = []
+            for X in single_images:
+                start = time.time()
+                forward(X)
+                latencies.append(time.time() - start)
+
+            start = time.time()
+            for X in batches:
+                forward(X)
+            batches_time = time.time() - start
+
+            max_abs_diff = max(float((torch.as_tensor(output) - reference_output).abs().max())
+                               for output, reference_output in zip(forward(batches[0]), reference_outputs))
+            results.append({'runtime': runtime,
+                            'latency_ms': 1000 * np.median(latencies),
+                            'images_per_second': steps * batch_size / batches_time,
+                            'max_abs_diff': max_abs_diff})
+
+    results = pd.DataFrame(results)
+    results['speedup'] = results['images_per_second'] / results['images_per_second'].iloc[0]
+    logger.info('export benchmark for {} on {} threads:\n{}'.format(network, torch.get_num_threads(),
+                                                                    results.to_string(index=False)))
+    return results
+
+
+def _get_onnx_session(model, input_shape):
+    try:
+        import onnxruntime
+    except ImportError:
+        logger.info('onnxruntime is not installed, skipping the onnx runtime')
+        return None
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = os.path.join(dirpath, 'model.onnx')
+        export_onnx(model, input_shape, filepath)
+        return onnxruntime.InferenceSession(filepath, providers=['CPUExecutionProvider'])
+
+
+def _run_onnx_session(session, X):
+    return session.run(None, {'input': X.numpy()})
+
+
+def benchmark_loader(network='aligner', steps=20, epochs=2, images_nr=64, img_size=(1536, 1024), seed=1234):
+    """
+    Iterates the training datagen of the network over synthetic jpegs with the process and the thread backend
+    for a few epochs, and compares the time to the first batch of every epoch and the throughput.
+    Run from main.py, so that the process backend uses the spawn start method of the solution.
+    """
+    dataset_params = dict(SOLUTION_CONFIG['{}_dataloader'.format(network)]['dataset_params']['train'])
+    loader_params = dict(SOLUTION_CONFIG['{}_dataloader'.format(network)]['loader_params']['train'])
+    loader_params['shard'] = False
+
+    results = []
+    with tempfile.TemporaryDirectory() as img_dirpath:
+        dataset_params.update({'img_dirpath': img_dirpath, 'image_cache_dirpath': None})
+        dataset = build_dataset(network, dataset_params, steps * loader_params['batch_size'], images_nr, img_size,
+                                seed)
+        for backend in ['process', 'thread']:
+            datagen = get_data_loader(dataset, dict(loader_params, backend=backend))
+            first_batch_times, images_nr_loaded = [], 0
+            start = time.time()
+            for _ in range(epochs):
+                epoch_start = time.time()
+                for batch_id, (X, y) in enumerate(datagen):
+                    if batch_id == 0:
+                        first_batch_times.append(time.time() - epoch_start)
+                    images_nr_loaded += X.size(0)
+                    if batch_id + 1 == steps:
+                        break
+            total_time = time.time() - start
+            results.append({'backend': backend,
+                            'first_batch_s': first_batch_times[0],
+                            'next_epochs_first_batch_s': np.mean(first_batch_times[1:]) if epochs > 1 else np.nan,
+                            'images_per_second': images_nr_loaded / total_time})
+
+    results = pd.DataFrame(results)
+    results['speedup'] = results['images_per_second'] / results['images_per_second'].iloc[0]
+    logger.info('loader benchmark for {} with {} workers:\n{}'.format(network, loader_params['num_workers'],
+                                                                      results.to_string(index=False)))
+    return results
+
+
+def build_dataset(network, dataset_params, samples_nr, images_nr, img_size, seed):
+    """
+    Dataset over images_nr random smooth jpegs of img_size (width, height) written to dataset_params['img_dirpath'],
+    with samples_nr samples drawn from them and random targets.
+    """
+    random_state = np.random.RandomState(seed)
+    width, height = img_size
+    img_names = []
+    for i in range(images_nr):
+        img = random_state.randint(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        img_name = 'w_{}.jpg'.format(i)
+        Image.fromarray(img).resize((width, height), Image.BILINEAR).save(
+            os.path.join(dataset_params['img_dirpath'], img_name), quality=90)
+        img_names.append(img_name)
+
+    X = pd.DataFrame({'Image': random_state.choice(img_names, samples_nr)})
+    X[SHAPE_COLUMNS[0]], X[SHAPE_COLUMNS[1]] = height, width
+    # keypoints and crops inside the middle of the image, categorical targets small integers
+    left = random_state.uniform(0.2, 0.4, samples_nr) * width
+    top = random_state.uniform(0.2, 0.4, samples_nr) * height
+    right = left + random_state.uniform(0.2, 0.4, samples_nr) * width
+    bottom = top + random_state.uniform(0.2, 0.4, samples_nr) * height
+    coordinates = np.stack([left, top, right, bottom], axis=1)
+    y = pd.DataFrame(np.hstack([coordinates, random_state.randint(0, 3, (samples_nr, 2))]),
+                     columns=ALIGNER_COLUMNS)
+
+    if network == 'localizer':
+        y.columns = LOCALIZER_COLUMNS + ['callosity', 'whaleID']
+        return DatasetLocalizer(X, y[LOCALIZER_COLUMNS], **dataset_params)
+    elif network == 'aligner':
+        return DatasetAligner(X, y[ALIGNER_COLUMNS], coordinates, **dataset_params)
+    else:
+        return DatasetClassifier(X, y[CLASSIFIER_COLUMNS].astype(np.int64), coordinates, **dataset_params)
+
+
+def build_model(network, architecture_config, training_config):
+    network_class, weight_regularization = NETWORKS[network]
+    model = MultiOutputModel(architecture_config, training_config, callbacks_config={})
+    model.model = network_class(**architecture_config['model_params'])
+    model.optimizer = optim.SGD(weight_regularization(model.model, **architecture_config['regularizer_params']),
+                                **architecture_config['optimizer_params'])
+    model.loss_function = multi_output_cross_entropy
+    model.callbacks = CallbackList()
+    return model
+
+
+def get_synthetic_batches(network, steps, batch_size, seed):
+    """
+    Random normalized images with random targets for every output of the network.
+    """
+    architecture_config = SOLUTION_CONFIG['{}_network'.format(network)]['architecture_config']
+    input_shape = architecture_config['model_params']['input_shape']
+    network_class, _ = NETWORKS[network]
+
+    generator = torch.Generator().manual_seed(seed)
+    model = network_class(**architecture_config['model_params']).eval()
+    with torch.no_grad():
+        classes = [output.size(1) for output in model(torch.zeros(1, *input_shape))]
+
+    batches = []
+    for _ in range(steps):
+        X = torch.randn(batch_size, *input_shape, generator=generator)
+        targets = torch.stack([torch.randint(0, classes_nr, (batch_size,), generator=generator)
+                               for classes_nr in classes], dim=1)
+        batches.append((X, targets))
+    return batches
@@ -38,11 +38,33 @@ GLOBAL_CONFIG = {'exp_name': exp_name,
                  'batch_size_train': 32,
                  'batch_size_inference': 32,
                  'localizer_bins': 128,
-                 'aligner_bins': 128
+                 'aligner_bins': 128,
+                 'image_cache_dirpath': os.path.join('output', 'image_cache'),
+                 'step_workers': 1,
+                 'cache_step_outputs': False,
+                 'batch_augmentation': True,
+                 'roi_decoding': False,
+                 'echo_factor': 1,
+                 'echo_buffer_size': 64,
+                 'pin_memory': True,
+                 'persistent_workers': True,
+                 'prefetch_depth': 2,
+                 'loader_backend': 'process',
+                 'tensor_cache': True,
+                 'tensor_cache_max_gb': 4,
+                 'tensor_cache_dirpath': os.path.join('output', 'tensor_cache'),
+                 'precision': 'fp32',
+                 'channels_last': False,
+                 'resume_training': True,
+                 'inference_runtime': 'eager',
+                 'export_onnx': False,
+                 'accumulation_steps': 1
                  }
 
 SOLUTION_CONFIG = {
-    'global': {'cache_dirpath': GLOBAL_CONFIG['exp_root']},
+    'global': {'cache_dirpath': GLOBAL_CONFIG['exp_root'],
+               'max_workers': GLOBAL_CONFIG['step_workers'],
+               'cache_outputs': GLOBAL_CONFIG['cache_step_outputs']},
     'trainer': {'metadata': os.path.join(data_dir, 'metadata.csv'),
                 'train_csv': os.path.join(data_dir, 'annotations/train.csv'),
                 'bbox_train_json': os.path.join(data_dir, 'annotations/slot.json'),
@@ -54,21 +76,44 @@ SOLUTION_CONFIG = {
     'localizer_dataloader': {'dataset_params': {'train': {'img_dirpath': os.path.join(data_dir, 'imgs'),
                                                           'augmentation': True,
                                                           'target_size': GLOBAL_CONFIG['img_H-W'],
-                                                          'bins_nr': GLOBAL_CONFIG['localizer_bins']
+                                                          'bins_nr': GLOBAL_CONFIG['localizer_bins'],
+                                                          'image_cache_dirpath': GLOBAL_CONFIG['image_cache_dirpath'],
+                                                          'image_cache_workers': GLOBAL_CONFIG['num_workers'],
+                                                          'batch_augmentation': GLOBAL_CONFIG['batch_augmentation'],
+                                                          'echo_factor': GLOBAL_CONFIG['echo_factor'],
+                                                          'echo_buffer_size': GLOBAL_CONFIG['echo_buffer_size']
                                                           },
                                                 'inference': {'img_dirpath': os.path.join(data_dir, 'imgs'),
                                                               'augmentation': False,
                                                               'target_size': GLOBAL_CONFIG['img_H-W'],
-                                                              'bins_nr': GLOBAL_CONFIG['localizer_bins']
+                                                              'bins_nr': GLOBAL_CONFIG['localizer_bins'],
+                                                              'image_cache_dirpath': GLOBAL_CONFIG[
+                                                                  'image_cache_dirpath'],
+                                                              'image_cache_workers': GLOBAL_CONFIG['num_workers'],
+                                                              'batch_augmentation': GLOBAL_CONFIG['batch_augmentation']
                                                               },
                                                 },
                              'loader_params': {'train': {'batch_size': GLOBAL_CONFIG['batch_size_train'],
+                                                         'backend': GLOBAL_CONFIG['loader_backend'],
                                                          'shuffle': True,
-                                                         'num_workers': GLOBAL_CONFIG['num_workers']
+                                                         'shard': True,
+                                                         'num_workers': GLOBAL_CONFIG['num_workers'],
+                                                         'pin_memory': GLOBAL_CONFIG['pin_memory'],
+                                                         'persistent_workers': GLOBAL_CONFIG['persistent_workers'],
+                                                         'prefetch_depth': GLOBAL_CONFIG['prefetch_depth']
                                                          },
                                                'inference': {'batch_size': GLOBAL_CONFIG['batch_size_inference'],
+                                                             'backend': GLOBAL_CONFIG['loader_backend'],
                                                              'shuffle': False,
-                                                             'num_workers': GLOBAL_CONFIG['num_workers']
+                                                             'num_workers': GLOBAL_CONFIG['num_workers'],
+                                                             'pin_memory': GLOBAL_CONFIG['pin_memory'],
+                                                             'persistent_workers': GLOBAL_CONFIG['persistent_workers'],
+                                                             'prefetch_depth': GLOBAL_CONFIG['prefetch_depth'],
+                                                             'tensor_cache': GLOBAL_CONFIG['tensor_cache'],
+                                                             'tensor_cache_max_gb': GLOBAL_CONFIG[
+                                                                 'tensor_cache_max_gb'],
+                                                             'tensor_cache_dirpath': GLOBAL_CONFIG[
+                                                                 'tensor_cache_dirpath']
                                                              },
                                                },
                              },
@@ -88,8 +133,16 @@ SOLUTION_CONFIG = {
                                                                               'std_linear': 0.001
                                                                               },
                                                                    },
+                                                  'inference_params': {'hflip_outputs': None,
+                                                                       'runtime': GLOBAL_CONFIG['inference_runtime'],
+                                                                       'onnx': GLOBAL_CONFIG['export_onnx'],
+                                                                       'input_shape': GLOBAL_CONFIG['img_C-H-W']},
                                                   },
-                          'training_config': {'epochs': 150},
+                          'training_config': {'epochs': 150,
+                                              'precision': GLOBAL_CONFIG['precision'],
+                                              'channels_last': GLOBAL_CONFIG['channels_last'],
+                                              'accumulation_steps': GLOBAL_CONFIG['accumulation_steps'],
+                                              'resume': GLOBAL_CONFIG['resume_training']},
                           'callbacks_config': {'model_checkpoint': {
                               'checkpoint_dir': os.path.join(exp_root, 'checkpoints', 'localizer_network'),
                               'epoch_every': 1},
@@ -114,21 +167,45 @@ SOLUTION_CONFIG = {
     'aligner_dataloader': {'dataset_params': {'train': {'img_dirpath': os.path.join(data_dir, 'imgs'),
                                                         'augmentation': True,
                                                         'target_size': GLOBAL_CONFIG['img_H-W'],
-                                                        'bins_nr': GLOBAL_CONFIG['aligner_bins']
+                                                        'bins_nr': GLOBAL_CONFIG['aligner_bins'],
+                                                        'fused_transform': False,
+                                                        'image_cache_dirpath': GLOBAL_CONFIG['image_cache_dirpath'],
+                                                        'image_cache_workers': GLOBAL_CONFIG['num_workers'],
+                                                        'batch_augmentation': GLOBAL_CONFIG['batch_augmentation'],
+                                                        'echo_factor': GLOBAL_CONFIG['echo_factor'],
+                                                        'echo_buffer_size': GLOBAL_CONFIG['echo_buffer_size'],
+                                                        'roi_decoding': GLOBAL_CONFIG['roi_decoding']
                                                         },
                                               'inference': {'img_dirpath': os.path.join(data_dir, 'imgs'),
                                                             'augmentation': False,
                                                             'target_size': GLOBAL_CONFIG['img_H-W'],
-                                                            'bins_nr': GLOBAL_CONFIG['aligner_bins']
+                                                            'bins_nr': GLOBAL_CONFIG['aligner_bins'],
+                                                            'fused_transform': False,
+                                                            'image_cache_dirpath': GLOBAL_CONFIG['image_cache_dirpath'],
+                                                            'image_cache_workers': GLOBAL_CONFIG['num_workers'],
+                                                            'batch_augmentation': GLOBAL_CONFIG['batch_augmentation'],
+                                                            'roi_decoding': GLOBAL_CONFIG['roi_decoding']
                                                             },
                                               },
                            'loader_params': {'train': {'batch_size': GLOBAL_CONFIG['batch_size_train'],
+                                                       'backend': GLOBAL_CONFIG['loader_backend'],
                                                        'shuffle': True,
-                                                       'num_workers': GLOBAL_CONFIG['num_workers']
+                                                       'shard': True,
+                                                       'num_workers': GLOBAL_CONFIG['num_workers'],
+                                                       'pin_memory': GLOBAL_CONFIG['pin_memory'],
+                                                       'persistent_workers': GLOBAL_CONFIG['persistent_workers'],
+                                                       'prefetch_depth': GLOBAL_CONFIG['prefetch_depth']
                                                        },
                                              'inference': {'batch_size': GLOBAL_CONFIG['batch_size_inference'],
+                                                           'backend': GLOBAL_CONFIG['loader_backend'],
                                                            'shuffle': False,
-                                                           'num_workers': GLOBAL_CONFIG['num_workers']
+                                                           'num_workers': GLOBAL_CONFIG['num_workers'],
+                                                           'pin_memory': GLOBAL_CONFIG['pin_memory'],
+                                                           'persistent_workers': GLOBAL_CONFIG['persistent_workers'],
+                                                           'prefetch_depth': GLOBAL_CONFIG['prefetch_depth'],
+                                                           'tensor_cache': GLOBAL_CONFIG['tensor_cache'],
+                                                           'tensor_cache_max_gb': GLOBAL_CONFIG['tensor_cache_max_gb'],
+                                                           'tensor_cache_dirpath': GLOBAL_CONFIG['tensor_cache_dirpath']
                                                            },
                                              },
                            },
@@ -152,8 +229,16 @@ SOLUTION_CONFIG = {
                                                                             'std_linear': 0.001
                                                                             },
                                                                  },
+                                                'inference_params': {'hflip_outputs': None,
+                                                                     'runtime': GLOBAL_CONFIG['inference_runtime'],
+                                                                     'onnx': GLOBAL_CONFIG['export_onnx'],
+                                                                     'input_shape': GLOBAL_CONFIG['img_C-H-W']},
                                                 },
-                        'training_config': {'epochs': 120},
+                        'training_config': {'epochs': 120,
+                                            'precision': GLOBAL_CONFIG['precision'],
+                                            'channels_last': GLOBAL_CONFIG['channels_last'],
+                                            'accumulation_steps': GLOBAL_CONFIG['accumulation_steps'],
+                                            'resume': GLOBAL_CONFIG['resume_training']},
                         'callbacks_config': {'model_checkpoint': {
                             'checkpoint_dir': os.path.join(exp_root, 'checkpoints', 'aligner_network'),
                             'epoch_every': 1
@@ -176,21 +261,47 @@ SOLUTION_CONFIG = {
     'classifier_dataloader': {'dataset_params': {'train': {'img_dirpath': os.path.join(data_dir, 'imgs'),
                                                            'augmentation': True,
                                                            'target_size': GLOBAL_CONFIG['img_H-W'],
-                                                           'num_classes': GLOBAL_CONFIG['num_classes']
+                                                           'num_classes': GLOBAL_CONFIG['num_classes'],
+                                                           'image_cache_dirpath': GLOBAL_CONFIG['image_cache_dirpath'],
+                                                           'image_cache_workers': GLOBAL_CONFIG['num_workers'],
+                                                           'batch_augmentation': GLOBAL_CONFIG['batch_augmentation'],
+                                                           'echo_factor': GLOBAL_CONFIG['echo_factor'],
+                                                           'echo_buffer_size': GLOBAL_CONFIG['echo_buffer_size'],
+                                                           'roi_decoding': GLOBAL_CONFIG['roi_decoding']
                                                            },
                                                  'inference': {'img_dirpath': os.path.join(data_dir, 'imgs'),
                                                                'augmentation': False,
                                                                'target_size': GLOBAL_CONFIG['img_H-W'],
-                                                               'num_classes': GLOBAL_CONFIG['num_classes']
+                                                               'num_classes': GLOBAL_CONFIG['num_classes'],
+                                                               'image_cache_dirpath': GLOBAL_CONFIG[
+                                                                   'image_cache_dirpath'],
+                                                               'image_cache_workers': GLOBAL_CONFIG['num_workers'],
+                                                               'batch_augmentation': GLOBAL_CONFIG[
+                                                                   'batch_augmentation'],
+                                                               'roi_decoding': GLOBAL_CONFIG['roi_decoding']
                                                                },
                                                  },
                               'loader_params': {'train': {'batch_size': GLOBAL_CONFIG['batch_size_train'],
+                                                          'backend': GLOBAL_CONFIG['loader_backend'],
                                                           'shuffle': True,
-                                                          'num_workers': GLOBAL_CONFIG['num_workers']
+                                                          'shard': True,
+                                                          'num_workers': GLOBAL_CONFIG['num_workers'],
+                                                          'pin_memory': GLOBAL_CONFIG['pin_memory'],
+                                                          'persistent_workers': GLOBAL_CONFIG['persistent_workers'],
+                                                          'prefetch_depth': GLOBAL_CONFIG['prefetch_depth']
                                                           },
                                                 'inference': {'batch_size': GLOBAL_CONFIG['batch_size_inference'],
+                                                              'backend': GLOBAL_CONFIG['loader_backend'],
                                                               'shuffle': False,
-                                                              'num_workers': GLOBAL_CONFIG['num_workers']
+                                                              'num_workers': GLOBAL_CONFIG['num_workers'],
+                                                              'pin_memory': GLOBAL_CONFIG['pin_memory'],
+                                                              'persistent_workers': GLOBAL_CONFIG['persistent_workers'],
+                                                              'prefetch_depth': GLOBAL_CONFIG['prefetch_depth'],
+                                                              'tensor_cache': GLOBAL_CONFIG['tensor_cache'],
+                                                              'tensor_cache_max_gb': GLOBAL_CONFIG[
+                                                                  'tensor_cache_max_gb'],
+                                                              'tensor_cache_dirpath': GLOBAL_CONFIG[
+                                                                  'tensor_cache_dirpath']
                                                               },
                                                 },
                               },
@@ -214,8 +325,16 @@ SOLUTION_CONFIG = {
                                                                         'momentum': 0.9,
                                                                         'nesterov': True
                                                                         },
+                                                   'inference_params': {'hflip_outputs': None,
+                                                                        'runtime': GLOBAL_CONFIG['inference_runtime'],
+                                                                        'onnx': GLOBAL_CONFIG['export_onnx'],
+                                                                        'input_shape': GLOBAL_CONFIG['img_C-H-W']},
                                                    },
-                           'training_config': {'epochs': 250},
+                           'training_config': {'epochs': 250,
+                                               'precision': GLOBAL_CONFIG['precision'],
+                                               'channels_last': GLOBAL_CONFIG['channels_last'],
+                                               'accumulation_steps': GLOBAL_CONFIG['accumulation_steps'],
+                                               'resume': GLOBAL_CONFIG['resume_training']},
                            'callbacks_config': {'model_checkpoint': {
                                'checkpoint_dir': os.path.join(exp_root, 'checkpoints', 'classifier_network'),
                                'epoch_every': 5,
@@ -0,0 +1,110 @@
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+from sklearn.externals import joblib
+
+from minerva.utils import get_logger, get_rescale_factor, decode_jpeg
+
+logger = get_logger()
+
+
+class ImageCache:
+    """
+    Persistent cache of decoded and rescaled uint8 images.
+
+    All images of a dataset are stored back to back in a single raw file which is memory-mapped on read,
+    so getting an image is a zero-copy slice. The offset index is keyed by (image name, scale factor).
+    """
+
+    def __init__(self, cache_dirpath, name):
+        self.cache_dirpath = cache_dirpath
+        self.name = name
+        self.data_filepath = os.path.join(cache_dirpath, '{}.bin'.format(name))
+        self.index_filepath = os.path.join(cache_dirpath, '{}_index.pkl'.format(name))
+
+        self._index = None
+        self._data = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def is_built(self):
+        return os.path.exists(self.index_filepath) and os.path.exists(self.data_filepath)
+
+    def build(self, img_names, img_dirpath, minimum_shape, *, max_scaling_factor=4, img_sizes=None, n_jobs=1,
+              chunk_size=64):
+        logger.info('building image cache {} for {} images...'.format(self.name, len(img_names)))
+        os.makedirs(self.cache_dirpath, exist_ok=True)
+
+        if img_sizes is None:
+            img_sizes = [None] * len(img_names)
+
+        index = {}
+        offset = 0
+        # concurrent builds of the same cache (e.g. one per distributed rank) never share a temporary file
+        tmp_filepath = '{}.tmp{}'.format(self.data_filepath, os.getpid())
+        with joblib.Parallel(n_jobs=n_jobs) as parallel, open(tmp_filepath, 'wb') as data_file:
+            for chunk_start in range(0, len(img_names), chunk_size):
+                chunk = img_names[chunk_start:chunk_start + chunk_size]
+                chunk_sizes = img_sizes[chunk_start:chunk_start + chunk_size]
+                decoded = parallel(joblib.delayed(_decode_image)(os.path.join(img_dirpath, img_name),
+                                                                 img_size,
+                                                                 minimum_shape,
+                                                                 max_scaling_factor)
+                                   for img_name, img_size in zip(chunk, chunk_sizes))
+                for img_name, (scale_factor, img) in zip(chunk, decoded):
+                    data_file.write(img.tobytes())
+                    index[(img_name, scale_factor)] = (offset, img.shape)
+                    offset += img.nbytes
+
+        os.replace(tmp_filepath, self.data_filepath)
+        tmp_index_filepath = '{}.tmp{}'.format(self.index_filepath, os.getpid())
+        joblib.dump(index, tmp_index_filepath)
+        os.replace(tmp_index_filepath, self.index_filepath)
+        logger.info('image cache {} saved to {}'.format(self.name, self.data_filepath))
+        return self
+
+    def get(self, img_name, scale_factor):
+        if self._index is None:
+            self._open()
+
+        try:
+            offset, shape = self._index[(img_name, scale_factor)]
+        except KeyError:
+            return None
+        return self._data[offset:offset + int(np.prod(shape))].reshape(shape)
+
+    def _open(self):
+        # datasets are read from several threads by ThreadPoolDataLoader
+        with self._open_lock:
+            if self._index is not None:
+                return
+            if os.path.getsize(self.data_filepath) > 0:
+                self._data = np.memmap(self.data_filepath, dtype=np.uint8, mode='r')
+            # published last, a reader seeing the index also sees the data
+            self._index = joblib.load(self.index_filepath)
+
+    def __getstate__(self):
+        # memory maps are reopened lazily in every DataLoader worker instead of being pickled
+        state = self.__dict__.copy()
+        state['_index'] = None
+        state['_data'] = None
+        del state['_open_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open_lock = threading.Lock()
+
+
+def get_image_cache_name(img_names, minimum_shape, max_scaling_factor):
+    return 'images_{}'.format(joblib.hash((sorted(img_names), list(minimum_shape), max_scaling_factor)))
+
+
+def _decode_image(img_path, img_size, minimum_shape, max_scaling_factor):
+    if img_size is None:
+        img_size = Image.open(img_path).size
+    scale_factor = get_rescale_factor(img_size, minimum_shape, max_scaling_factor=max_scaling_factor)
+    img = np.ascontiguousarray(decode_jpeg(img_path, scale=1 / scale_factor), dtype=np.uint8)
+    return scale_factor, img
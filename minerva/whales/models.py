@@ -8,6 +8,7 @@ from torch.autograd import Variable
 from minerva.backend.models.pytorch.callbacks import CallbackList, TrainingMonitor, ValidationMonitor, ModelCheckpoint, \
     NeptuneMonitor, NeptuneMonitorLocalizer, ExperimentTiming, NeptuneMonitorKeypoints, ExponentialLRScheduler, \
     PlotBoundingBoxPredictions
+from minerva.backend.distributed import is_main_process
 from minerva.backend.models.pytorch.models import MultiOutputModel
 
 
@@ -22,8 +23,8 @@ class SimpleLocalizer(MultiOutputModel):
         self.callbacks = build_callbacks_localizer(self.callbacks_config)
 
     def transform(self, datagen, validation_datagen=None):
-        prediction_coordinates = self._transform(datagen, validation_datagen)
-        prediction_coordinates_ = np.squeeze(np.argmax(prediction_coordinates, axis=2))
+        prediction_coordinates = self._transform(datagen, validation_datagen, reduction='argmax')
+        prediction_coordinates_ = np.squeeze(prediction_coordinates)
         return {'prediction_coordinates': prediction_coordinates_}
 
 
@@ -38,8 +39,8 @@ class SimpleAligner(MultiOutputModel):
         self.callbacks = build_callbacks_aligner(self.callbacks_config)
 
     def transform(self, datagen, validation_datagen=None):
-        prediction_coordinates = self._transform(datagen, validation_datagen)
-        prediction_coordinates_ = np.squeeze(np.argmax(prediction_coordinates, axis=2))
+        prediction_coordinates = self._transform(datagen, validation_datagen, reduction='argmax')
+        prediction_coordinates_ = np.squeeze(prediction_coordinates)
         return {'prediction_coordinates': prediction_coordinates_}
 
 
@@ -55,7 +56,7 @@ class SimpleClassifier(MultiOutputModel):
 
     def transform(self, datagen, validation_datagen=None):
         prediction_proba = self._transform(datagen, validation_datagen)
-        return {'prediction_probability': np.array(prediction_proba)}
+        return {'prediction_probability': prediction_proba}
 
 
 class PyTorchLocalizer(nn.Module):
@@ -121,7 +122,7 @@ class PyTorchLocalizer(nn.Module):
 
     def forward(self, x):
         features = self.features(x)
-        flat_features = features.view(-1, self.flat_features)
+        flat_features = features.reshape(-1, self.flat_features)
         pred_p1x = self.point1_x(flat_features)
         pred_p1y = self.point1_y(flat_features)
         pred_p2x = self.point2_x(flat_features)
@@ -222,7 +223,7 @@ class PyTorchAligner(nn.Module):
 
     def forward(self, x):
         features = self.features(x)
-        flat_features = features.view(-1, self.flat_features)
+        flat_features = features.reshape(-1, self.flat_features)
         pred_p1x = self.point1_x(flat_features)
         pred_p1y = self.point1_y(flat_features)
         pred_p2x = self.point2_x(flat_features)
@@ -234,7 +235,7 @@ class PyTorchAligner(nn.Module):
 
     def forward_target(self, x):
         features = self.features(x)
-        flat_features = features.view(-1, self.flat_features)
+        flat_features = features.reshape(-1, self.flat_features)
         pred_p1x = self.point1_x(flat_features)
         pred_p1y = self.point1_y(flat_features)
         pred_p2x = self.point2_x(flat_features)
@@ -309,7 +310,7 @@ class PyTorchClassifier(nn.Module):
 
     def forward(self, x):
         features = self.features(x)
-        flat_features = features.view(-1, self.flat_features)
+        flat_features = features.reshape(-1, self.flat_features)
         out = self.classifier(flat_features)
         return out
 
@@ -388,14 +389,14 @@ class PyTorchClassifierMultiOutput(nn.Module):
 
     def forward(self, x):
         features = self.features(x)
-        flat_features = features.view(-1, self.flat_features)
+        flat_features = features.reshape(-1, self.flat_features)
         pred_whale_id = self.whale_id(flat_features)
         pred_callosity = self.callosity(flat_features)
         return [pred_whale_id, pred_callosity]
 
     def forward_target(self, x):
         features = self.features(x)
-        flat_features = features.view(-1, self.flat_features)
+        flat_features = features.reshape(-1, self.flat_features)
         pred_whale_id = self.whale_id(flat_features)
         return [pred_whale_id]
 
@@ -456,9 +457,12 @@ def weight_regularization_classifier(model, regularize, weight_decay_conv2d, wei
 
 
 def build_callbacks_localizer(callbacks_config):
+    lr_scheduler = ExponentialLRScheduler(**callbacks_config['lr_scheduler'])
+    if not is_main_process():
+        return CallbackList(callbacks=[lr_scheduler])
+
     experiment_timing = ExperimentTiming()
     model_checkpoints = ModelCheckpoint(**callbacks_config['model_checkpoint'])
-    lr_scheduler = ExponentialLRScheduler(**callbacks_config['lr_scheduler'])
     training_monitor = TrainingMonitor(**callbacks_config['training_monitor'])
     validation_monitor = ValidationMonitor(**callbacks_config['validation_monitor'])
     neptune_monitor = NeptuneMonitorLocalizer(name='localizer', **callbacks_config['neptune_monitor'])
@@ -470,9 +474,12 @@ def build_callbacks_localizer(callbacks_config):
 
 
 def build_callbacks_aligner(callbacks_config):
+    lr_scheduler = ExponentialLRScheduler(**callbacks_config['lr_scheduler'])
+    if not is_main_process():
+        return CallbackList(callbacks=[lr_scheduler])
+
     experiment_timing = ExperimentTiming()
     model_checkpoints = ModelCheckpoint(**callbacks_config['model_checkpoint'])
-    lr_scheduler = ExponentialLRScheduler(**callbacks_config['lr_scheduler'])
     training_monitor = TrainingMonitor(**callbacks_config['training_monitor'])
     validation_monitor = ValidationMonitor(**callbacks_config['validation_monitor'])
     neptune_monitor = NeptuneMonitorKeypoints(name='aligner', **callbacks_config['neptune_monitor'])
@@ -483,9 +490,12 @@ def build_callbacks_aligner(callbacks_config):
 
 
 def build_callbacks_classifier(callbacks_config):
+    lr_scheduler = ExponentialLRScheduler(**callbacks_config['lr_scheduler'])
+    if not is_main_process():
+        return CallbackList(callbacks=[lr_scheduler])
+
     experiment_timing = ExperimentTiming()
     model_checkpoints = ModelCheckpoint(**callbacks_config['model_checkpoint'])
-    lr_scheduler = ExponentialLRScheduler(**callbacks_config['lr_scheduler'])
     validation_monitor = ValidationMonitor(**callbacks_config['validation_monitor'])
     training_monitor = TrainingMonitor(**callbacks_config['training_monitor'])
     neptune_monitor = NeptuneMonitor(name='classifier')
@@ -14,7 +14,8 @@ def localization_pipeline(config):
     network = SubstitutableStep(name='localizer_network',
                                 transformer=SimpleLocalizer(**config['localizer_network']),
                                 input_steps=[dataloader],
-                                cache_dirpath=config['global']['cache_dirpath'])
+                                cache_dirpath=config['global']['cache_dirpath'],
+                                cache_output=config['global']['cache_outputs'])
     unbinner = SubstitutableStep(name='localizer_unbinner',
                                  transformer=UnBinner(**config['localizer_unbinner']),
                                  input_steps=[network],
@@ -28,7 +29,8 @@ def localization_pipeline(config):
                                adapter={
                                    'y_pred': ([('localizer_unbinner', 'prediction_coordinates')], identity_inputs),
                                    'y_true': ([('localizer_input', 'y')], get_localizer_target_column), },
-                               cache_dirpath=config['global']['cache_dirpath'])
+                               cache_dirpath=config['global']['cache_dirpath'],
+                               max_workers=config['global']['max_workers'])
     return output
 
 
@@ -57,7 +59,8 @@ def alignment_pipeline(config):
     network = SubstitutableStep(name='aligner_network',
                                 transformer=SimpleAligner(**config['aligner_network']),
                                 input_steps=[dataloader],
-                                cache_dirpath=config['global']['cache_dirpath'])
+                                cache_dirpath=config['global']['cache_dirpath'],
+                                cache_output=config['global']['cache_outputs'])
     unbinner = SubstitutableStep(name='aligner_unbinner',
                                  transformer=UnBinner(**config['aligner_unbinner']),
                                  input_steps=[network],
@@ -81,7 +84,8 @@ def alignment_pipeline(config):
                                adapter={
                                    'y_pred': ([('aligner_adjuster', 'prediction_coordinates')], identity_inputs),
                                    'y_true': ([('aligner_input', 'y')], get_aligner_target_column), },
-                               cache_dirpath=config['global']['cache_dirpath'])
+                               cache_dirpath=config['global']['cache_dirpath'],
+                               max_workers=config['global']['max_workers'])
     return output
 
 
@@ -110,7 +114,8 @@ def classification_pipeline(config):
     network = SubstitutableStep(name='classifier_network',
                                 transformer=SimpleClassifier(**config['classifier_network']),
                                 input_steps=[dataloader],
-                                cache_dirpath=config['global']['cache_dirpath'])
+                                cache_dirpath=config['global']['cache_dirpath'],
+                                cache_output=config['global']['cache_outputs'])
     proba_calibrator = SubstitutableStep(name='classifier_calibrator',
                                          transformer=ProbabilityCalibration(**config['classifier_calibrator']),
                                          input_steps=[network],
@@ -126,5 +131,6 @@ def classification_pipeline(config):
                                adapter={
                                    'y_pred': ([('classifier_calibrator', 'prediction_probability')], identity_inputs),
                                    'y_true': ([('classifier_encoder', 'y')], get_classifier_target_column), },
-                               cache_dirpath=config['global']['cache_dirpath'])
+                               cache_dirpath=config['global']['cache_dirpath'],
+                               max_workers=config['global']['max_workers'])
     return output
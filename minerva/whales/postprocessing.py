@@ -1,6 +1,7 @@
 import numpy as np
 from sklearn.externals import joblib
 
+from .quantization import adjust, dequantize
 from ..backend.base import BaseTransformer
 
 
@@ -13,22 +14,7 @@ class Adjuster(BaseTransformer):
 
     def transform(self, prediction_coordinates, crop_coordinates):
 
-        box_h, box_w = self.shape
-        scale_factor_x = (crop_coordinates[:, 2] - crop_coordinates[:, 0]) / float(box_w)
-        scale_factor_y = (crop_coordinates[:, 3] - crop_coordinates[:, 1]) / float(box_h)
-
-        prediction_adjusted = np.zeros_like(prediction_coordinates)
-        prediction_adjusted[:, 0] = prediction_coordinates[:, 0] * scale_factor_x
-        prediction_adjusted[:, 1] = prediction_coordinates[:, 1] * scale_factor_y
-        prediction_adjusted[:, 2] = prediction_coordinates[:, 2] * scale_factor_x
-        prediction_adjusted[:, 3] = prediction_coordinates[:, 3] * scale_factor_y
-
-        adjusted_coordinates = np.zeros_like(prediction_adjusted)
-        adjusted_coordinates[:, 0] = prediction_adjusted[:, 0] + crop_coordinates[:, 0]
-        adjusted_coordinates[:, 1] = prediction_adjusted[:, 1] + crop_coordinates[:, 1]
-        adjusted_coordinates[:, 2] = prediction_adjusted[:, 2] + crop_coordinates[:, 0]
-        adjusted_coordinates[:, 3] = prediction_adjusted[:, 3] + crop_coordinates[:, 1]
-
+        adjusted_coordinates = adjust(prediction_coordinates, crop_coordinates, self.shape)
         return {'prediction_coordinates': adjusted_coordinates.astype(np.uint64)}
 
     def load(self, filepath):
@@ -48,15 +34,11 @@ class UnBinner(BaseTransformer):
 
     def transform(self, prediction_coordinates, original_shapes):
         if self.shape is None:
-            y_granularity = original_shapes[['height']].values / self.bins_nr
-            x_granularity = original_shapes[['width']].values / self.bins_nr
+            # predictions are (x, y) pairs, so the first and third columns are scaled by the width
+            shapes = original_shapes[['width', 'height']].values
         else:
-            y_granularity = self.shape[1] / self.bins_nr
-            x_granularity = self.shape[0] / self.bins_nr
-
-        scaled_coordinates = np.zeros_like(prediction_coordinates)
-        scaled_coordinates[:, [0, 2]] = prediction_coordinates[:, [0, 2]] * x_granularity
-        scaled_coordinates[:, [1, 3]] = prediction_coordinates[:, [1, 3]] * y_granularity
+            shapes = self.shape
+        scaled_coordinates = dequantize(prediction_coordinates, shapes, self.bins_nr)
         return {'prediction_coordinates': scaled_coordinates.astype(np.uint64)}
 
     def load(self, filepath):
@@ -1,4 +1,3 @@
-from math import ceil
 from pathlib import Path
 
 import imgaug as ia
@@ -8,12 +7,44 @@ import torch
 from imgaug import augmenters as iaa
 from sklearn.externals import joblib
 from sklearn.preprocessing import LabelEncoder
-from torch.utils.data import Dataset, DataLoader
-
-from minerva.utils import decode_with_rescale
-from .config import ALIGNER_AUXILARY_COLUMNS
-from .utils import CropKeypoints, AlignKeypoints
+from torch.utils.data import Dataset, DataLoader, IterableDataset, get_worker_info
+from torch.utils.data.dataloader import default_collate
+from torch.utils.data.distributed import DistributedSampler
+
+from minerva.utils import decode_with_rescale, decode_roi_with_rescale, get_rescale_factor, \
+    is_roi_decoding_available, get_logger
+from .augmentation import sample_affine_params, get_augmentation_matrices, get_scale_matrices, \
+    get_translation_matrices, warp_images, transform_keypoints
+from .config import SHAPE_COLUMNS, LOCALIZER_TARGET_COLUMNS, LOCALIZER_AUXILARY_COLUMNS, ALIGNER_TARGET_COLUMNS, \
+    ALIGNER_AUXILARY_COLUMNS
+from .image_cache import ImageCache, get_image_cache_name
+from .quantization import quantize
+from .utils import CropKeypoints, AlignKeypoints, get_align_matrix
 from ..backend.base import BaseTransformer
+from ..backend.distributed import is_distributed, is_main_process, get_rank, get_world_size, barrier
+from ..backend.models.pytorch.loaders import PrefetchLoader, BatchTransformLoader, CachedLoader, \
+    ThreadPoolDataLoader, get_tensor_cache
+
+logger = get_logger()
+
+IMG_MEAN = [0.28201905, 0.37246801, 0.42341868]
+IMG_STD = [0.13609867, 0.12380088, 0.13325344]
+
+LOCALIZER_AUGMENTATION_PARAMS = {'rotate': (-10, 10),
+                                 'scale': (1 / 1.2, 1.2)}
+ALIGNER_AUGMENTATION_PARAMS = {'fliplr': 0.5,
+                               'flipud': 0.5,
+                               'translate_px': (-4, 4),
+                               'rotate': (-180, 180),
+                               'scale': (1.0, 1.5)}
+CLASSIFIER_AUGMENTATION_PARAMS = {'translate_px': (-4, 4),
+                                  'rotate': (-4, 4),
+                                  'scale': (1.0, 1.3),
+                                  'flipud': 0.5,
+                                  'fliplr': 0.5}
+
+LOADER_BACKENDS = {'process': DataLoader,
+                   'thread': ThreadPoolDataLoader}
 
 
 class TargetEncoderPandas(BaseTransformer):
@@ -79,118 +110,404 @@ class TargetEncoderPandas(BaseTransformer):
 
 
 class MetaDatasetBasic(Dataset):
-    def __init__(self, X, y, img_dirpath, augmentation, target_size, bins_nr):
+    """
+    Metadata and targets are kept as contiguous numpy arrays built once at construction, so items are read
+    with plain indexing and the dataset pickled to every worker stays small.
+    keypoint_columns are read from y as (x, y) pairs, auxiliary_columns as integer targets,
+    by default all columns of y that are not keypoints.
+    """
+    augmentation_params = {}
+    flip_first = False
+    keypoint_columns = []
+    auxiliary_columns = None
+
+    def __init__(self, X, y, img_dirpath, augmentation, target_size, bins_nr,
+                 image_cache_dirpath=None, image_cache_workers=1, batch_augmentation=False, roi_decoding=False,
+                 echo_factor=1, echo_buffer_size=64):
         super().__init__()
         self.img_dirpath = img_dirpath
-        self.X = X.reset_index(drop=True)
-        if y is not None:
-            self.y = y.reset_index(drop=True)
-        else:
+        if y is None:
             """
             Wouldn't work with kaggle submission Fix it
             """
             raise NotImplementedError('Not working with y being None')
+        self._set_columns(X, y)
         self.target_size = target_size
         self.bins_nr = bins_nr
         self.augmentation = augmentation
+        self.batch_augmentation = batch_augmentation
+        if roi_decoding and not is_roi_decoding_available():
+            logger.warning('roi_decoding requires TurboJPEG with crop, whole images are decoded instead')
+            roi_decoding = False
+        self.roi_decoding = roi_decoding
+        self.echo_factor = echo_factor
+        self.echo_buffer_size = echo_buffer_size
         self.preprocessing_function = None
-        self.normalization_function = None
+        self.max_scaling_factor = 8
+        self.image_cache = self._get_image_cache(image_cache_dirpath, image_cache_workers)
+
+    def _set_columns(self, X, y):
+        img_name_codes, self.img_names = pd.factorize(X['Image'])
+        self.img_name_codes = img_name_codes.astype(np.int32)
+        self.img_names = np.asarray(self.img_names, dtype=object)
+        self.org_shapes = np.ascontiguousarray(X[SHAPE_COLUMNS].values, dtype=np.int64)
+
+        auxiliary_columns = self.auxiliary_columns
+        if auxiliary_columns is None:
+            auxiliary_columns = [column for column in y.columns if column not in self.keypoint_columns]
+        self.keypoints = np.ascontiguousarray(y[self.keypoint_columns].values, dtype=np.float64).reshape(len(y), -1, 2)
+        self.auxiliary_targets = np.ascontiguousarray(y[auxiliary_columns].values, dtype=np.int64)
+
+    def get_img_name(self, index):
+        return self.img_names[self.img_name_codes[index]]
+
+    def get_org_size(self, index):
+        return self.org_shapes[index].tolist()
+
+    def get_img_size(self, index):
+        """
+        Original (width, height) of the image, so that the decoding scale is chosen without reading the file.
+        """
+        height, width = self.org_shapes[index]
+        return int(width), int(height)
+
+    @property
+    def minimum_shape(self):
+        return [d * 3 for d in self.target_size]
+
+    def _get_image_cache(self, image_cache_dirpath, image_cache_workers):
+        # the cache holds whole images, regions are decoded from the files instead
+        if image_cache_dirpath is None or self.roi_decoding:
+            return None
+
+        img_names = self.img_names[self.img_name_codes].tolist()
+        image_cache = ImageCache(image_cache_dirpath,
+                                 name=get_image_cache_name(img_names, self.minimum_shape, self.max_scaling_factor))
+        if is_main_process() and not image_cache.is_built:
+            image_cache.build(img_names, self.img_dirpath, self.minimum_shape,
+                              max_scaling_factor=self.max_scaling_factor,
+                              img_sizes=[self.get_img_size(index) for index in range(len(self))],
+                              n_jobs=image_cache_workers)
+        # in distributed training the other ranks wait for the cache built by the main process
+        barrier()
+        return image_cache
+
+    def load_image(self, index):
+        img_name = self.get_img_name(index)
+        img_size = self.get_img_size(index)
+        if self.image_cache is not None:
+            scale_factor = get_rescale_factor(img_size, self.minimum_shape,
+                                              max_scaling_factor=self.max_scaling_factor)
+            img = self.image_cache.get(img_name, scale_factor)
+            if img is not None:
+                return img
 
-    def load_image(self, img_name, max_scaling_factor=8):
         img_path = Path(self.img_dirpath) / img_name
         return decode_with_rescale(img_path,
-                                   minimum_shape=[d * 3 for d in self.target_size],
-                                   max_scaling_factor=max_scaling_factor)
+                                   minimum_shape=self.minimum_shape,
+                                   max_scaling_factor=self.max_scaling_factor,
+                                   img_size=img_size)
+
+    def load_image_region(self, index):
+        """
+        Returns the image, the (left, top) of the region it shows and the region (height, width),
+        both in original image coordinates.
+        With roi_decoding only the region from get_roi is decoded and the image cache is not used,
+        otherwise the whole image is loaded.
+        """
+        img_name = self.get_img_name(index)
+        if not self.roi_decoding:
+            return np.asarray(self.load_image(index)), np.zeros(2), self.get_org_size(index)
+
+        img_path = Path(self.img_dirpath) / img_name
+        img, (left, top, right, bottom) = decode_roi_with_rescale(img_path, self.get_roi(index), self.minimum_shape,
+                                                                  max_scaling_factor=self.max_scaling_factor)
+        return img, np.array([left, top], dtype=np.float64), [bottom - top, right - left]
+
+    def get_roi(self, index):
+        """
+        Region (left, top, right, bottom) of the original image the item is made from.
+        """
+        raise NotImplementedError()
+
+    @property
+    def is_deterministic(self):
+        return not self.augmentation
+
+    @property
+    def fingerprint(self):
+        """
+        Hash of everything items are computed from, the image cache is derived from the rest.
+        """
+        state = {name: value for name, value in vars(self).items() if name != 'image_cache'}
+        return joblib.hash((type(self).__name__, state))
+
+    @property
+    def collate_fn(self):
+        if self.batch_augmentation:
+            return AffineBatchCollate(self.target_size, self.augmentation, self.augmentation_params,
+                                      self.flip_first, self.bins_nr)
+        else:
+            return default_collate
 
     def __len__(self):
-        return self.X.shape[0]
+        return len(self.img_name_codes)
 
     def __getitem__(self, index):
+        return self.get_item(index, self.load_image_region(index))
+
+    def get_echoed_items(self, index):
+        """
+        Returns echo_factor items made from a single decode of the image region, each augmented independently.
+        Raw items share the image, it is augmented separately for every item by AffineBatchCollate.
+        """
+        region = self.load_image_region(index)
+        return [self.get_item(index, region) for _ in range(self.echo_factor)]
+
+    def get_item(self, index, region):
+        if self.batch_augmentation:
+            return self.get_raw_item(index, region)
+        return self.get_processed_item(index, region)
+
+    def get_processed_item(self, index, region):
+        """
+        Returns the preprocessed image tensor and the target tensor made from the region of load_image_region.
+        """
         raise NotImplementedError()
 
+    def get_raw_item(self, index, region=None):
+        """
+        Returns a decoded image with the geometry needed by AffineBatchCollate:
+        keypoints (K, 2) in image coordinates, matrix (3, 3) mapping the image to the space where augmentation
+        is applied, the (height, width) of that space and the auxiliary targets.
+        """
+        raise NotImplementedError()
 
-class DatasetLocalizer(MetaDatasetBasic):
-    def __init__(self, X, y, img_dirpath, augmentation, target_size, bins_nr):
-        super().__init__(X, y, img_dirpath, augmentation, target_size, bins_nr)
-        self.preprocessing_function = localizer_preprocessing
-        self.normalization_function = normalize_img
 
-    def __getitem__(self, index):
-        img_name = self.X['Image'].iloc[index]
-        org_size = self.X[['height', 'width']].iloc[index].tolist()
-        yi = self.y.iloc[index]
+class DatasetLocalizer(MetaDatasetBasic):
+    augmentation_params = LOCALIZER_AUGMENTATION_PARAMS
+    keypoint_columns = LOCALIZER_TARGET_COLUMNS
+    auxiliary_columns = LOCALIZER_AUXILARY_COLUMNS
 
-        Xi_img = self.load_image(img_name)
-        Xi = np.asarray(Xi_img)
+    def __init__(self, X, y, img_dirpath, augmentation, target_size, bins_nr, **kwargs):
+        super().__init__(X, y, img_dirpath, augmentation, target_size, bins_nr, **kwargs)
+        self.preprocessing_function = localizer_preprocessing
 
-        Xi, yi = self.preprocessing_function(Xi, yi,
+    def get_processed_item(self, index, region):
+        Xi, _, org_size = region
+        Xi, yi = self.preprocessing_function(Xi, self.keypoints[index],
                                              self.augmentation,
                                              org_size=org_size,
                                              target_size=self.target_size,
                                              bins_nr=self.bins_nr)
-        Xi = self.normalization_function(Xi)
-
-        Xi_tensor = torch.from_numpy(Xi).permute(2, 0, 1).type(torch.FloatTensor)
+        Xi_tensor = torch.from_numpy(Xi).permute(2, 0, 1).contiguous()
         yi_tensors = torch.from_numpy(yi).type(torch.LongTensor)
         return Xi_tensor, yi_tensors
 
+    def get_raw_item(self, index, region=None):
+        Xi, _, org_size = region or self.load_image_region(index)
+        keypoints = self.keypoints[index] * get_image_scale(Xi, org_size)
+        return Xi, keypoints, np.eye(3), Xi.shape[:2], self.auxiliary_targets[index]
+
 
 class DatasetAligner(MetaDatasetBasic):
-    def __init__(self, X, y, crop_coordinates, img_dirpath, augmentation, target_size, bins_nr):
-        super().__init__(X, y, img_dirpath, augmentation, target_size, bins_nr)
+    augmentation_params = ALIGNER_AUGMENTATION_PARAMS
+    flip_first = True
+    keypoint_columns = ALIGNER_TARGET_COLUMNS
+    auxiliary_columns = ALIGNER_AUXILARY_COLUMNS
+
+    def __init__(self, X, y, crop_coordinates, img_dirpath, augmentation, target_size, bins_nr,
+                 fused_transform=False, **kwargs):
+        super().__init__(X, y, img_dirpath, augmentation, target_size, bins_nr, **kwargs)
         self.crop_coordinates = crop_coordinates
-        self.preprocessing_function = aligner_preprocessing
-        self.normalization_function = normalize_img
-
-    def __getitem__(self, index):
-        img_name = self.X['Image'].iloc[index]
-        org_size = self.X[['height', 'width']].iloc[index].tolist()
-        crop_coordinates = self.crop_coordinates[index]
-        yi = self.y.iloc[index]
+        # per item counterpart of AffineBatchCollate, used only without batch_augmentation
+        if fused_transform:
+            self.preprocessing_function = aligner_preprocessing_fused
+        else:
+            self.preprocessing_function = aligner_preprocessing
 
-        Xi_img = self.load_image(img_name)
-        Xi = np.asarray(Xi_img)
+    def get_processed_item(self, index, region):
+        Xi, origin, org_size = region
+        keypoints = self.keypoints[index] - origin
+        crop_coordinates = np.asarray(self.crop_coordinates[index], dtype=np.float64) - np.tile(origin, 2)
 
-        Xi, yi = self.preprocessing_function(Xi, yi,
+        Xi, yi = self.preprocessing_function(Xi, keypoints, self.auxiliary_targets[index],
                                              crop_coordinates,
                                              self.augmentation,
                                              org_size=org_size,
                                              target_size=self.target_size,
                                              bins_nr=self.bins_nr)
-        Xi = self.normalization_function(Xi)
-
-        Xi_tensor = torch.from_numpy(Xi).permute(2, 0, 1).type(torch.FloatTensor)
+        Xi_tensor = torch.from_numpy(Xi).permute(2, 0, 1).contiguous()
         yi_tensors = torch.from_numpy(yi).type(torch.LongTensor)
         return Xi_tensor, yi_tensors
 
+    def get_raw_item(self, index, region=None):
+        Xi, origin, org_size = region or self.load_image_region(index)
+        crop_coordinates = np.asarray(self.crop_coordinates[index], dtype=np.float64) - np.tile(origin, 2)
+        keypoints, crop, crop_shape = get_crop_geometry(Xi, org_size, self.keypoints[index] - origin,
+                                                        crop_coordinates)
+        return Xi, keypoints, crop, crop_shape, self.auxiliary_targets[index]
+
+    def get_roi(self, index):
+        return self.crop_coordinates[index]
+
 
 class DatasetClassifier(MetaDatasetBasic):
-    def __init__(self, X, y, aligner_coordinates, img_dirpath, augmentation, target_size, num_classes):
-        super().__init__(X, y, img_dirpath, augmentation, target_size, num_classes)
+    augmentation_params = CLASSIFIER_AUGMENTATION_PARAMS
+
+    def __init__(self, X, y, aligner_coordinates, img_dirpath, augmentation, target_size, num_classes, **kwargs):
+        super().__init__(X, y, img_dirpath, augmentation, target_size, num_classes, **kwargs)
         self.aligner_coordinates = aligner_coordinates
         self.preprocessing_function = classifier_preprocessing
-        self.normalization_function = normalize_img
         self.num_classes = num_classes
 
-    def __getitem__(self, index):
-        img_name = self.X['Image'].iloc[index]
-        org_shape = self.X[['height', 'width']].iloc[index].tolist()
-        aligner_coordinates = self.aligner_coordinates[index]
-        yi = self.y.iloc[index]
-
-        Xi_img = self.load_image(img_name)
-        Xi = np.asarray(Xi_img)
+    def get_processed_item(self, index, region):
+        Xi, origin, org_shape = region
+        aligner_coordinates = np.asarray(self.aligner_coordinates[index], dtype=np.float64) - np.tile(origin, 2)
 
-        Xi, yi = self.preprocessing_function(Xi, yi,
+        Xi, yi = self.preprocessing_function(Xi, self.auxiliary_targets[index],
                                              aligner_coordinates,
                                              self.augmentation,
                                              org_size=org_shape,
                                              target_size=self.target_size)
-        Xi = self.normalization_function(Xi)
-
-        Xi_tensor = torch.from_numpy(Xi).permute(2, 0, 1)
+        Xi_tensor = torch.from_numpy(Xi).permute(2, 0, 1).contiguous()
         yi_tensor = torch.from_numpy(yi)
-        return Xi_tensor.type(torch.FloatTensor), yi_tensor.type(torch.LongTensor)
+        return Xi_tensor, yi_tensor.type(torch.LongTensor)
+
+    def get_raw_item(self, index, region=None):
+        Xi, origin, org_shape = region or self.load_image_region(index)
+        aligner_coordinates = np.asarray(self.aligner_coordinates[index], dtype=np.float64).reshape(2, 2) - origin
+        p1, p2 = aligner_coordinates * get_image_scale(Xi, org_shape)
+
+        align = np.vstack([get_align_matrix(tuple(p1), tuple(p2), self.target_size), [0, 0, 1]])
+        t_width, t_height = self.target_size
+        return Xi, np.empty((0, 2)), align, (t_height, t_width), self.auxiliary_targets[index]
+
+    def get_roi(self, index):
+        return get_align_roi(self.aligner_coordinates[index], self.target_size)
+
+
+class AffineBatchCollate:
+    """
+    Batch-level replacement of the per-sample imgaug pipelines.
+
+    Augmentation parameters are sampled for the whole batch, every sample gets one matrix composed of
+    its dataset specific transform, the augmentation and the final scale, and the image is resampled once.
+    Keypoints are transformed with the same matrices and quantized into bins.
+    """
+
+    def __init__(self, target_size, augmentation, augmentation_params, flip_first, bins_nr):
+        self.target_size = target_size
+        self.augmentation = augmentation
+        self.augmentation_params = augmentation_params
+        self.flip_first = flip_first
+        self.bins_nr = bins_nr
+
+    def __call__(self, items):
+        images, keypoints, matrices, shapes, auxiliary_targets = zip(*items)
+        matrices = np.stack(matrices)
+
+        if self.augmentation:
+            params = sample_affine_params(len(images), **self.augmentation_params)
+            matrices = get_augmentation_matrices(params, shapes, self.flip_first) @ matrices
+        matrices = get_scale_matrices(shapes, self.target_size) @ matrices
+
+        X = warp_images(images, matrices, self.target_size)
+        targets = self._get_targets(transform_keypoints(np.stack(keypoints), matrices), np.stack(auxiliary_targets))
+
+        X_tensor = torch.from_numpy(X).permute(0, 3, 1, 2).contiguous()
+        targets_tensor = torch.from_numpy(targets).type(torch.LongTensor)
+        return X_tensor, targets_tensor
+
+    def _get_targets(self, keypoints, auxiliary_targets):
+        if keypoints.shape[1] == 0:
+            return auxiliary_targets
+
+        binned_coordinates = quantize(keypoints.reshape(keypoints.shape[0], -1), self.target_size, self.bins_nr)
+        return np.hstack([binned_coordinates, auxiliary_targets])
+
+
+class EchoingDataset(IterableDataset):
+    """
+    Data echoing: iterates batches of the items of dataset with every decoded image region repeated echo_factor
+    times, each repetition augmented independently, see MetaDatasetBasic.get_echoed_items.
+
+    Items pass through a shuffle buffer of buffer_size items, so a batch mixes echoes of many source images.
+    Source indices are permuted every epoch with shuffle, split evenly between the ranks with shard
+    in distributed training and between the workers_nr DataLoader workers.
+    Every worker collates its own batches, so the length counts the last partial batch of each worker.
+    """
+
+    def __init__(self, dataset, batch_size, buffer_size, collate_fn, shuffle=False, shard=False, drop_last=False,
+                 workers_nr=1, seed=0):
+        super().__init__()
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.buffer_size = max(buffer_size, 1)
+        self.collate_fn = collate_fn
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.workers_nr = max(workers_nr, 1)
+        self.seed = seed
+        self.epoch_id = 0
+        # the process group is not available in DataLoader workers
+        if shard and is_distributed():
+            self.rank, self.world_size = get_rank(), get_world_size()
+        else:
+            self.rank, self.world_size = 0, 1
+
+    def set_epoch(self, epoch_id):
+        self.epoch_id = epoch_id
+
+    def __len__(self):
+        rank_indices = self._get_rank_indices()
+        batches_nr = 0
+        for worker_id in range(self.workers_nr):
+            items_nr = len(rank_indices[worker_id::self.workers_nr]) * self.dataset.echo_factor
+            if self.drop_last:
+                batches_nr += items_nr // self.batch_size
+            else:
+                batches_nr += -(-items_nr // self.batch_size)
+        return batches_nr
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        indices = self._get_rank_indices()[worker_id::self.workers_nr]
+        random_state = np.random.RandomState([self.seed, self.epoch_id, self.rank, worker_id])
+
+        batch = []
+        for item in self._iterate_shuffled(indices, random_state):
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield self.collate_fn(batch)
+                batch = []
+        if batch and not self.drop_last:
+            yield self.collate_fn(batch)
+
+    def _iterate_shuffled(self, indices, random_state):
+        buffer = []
+        for index in indices:
+            buffer.extend(self.dataset.get_echoed_items(index))
+            while len(buffer) >= self.buffer_size:
+                yield _pop_random(buffer, random_state)
+        while buffer:
+            yield _pop_random(buffer, random_state)
+
+    def _get_rank_indices(self):
+        indices = np.arange(len(self.dataset))
+        if self.shuffle:
+            indices = np.random.RandomState([self.seed, self.epoch_id]).permutation(indices)
+        # like DistributedSampler every rank gets the same number of indices, so ranks run the same number of steps
+        rank_size = -(-len(indices) // self.world_size)
+        indices = np.resize(indices, rank_size * self.world_size)
+        return indices[self.rank::self.world_size]
+
+
+def _pop_random(buffer, random_state):
+    position = random_state.randint(len(buffer))
+    buffer[position], buffer[-1] = buffer[-1], buffer[position]
+    return buffer.pop()
 
 
 class DataLoaderBasic(BaseTransformer):
@@ -202,7 +519,9 @@ class DataLoaderBasic(BaseTransformer):
 
     def _unpack_params(self):
         self.inference_dataset_params = self.dataset_params['inference']
-        self.inference_loader_params = self.loader_params['inference']
+        # collated batches are cached only for validation datagens, which are iterated at every validation
+        self.validation_loader_params = self.loader_params['inference']
+        self.inference_loader_params = dict(self.loader_params['inference'], tensor_cache=False)
         self.train_dataset_params = self.dataset_params['train']
         self.train_loader_params = self.loader_params['train']
 
@@ -220,7 +539,7 @@ class DataLoaderBasic(BaseTransformer):
             X_valid, y_valid = validation_data
             valid_flow, valid_steps = self.datagen_builder(X_valid, y_valid,
                                                            self.inference_dataset_params,
-                                                           self.inference_loader_params)
+                                                           self.validation_loader_params)
         else:
             valid_flow = None
             valid_steps = None
@@ -246,8 +565,8 @@ class DataLoaderLocalizer(DataLoaderBasic):
 
     def datagen_builder(self, X, y, dataset_params, loader_params):
         dataset = self.dataset(X, y, **dataset_params)
-        datagen = DataLoader(dataset, **loader_params)
-        steps = ceil(X.shape[0] / loader_params['batch_size'])
+        datagen = get_data_loader(dataset, loader_params)
+        steps = len(datagen)
         return datagen, steps
 
 
@@ -271,7 +590,7 @@ class DataLoaderAligner(DataLoaderBasic):
             X_valid, y_valid, crop_coordinates_valid = validation_data
             valid_flow, valid_steps = self.datagen_builder(X_valid, y_valid, crop_coordinates_valid,
                                                            self.inference_dataset_params,
-                                                           self.inference_loader_params)
+                                                           self.validation_loader_params)
         else:
             valid_flow = None
             valid_steps = None
@@ -280,8 +599,8 @@ class DataLoaderAligner(DataLoaderBasic):
 
     def datagen_builder(self, X, y, crop_coordinates, dataset_params, loader_params):
         dataset = self.dataset(X, y, crop_coordinates, **dataset_params)
-        datagen = DataLoader(dataset, **loader_params)
-        steps = ceil(X.shape[0] / loader_params['batch_size'])
+        datagen = get_data_loader(dataset, loader_params)
+        steps = len(datagen)
         return datagen, steps
 
 
@@ -304,7 +623,7 @@ class DataLoaderClassifier(DataLoaderBasic):
             X_valid, y_valid, align_coordinates_valid = validation_data
             valid_flow, valid_steps = self.datagen_builder(X_valid, y_valid, align_coordinates_valid,
                                                            self.inference_dataset_params,
-                                                           self.inference_loader_params)
+                                                           self.validation_loader_params)
         else:
             valid_flow = None
             valid_steps = None
@@ -314,18 +633,93 @@ class DataLoaderClassifier(DataLoaderBasic):
 
     def datagen_builder(self, X, y, align_coordinates, dataset_params, loader_params):
         dataset = self.dataset(X, y, align_coordinates, **dataset_params)
-        datagen = DataLoader(dataset, **loader_params)
-        steps = ceil(X.shape[0] / loader_params['batch_size'])
+        datagen = get_data_loader(dataset, loader_params)
+        steps = len(datagen)
         return datagen, steps
 
 
-def localizer_preprocessing(img, target, augmentation, *, org_size, target_size, bins_nr):
+def get_data_loader(dataset, loader_params):
+    """
+    Datasets emit uint8 images which are normalized after collation, in the main process
+    and after the transfer to the device when prefetching.
+    prefetch_depth > 0 stages batches on a background thread, see PrefetchLoader.
+    With shard in distributed training every rank iterates its own part of the dataset.
+    With tensor_cache the collated batches of a dataset without augmentation and shuffling are computed once
+    and replayed, from memory up to tensor_cache_max_gb and from a file in tensor_cache_dirpath beyond it,
+    see get_tensor_cache. It pays off only for datagens iterated repeatedly, like validation ones.
+    backend 'process' loads items in DataLoader worker processes, 'thread' on a thread pool,
+    see ThreadPoolDataLoader.
+    Datasets with augmentation and echo_factor > 1 are iterated through an EchoingDataset, an epoch is then
+    one pass over the source items with echo_factor times as many steps. Echoing requires the process backend.
+    """
+    loader_params = dict(loader_params)
+    backend = loader_params.pop('backend', 'process')
+    if backend not in LOADER_BACKENDS:
+        raise ValueError('backend must be one of {}, got {}'.format(list(LOADER_BACKENDS), backend))
+    prefetch_depth = loader_params.pop('prefetch_depth', 0)
+    tensor_cache = loader_params.pop('tensor_cache', False)
+    tensor_cache_max_gb = loader_params.pop('tensor_cache_max_gb', 1)
+    tensor_cache_dirpath = loader_params.pop('tensor_cache_dirpath', None)
+    if dataset.echo_factor > 1 and not dataset.is_deterministic:
+        if backend != 'process':
+            raise ValueError('echo_factor > 1 requires the process backend, got {}'.format(backend))
+        return _get_echoing_data_loader(dataset, loader_params, prefetch_depth)
+    if loader_params.pop('shard', False) and is_distributed():
+        loader_params['sampler'] = DistributedSampler(dataset, shuffle=loader_params.pop('shuffle', False))
+    if backend == 'thread':
+        # threads live only as long as an iteration, there is nothing to keep alive between epochs
+        loader_params.pop('persistent_workers', None)
+    datagen = LOADER_BACKENDS[backend](dataset, collate_fn=dataset.collate_fn, **loader_params)
+    if tensor_cache and dataset.is_deterministic and not loader_params.get('shuffle', False) \
+            and 'sampler' not in loader_params:
+        cache_key = joblib.hash((dataset.fingerprint, loader_params.get('batch_size', 1)))
+        datagen = CachedLoader(datagen, get_tensor_cache(cache_key, int(tensor_cache_max_gb * 2 ** 30),
+                                                         tensor_cache_dirpath))
+    return _wrap_normalization(datagen, prefetch_depth)
+
+
+def _get_echoing_data_loader(dataset, loader_params, prefetch_depth):
+    echoing_dataset = EchoingDataset(dataset, loader_params.pop('batch_size', 1), dataset.echo_buffer_size,
+                                     dataset.collate_fn,
+                                     shuffle=loader_params.pop('shuffle', False),
+                                     shard=loader_params.pop('shard', False),
+                                     drop_last=loader_params.pop('drop_last', False),
+                                     workers_nr=loader_params.get('num_workers', 0))
+    # workers must be restarted to see the epoch of the echoing dataset
+    loader_params.pop('persistent_workers', None)
+    # batches are collated by the echoing dataset
+    datagen = DataLoader(echoing_dataset, batch_size=None, **loader_params)
+    return _wrap_normalization(datagen, prefetch_depth)
+
+
+def _wrap_normalization(datagen, prefetch_depth):
+    if prefetch_depth:
+        return PrefetchLoader(datagen, prefetch_depth, batch_transform=normalize_batch)
+    return BatchTransformLoader(datagen, normalize_batch)
+
+
+def get_imgaug_augmenter(augmentation_params, flip_first=False):
+    """
+    imgaug counterpart of sample_affine_params, so both transform paths share the same ranges.
+    """
+    params = dict(augmentation_params)
+    flips = [iaa.Flipud(params.pop('flipud'))] if 'flipud' in params else []
+    if 'fliplr' in params:
+        flips.append(iaa.Fliplr(params.pop('fliplr')))
+    if 'translate_px' in params:
+        translate_px = params.pop('translate_px')
+        params['translate_px'] = {'x': translate_px, 'y': translate_px}
+    affine = [iaa.Affine(**params)]
+    return iaa.Sequential(flips[::-1] + affine if flip_first else affine + flips)
+
+
+def localizer_preprocessing(img, keypoints, augmentation, *, org_size, target_size, bins_nr):
     final_height, finale_width = target_size
     img_height, img_width = img.shape[:-1]
 
     load_scale = iaa.Scale({"height": img_height, "width": img_width}).to_deterministic()
     final_scale = iaa.Scale({"height": final_height, "width": finale_width}).to_deterministic()
-    augmenter = iaa.Affine(rotate=(-10, 10), scale=(1 / 1.2, 1.2)).to_deterministic()
+    augmenter = get_imgaug_augmenter(LOCALIZER_AUGMENTATION_PARAMS).to_deterministic()
 
     if augmentation:
         transformations = [load_scale, augmenter, final_scale]
@@ -335,9 +729,10 @@ def localizer_preprocessing(img, target, augmentation, *, org_size, target_size,
 
     aug_X = transformer.augment_image(img)
 
+    (bbox1_x, bbox1_y), (bbox2_x, bbox2_y) = keypoints
     keypoints = ia.KeypointsOnImage([
-        ia.Keypoint(x=int(target.bbox1_x), y=int(target.bbox1_y)),
-        ia.Keypoint(x=int(target.bbox2_x), y=int(target.bbox2_y))],
+        ia.Keypoint(x=int(bbox1_x), y=int(bbox1_y)),
+        ia.Keypoint(x=int(bbox2_x), y=int(bbox2_y))],
         shape=org_size)
     aug_points = transformer.augment_keypoints([keypoints])[0]
     aug_points_formatted = np.reshape(aug_points.get_coords_array(), -1).astype(np.float)
@@ -346,12 +741,14 @@ def localizer_preprocessing(img, target, augmentation, *, org_size, target_size,
     return aug_X, aug_points_binned
 
 
-def aligner_preprocessing(img, target, crop_coordinates, augmentation, *, org_size, target_size, bins_nr):
+def aligner_preprocessing(img, keypoints, auxiliary_targets, crop_coordinates, augmentation, *,
+                          org_size, target_size, bins_nr):
     img_height, img_width = img.shape[:-1]
     final_height, final_width = target_size
 
-    keypoints = ia.KeypointsOnImage([ia.Keypoint(x=int(target.bonnet_x), y=int(target.bonnet_y)),
-                                     ia.Keypoint(x=int(target.blowhead_x), y=int(target.blowhead_y))],
+    (bonnet_x, bonnet_y), (blowhead_x, blowhead_y) = keypoints
+    keypoints = ia.KeypointsOnImage([ia.Keypoint(x=int(bonnet_x), y=int(bonnet_y)),
+                                     ia.Keypoint(x=int(blowhead_x), y=int(blowhead_y))],
                                     shape=org_size)
     crop_coordinates = ia.KeypointsOnImage([ia.Keypoint(x=crop_coordinates[0], y=crop_coordinates[1]),
                                             ia.Keypoint(x=crop_coordinates[2], y=crop_coordinates[3])],
@@ -362,13 +759,7 @@ def aligner_preprocessing(img, target, crop_coordinates, augmentation, *, org_si
     crop_coordinates = crop_coordinates.get_coords_array().flatten()
 
     crop = CropKeypoints(crop_coordinates).to_deterministic()
-    augmenter = iaa.Sequential([iaa.Fliplr(0.5),
-                                iaa.Flipud(0.5),
-                                iaa.Affine(
-                                    translate_px={"x": (-4, 4), "y": (-4, 4)},
-                                    rotate=(-180, 180),
-                                    scale=(1.0, 1.5)),
-                                ]).to_deterministic()
+    augmenter = get_imgaug_augmenter(ALIGNER_AUGMENTATION_PARAMS, flip_first=True).to_deterministic()
     final_scale = iaa.Scale({"height": final_height, "width": final_width}).to_deterministic()
 
     if augmentation:
@@ -384,11 +775,72 @@ def aligner_preprocessing(img, target, crop_coordinates, augmentation, *, org_si
     # bin key-points
     aug_points_formatted = np.reshape(aug_points.get_coords_array(), -1).astype(np.float)
     aug_points_binned = bin_quantizer(aug_points_formatted, target_size, bins_nr)
-    aug_target_binned = np.hstack([aug_points_binned, target[ALIGNER_AUXILARY_COLUMNS].values])
+    aug_target_binned = np.hstack([aug_points_binned, auxiliary_targets])
+    return aug_X, aug_target_binned
+
+
+def aligner_preprocessing_fused(img, keypoints, auxiliary_targets, crop_coordinates, augmentation, *,
+                                org_size, target_size, bins_nr):
+    """
+    Same as aligner_preprocessing, but the load scale, crop, augmentation and final scale are composed
+    into one affine matrix and the image is resampled once, straight from the decoded image to target_size.
+    """
+    keypoints, crop, crop_shape = get_crop_geometry(img, org_size, keypoints, crop_coordinates)
+    matrix = crop[np.newaxis]
+    if augmentation:
+        params = sample_affine_params(1, **ALIGNER_AUGMENTATION_PARAMS)
+        matrix = get_augmentation_matrices(params, [crop_shape], flip_first=True) @ matrix
+    matrix = get_scale_matrices([crop_shape], target_size) @ matrix
+
+    aug_X = warp_images([img], matrix, target_size)[0]
+    aug_points = transform_keypoints(keypoints[np.newaxis], matrix)[0]
+
+    # bin key-points
+    aug_points_binned = bin_quantizer(aug_points.reshape(-1), target_size, bins_nr)
+    aug_target_binned = np.hstack([aug_points_binned, auxiliary_targets])
     return aug_X, aug_target_binned
 
 
-def classifier_preprocessing(img, target, aligner_coordinates, augmentation, *, org_size, target_size):
+def get_image_scale(img, org_size):
+    """
+    Keypoints and crop coordinates are given for the original image, img may be decoded with downscaling.
+    """
+    img_height, img_width = img.shape[:2]
+    org_height, org_width = org_size
+    return np.array([img_width / org_width, img_height / org_height])
+
+
+def get_crop_geometry(img, org_size, keypoints, crop_coordinates):
+    """
+    Returns keypoints in img coordinates, the matrix moving the crop to the origin and the crop (height, width).
+    """
+    image_scale = get_image_scale(img, org_size)
+    keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, 2) * image_scale
+    crop_coordinates = np.asarray(crop_coordinates, dtype=np.float64).reshape(2, 2) * image_scale
+    (crop_left, crop_top), (crop_right, crop_bottom) = crop_coordinates
+
+    crop = get_translation_matrices([-crop_left], [-crop_top])[0]
+    crop_shape = (max(crop_bottom - crop_top, 1.), max(crop_right - crop_left, 1.))
+    return keypoints, crop, crop_shape
+
+
+def get_align_roi(aligner_coordinates, target_size, margin=0.1):
+    """
+    Bounding box (left, top, right, bottom) of the image region the alignment maps to target_size,
+    widened by margin on every side for the augmentation.
+    """
+    p1, p2 = np.asarray(aligner_coordinates, dtype=np.float64).reshape(2, 2)
+    align = np.vstack([get_align_matrix(tuple(p1), tuple(p2), target_size), [0, 0, 1]])
+    t_width, t_height = target_size
+    corners = np.array([[0, t_width, 0, t_width],
+                        [0, 0, t_height, t_height],
+                        [1, 1, 1, 1]], dtype=np.float64)
+    x, y = (np.linalg.inv(align) @ corners)[:2]
+    margin_x, margin_y = margin * (x.max() - x.min()), margin * (y.max() - y.min())
+    return x.min() - margin_x, y.min() - margin_y, x.max() + margin_x, y.max() + margin_y
+
+
+def classifier_preprocessing(img, targets, aligner_coordinates, augmentation, *, org_size, target_size):
     img_height, img_width = img.shape[:-1]
     final_height, final_width = target_size
 
@@ -401,12 +853,7 @@ def classifier_preprocessing(img, target, aligner_coordinates, augmentation, *,
     aligner_coordinates = aligner_coordinates.get_coords_array().flatten()
 
     align = AlignKeypoints(aligner_coordinates, target_size).to_deterministic()
-    augmenter = iaa.Sequential([iaa.Affine(translate_px={"x": (-4, 4), "y": (-4, 4)},
-                                           rotate=(-4, 4),
-                                           scale=(1.0, 1.3)),
-                                iaa.Flipud(0.5),
-                                iaa.Fliplr(0.5),
-                                ]).to_deterministic()
+    augmenter = get_imgaug_augmenter(CLASSIFIER_AUGMENTATION_PARAMS).to_deterministic()
     final_scale = iaa.Scale({"height": final_height, "width": final_width}).to_deterministic()
 
     if augmentation:
@@ -417,36 +864,21 @@ def classifier_preprocessing(img, target, aligner_coordinates, augmentation, *,
     transformer = iaa.Sequential(transformations).to_deterministic()
 
     aug_X = transformer.augment_image(img)
-    target_np = target.values.astype(np.int64)
-    return aug_X, target_np
+    return aug_X, np.array(targets, dtype=np.int64)
 
 
-def normalize_img(img):
-    mean = [0.28201905, 0.37246801, 0.42341868]
-    std = [0.13609867, 0.12380088, 0.13325344]
-    img_ = img.astype(np.float64) / 255.
-    img_ = (img_ - mean) / std
-    return img_
+def normalize_batch(batch):
+    X, y = batch
+    mean = torch.tensor(IMG_MEAN, dtype=torch.float32, device=X.device).view(1, -1, 1, 1)
+    std = torch.tensor(IMG_STD, dtype=torch.float32, device=X.device).view(1, -1, 1, 1)
+    X = X.float().div_(255.).sub_(mean).div_(std)
+    return X, y
 
 
 def denormalize_img(img):
-    mean = [0.28201905, 0.37246801, 0.42341868]
-    std = [0.13609867, 0.12380088, 0.13325344]
-    img_ = (img * std) + mean
+    img_ = (img * IMG_STD) + IMG_MEAN
     return img_
 
 
 def bin_quantizer(coordinates, shape, bins_nr):
-    height, width = shape
-    bins_nr_ = bins_nr - 1  # hack/adjustment when value is at the right edge
-
-    x_coordinates = coordinates[[1, 3]]
-    bins_x = [i * (width / bins_nr_) for i in range(bins_nr_)]
-    binned_x = np.digitize(x_coordinates, bins_x)
-
-    y_coordinates = coordinates[[0, 2]]
-    bins_y = [i * (height / bins_nr_) for i in range(bins_nr_)]
-    binned_y = np.digitize(y_coordinates, bins_y)
-
-    binned_coordinates = np.array([binned_y[0], binned_x[0], binned_y[1], binned_x[1]])
-    return binned_coordinates
+    return quantize(coordinates, shape, bins_nr)[0]
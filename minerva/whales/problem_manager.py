@@ -6,6 +6,7 @@ from .pipelines import localization_pipeline, alignment_pipeline, classification
 from .tasks import initialize_tasks
 from .registry import registered_tasks, registered_scores
 from .trainer import Trainer
+from ..backend.distributed import is_main_process
 from ..backend.task_manager import TaskSolutionParser
 
 initialize_tasks()
@@ -26,7 +27,8 @@ def dry_run(sub_problem, train_mode, dev_mode):
 
     if train_mode:
         trainer.train()
-    _evaluate(trainer, sub_problem)
+    if is_main_process():
+        _evaluate(trainer, sub_problem)
 
 
 def submit_task(sub_problem, task_nr, filepath, dev_mode):
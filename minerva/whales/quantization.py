@@ -0,0 +1,48 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def get_bin_edges(size, bins_nr):
+    """
+    Left bin edges for coordinates in [0, size], computed once per (size, bins_nr).
+    """
+    bins_nr_ = bins_nr - 1  # hack/adjustment when value is at the right edge
+    edges = np.arange(bins_nr_) * (size / bins_nr_)
+    edges.setflags(write=False)
+    return edges
+
+
+def quantize(coordinates, shape, bins_nr):
+    """
+    Bins coordinates (N, 4) for an image of shape (height, width), the target_size the datasets pass.
+    Columns 0 and 2 are binned against the height, columns 1 and 3 against the width, as the per-sample
+    binning did. Target sizes are square, so this equals binning x against the width.
+    """
+    height, width = shape
+    coordinates = np.asarray(coordinates).reshape(-1, 4)
+    binned_coordinates = np.empty(coordinates.shape, dtype=np.int64)
+    binned_coordinates[:, 0::2] = np.digitize(coordinates[:, 0::2], get_bin_edges(float(height), bins_nr))
+    binned_coordinates[:, 1::2] = np.digitize(coordinates[:, 1::2], get_bin_edges(float(width), bins_nr))
+    return binned_coordinates
+
+
+def dequantize(binned_coordinates, shapes, bins_nr):
+    """
+    Maps bins (N, 4) back to coordinates, the inverse of quantize up to the bin width.
+    shapes is a single (width, height) or one per row (N, 2).
+    """
+    granularity = np.asarray(shapes, dtype=np.float64).reshape(-1, 2) / bins_nr
+    return np.asarray(binned_coordinates).reshape(-1, 4) * np.tile(granularity, 2)
+
+
+def adjust(coordinates, crop_coordinates, shape):
+    """
+    Maps coordinates (N, 4) predicted on crops resized to shape (height, width) back to the frame
+    the crops (N, 4) given as (left, top, right, bottom) were taken from.
+    """
+    box_h, box_w = shape
+    crop_coordinates = np.asarray(crop_coordinates, dtype=np.float64).reshape(-1, 4)
+    scale_factors = (crop_coordinates[:, 2:] - crop_coordinates[:, :2]) / np.array([box_w, box_h], dtype=np.float64)
+    return np.asarray(coordinates).reshape(-1, 4) * np.tile(scale_factors, 2) + np.tile(crop_coordinates[:, :2], 2)
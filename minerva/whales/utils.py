@@ -127,6 +127,15 @@ def align(img, aligning_coordinates_p1, aligning_coordinates_p2, target_size=(20
     Adjusted from https://www.pyimagesearch.com/2017/05/22/face-alignment-with-opencv-and-python
     """
     t_width, t_height = target_size
+    M = get_align_matrix(aligning_coordinates_p1, aligning_coordinates_p2, target_size)
+
+    output = cv2.warpAffine(img, M, (t_width, t_height), flags=cv2.INTER_CUBIC)
+
+    return output
+
+
+def get_align_matrix(aligning_coordinates_p1, aligning_coordinates_p2, target_size=(200, 100)):
+    t_width, t_height = target_size
 
     target_position = (int(0.75 * t_width), int(0.5 * t_height))
 
@@ -148,6 +157,4 @@ def align(img, aligning_coordinates_p1, aligning_coordinates_p2, target_size=(20
     M[0, 2] += (left_x - x1)
     M[1, 2] += (left_y - y1)
 
-    output = cv2.warpAffine(img, M, (t_width, t_height), flags=cv2.INTER_CUBIC)
-
-    return output
+    return M
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from minerva.backend.utils import ChannelRegistry, get_unique_channel_name
+
+
+def make_ctx(channel_names):
+    channels = [SimpleNamespace(name=channel_name) for channel_name in channel_names]
+    return SimpleNamespace(_experiment=SimpleNamespace(_channels=channels))
+
+
+def test_registry_returns_bare_name_first_then_numbers():
+    registry = ChannelRegistry()
+    assert registry.get_unique_name('batch_loss') == 'batch_loss'
+    assert registry.get_unique_name('batch_loss') == 'batch_loss 1'
+    assert registry.get_unique_name('batch_loss') == 'batch_loss 2'
+
+
+def test_registry_force_id():
+    registry = ChannelRegistry()
+    assert registry.get_unique_name('batch_loss', force_id=True) == 'batch_loss 1'
+    assert registry.get_unique_name('batch_loss', force_id=True) == 'batch_loss 2'
+
+
+def test_registry_continues_after_existing_channels():
+    registry = ChannelRegistry(['batch_loss', 'batch_loss 3', 'batch_loss 1', 'epoch_acc'])
+    assert registry.get_unique_name('batch_loss') == 'batch_loss 4'
+    assert registry.get_unique_name('epoch_acc') == 'epoch_acc 1'
+    assert registry.get_unique_name('epoch_loss') == 'epoch_loss'
+
+
+def test_registry_matches_exact_names():
+    registry = ChannelRegistry(['batch_loss', 'batch_loss 2'])
+    assert registry.get_unique_name('loss') == 'loss'
+    assert registry.get_unique_name('batch_loss (classifier)') == 'batch_loss (classifier)'
+
+
+def test_unique_channel_name_shares_registry_per_experiment():
+    ctx = make_ctx(['batch_loss (localizer)'])
+    other_ctx = SimpleNamespace(_experiment=ctx._experiment)
+
+    assert get_unique_channel_name(ctx, 'batch_loss', suffix='localizer') == 'batch_loss (localizer) 1'
+    assert get_unique_channel_name(other_ctx, 'batch_loss', suffix='localizer') == 'batch_loss (localizer) 2'
+    assert get_unique_channel_name(ctx, 'loss') == 'loss'
+    assert get_unique_channel_name(make_ctx([]), 'batch_loss', suffix='localizer') == 'batch_loss (localizer)'
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from minerva.backend.models.pytorch.callbacks import CallbackList, ValidationMonitor
+
+
+class TwoOutputs(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(4, 3)
+
+    def forward(self, x):
+        output = self.linear(x)
+        return [output, output]
+
+
+class CountingBatches:
+    def __init__(self, batches):
+        self.batches = batches
+        self.passes = 0
+
+    def __iter__(self):
+        self.passes += 1
+        return iter(self.batches)
+
+
+def multi_output_cross_entropy(outputs, targets):
+    return sum(F.cross_entropy(output, target) for output, target in zip(outputs, targets)) / len(outputs)
+
+
+def test_callbacks_share_one_validation_pass():
+    torch.manual_seed(0)
+    model = TwoOutputs()
+    batches = CountingBatches([(torch.randn(5, 4), torch.randint(0, 3, (5, 2))) for _ in range(2)])
+    transformer = SimpleNamespace(model=model, optimizer=None, loss_function=multi_output_cross_entropy)
+
+    callbacks = CallbackList([ValidationMonitor(epoch_every=1), ValidationMonitor(epoch_every=1)])
+    callbacks.set_params(transformer, validation_datagen=(batches, 1))
+    callbacks.on_train_begin()
+
+    callbacks.on_epoch_end()
+    assert batches.passes == 1
+    assert model.training
+    first, second = [callback.get_validation_metrics() for callback in callbacks.callbacks]
+    assert first == second
+    assert set(first) == {'val_loss', 'val_acc'}
+
+    callbacks.on_epoch_end()
+    assert batches.passes == 2
@@ -0,0 +1,111 @@
+import json
+import threading
+
+import pytest
+
+from minerva.backend.channels import ChannelSender, FileSink
+
+
+class BlockingSink:
+    def __init__(self):
+        self.points = []
+        self.images = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def send_numeric(self, points):
+        self.started.set()
+        self.release.wait(timeout=10)
+        self.points.extend(points)
+
+    def send_image(self, channel_name, name, description, image):
+        self.images.append((channel_name, name, description, image))
+
+
+class FakeImage:
+    def __init__(self, content):
+        self.content = content
+
+    def save(self, filepath):
+        with open(filepath, 'w') as f:
+            f.write(self.content)
+
+
+def fill_blocked_sender(drop_policy):
+    sink = BlockingSink()
+    sender = ChannelSender(sink, max_queue_size=2, batch_size=1, drop_policy=drop_policy)
+    sender.send_numeric('loss', x=0, y=0.)
+    assert sink.started.wait(timeout=10)
+    for x in range(1, 4):
+        sender.send_numeric('loss', x=x, y=float(x))
+    return sink, sender
+
+
+@pytest.mark.parametrize('drop_policy, expected_xs', [('oldest', [0, 2, 3]), ('newest', [0, 1, 2])])
+def test_sender_drop_policy(drop_policy, expected_xs):
+    sink, sender = fill_blocked_sender(drop_policy)
+    assert sender.dropped_nr == 1
+
+    sink.release.set()
+    sender.close()
+    assert [x for _, x, _ in sink.points] == expected_xs
+
+
+def test_sender_rejects_unknown_drop_policy():
+    with pytest.raises(ValueError):
+        ChannelSender(BlockingSink(), drop_policy='random')
+
+
+def test_sender_flush_sends_everything_queued():
+    sink = BlockingSink()
+    sink.release.set()
+    sender = ChannelSender(sink, batch_size=3)
+    for x in range(10):
+        sender.send_numeric('loss', x=x, y=float(x))
+    sender.send_image('images', 'first', 'description', lambda: 'rendered')
+
+    sender.flush()
+    assert [x for _, x, _ in sink.points] == list(range(10))
+    assert sink.images == [('images', 'first', 'description', 'rendered')]
+    assert sender.dropped_nr == 0
+    sender.close()
+
+
+def test_sender_close_stops_worker():
+    sink = BlockingSink()
+    sink.release.set()
+    sender = ChannelSender(sink)
+    sender.send_numeric('loss', x=0, y=1.)
+
+    sender.close()
+    assert not sender._worker.is_alive()
+    assert sink.points == [('loss', 0, 1.)]
+
+
+def test_sender_survives_failing_image_render():
+    sink = BlockingSink()
+    sink.release.set()
+    sender = ChannelSender(sink)
+
+    def failing_render():
+        raise RuntimeError('render failed')
+
+    sender.send_image('images', 'broken', 'description', failing_render)
+    sender.send_numeric('loss', x=0, y=1.)
+    sender.close()
+    assert sink.images == []
+    assert sink.points == [('loss', 0, 1.)]
+
+
+def test_file_sink_writes_points_and_images(tmp_path):
+    sink = FileSink(str(tmp_path / 'channels'))
+    sink.send_numeric([('loss', 0, 1.5), ('acc', 0, 0.25)])
+    sink.send_numeric([('loss', 1, 1.)])
+    sink.send_image('plotted bbox', 'epoch0', 'description', FakeImage('png'))
+
+    with open(sink.numeric_filepath) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines == [{'channel': 'loss', 'x': 0., 'y': 1.5},
+                     {'channel': 'acc', 'x': 0., 'y': 0.25},
+                     {'channel': 'loss', 'x': 1., 'y': 1.}]
+    assert (tmp_path / 'channels' / 'plotted bbox' / 'epoch0.png').read_text() == 'png'
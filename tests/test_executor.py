@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+from sklearn.externals import joblib
+
+from minerva.backend.base import BaseTransformer, Step
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+class AddIncrement(BaseTransformer):
+    def __init__(self, name, increment, calls):
+        super().__init__()
+        self.name = name
+        self.increment = increment
+        self.calls = calls
+
+    def transform(self, value):
+        self.calls.count(self.name)
+        return {'value': value + self.increment}
+
+    def save(self, filepath):
+        joblib.dump({'increment': self.increment}, filepath)
+
+    def load(self, filepath):
+        self.increment = joblib.load(filepath)['increment']
+        return self
+
+
+def sum_values(values):
+    return sum(values)
+
+
+def build_diamond(cache_dirpath, calls, max_workers=1, cache_output=False):
+    """
+    root feeds left and right, which both feed output.
+    """
+    root = Step(name='root', transformer=AddIncrement('root', 1, calls), input_data=['input'],
+                cache_dirpath=cache_dirpath)
+    left = Step(name='left', transformer=AddIncrement('left', 10, calls), input_steps=[root],
+                cache_dirpath=cache_dirpath)
+    right = Step(name='right', transformer=AddIncrement('right', 100, calls), input_steps=[root],
+                 cache_dirpath=cache_dirpath)
+    return Step(name='output', transformer=AddIncrement('output', 1000, calls), input_steps=[left, right],
+                adapter={'value': ([('left', 'value'), ('right', 'value')], sum_values)},
+                cache_dirpath=cache_dirpath, max_workers=max_workers, cache_output=cache_output)
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_diamond_runs_every_step_once(tmpdir, max_workers):
+    calls = CallCounter()
+    output = build_diamond(str(tmpdir), calls, max_workers=max_workers)
+    data = {'input': {'value': 0}}
+
+    assert output.fit_transform(data) == {'value': 1112}
+    assert calls.counts == {'root': 1, 'left': 1, 'right': 1, 'output': 1}
+
+    assert output.transform(data) == {'value': 1112}
+    assert calls.counts == {'root': 2, 'left': 2, 'right': 2, 'output': 2}
+
+
+def test_cached_output_follows_fingerprint(tmpdir):
+    calls = CallCounter()
+    output = build_diamond(str(tmpdir), calls, cache_output=True)
+    data = {'input': {'value': 0}}
+    output.fit_transform(data)
+    assert output.transform(data) == {'value': 1112}
+    assert calls.counts['output'] == 2
+
+    rebuilt_calls = CallCounter()
+    rebuilt = build_diamond(str(tmpdir), rebuilt_calls, cache_output=True)
+    assert rebuilt.transform(data) == {'value': 1112}
+    assert rebuilt_calls.counts == {}
+
+    assert rebuilt.transform({'input': {'value': 1}}) == {'value': 1114}
+    assert rebuilt_calls.counts == {'root': 1, 'left': 1, 'right': 1, 'output': 1}
+
+    rebuilt.get_step('left').transformer.verbose = True
+    assert rebuilt.transform(data) == {'value': 1112}
+    assert rebuilt_calls.counts == {'root': 2, 'left': 2, 'right': 2, 'output': 2}
+
+    left = rebuilt.get_step('left')
+    joblib.dump({'increment': 10, 'refitted': True}, left.cache_filepath_step_transformer)
+    assert rebuilt.transform(data) == {'value': 1112}
+    assert rebuilt_calls.counts == {'root': 3, 'left': 3, 'right': 3, 'output': 3}
+
+    assert rebuilt.transform(data) == {'value': 1112}
+    assert rebuilt_calls.counts == {'root': 3, 'left': 3, 'right': 3, 'output': 3}
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+import torch
+
+from minerva.backend.models.pytorch import loaders
+from minerva.backend.models.pytorch.loaders import CachedLoader, TensorCache, get_tensor_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_tensor_caches():
+    loaders._TENSOR_CACHES.clear()
+    yield
+    loaders._TENSOR_CACHES.clear()
+
+
+class CountingLoader:
+    def __init__(self, batches):
+        self.batches = batches
+        self.passes = 0
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        self.passes += 1
+        return iter(self.batches)
+
+
+def get_batches():
+    generator = torch.Generator().manual_seed(0)
+    return [(torch.randn(2, 3, 5, 5, generator=generator), [torch.arange(2), torch.ones(2, dtype=torch.int64)])
+            for _ in range(4)]
+
+
+def assert_same_batches(batches, other_batches):
+    assert len(batches) == len(other_batches)
+    for batch, other_batch in zip(batches, other_batches):
+        if torch.is_tensor(batch):
+            assert torch.equal(batch, other_batch)
+        else:
+            assert type(batch) is type(other_batch)
+            assert_same_batches(batch, other_batch)
+
+
+@pytest.mark.parametrize('max_memory_bytes', [2 ** 30, 1000])
+def test_cached_loader_replays_recorded_batches(tmpdir, max_memory_bytes):
+    batches = get_batches()
+    loader = CountingLoader(batches)
+    cache = TensorCache(max_memory_bytes, dirpath=str(tmpdir))
+    cached_loader = CachedLoader(loader, cache)
+
+    recorded = list(cached_loader)
+    assert cache.is_complete
+    # a consumer modifying the first pass in place does not change what is replayed
+    for X, _ in recorded:
+        X.zero_()
+
+    replayed = list(cached_loader)
+    assert loader.passes == 1
+    assert_same_batches(replayed, get_batches())
+    assert cache.nbytes == sum(X.nbytes + y[0].nbytes + y[1].nbytes for X, y in batches)
+    if max_memory_bytes < cache.nbytes:
+        # the spill file is unlinked once mapped
+        assert os.listdir(str(tmpdir)) == []
+        assert isinstance(cache.batches[0][0], loaders._StoredTensor)
+    else:
+        assert torch.is_tensor(cache.batches[0][0])
+
+
+def test_interrupted_pass_does_not_complete_cache(tmpdir):
+    loader = CountingLoader(get_batches())
+    cached_loader = CachedLoader(loader, TensorCache(1000, dirpath=str(tmpdir)))
+
+    for _ in zip(range(2), cached_loader):
+        pass
+    assert not cached_loader.cache.is_complete
+    assert os.listdir(str(tmpdir)) == []
+
+    assert_same_batches(list(cached_loader), get_batches())
+    assert loader.passes == 2
+    assert_same_batches(list(cached_loader), get_batches())
+    assert loader.passes == 2
+
+
+def fill(cache, batches_nr):
+    list(cache.record([torch.zeros(256, dtype=torch.uint8) for _ in range(batches_nr)]))
+
+
+def test_tensor_caches_are_shared_and_evicted_least_recently_requested():
+    first = get_tensor_cache('first', 1024)
+    assert get_tensor_cache('first', 1024) is first
+    fill(first, 2)
+    second = get_tensor_cache('second', 1024)
+    fill(second, 2)
+
+    # requesting first again makes second the least recently requested one
+    assert get_tensor_cache('first', 1024) is first
+    third = get_tensor_cache('third', 1024)
+    fill(third, 2)
+
+    get_tensor_cache('third', 1024)
+    assert list(loaders._TENSOR_CACHES) == ['first', 'third']
+    assert get_tensor_cache('second', 1024) is not second
+
+
+def test_most_recent_tensor_cache_is_never_evicted():
+    cache = get_tensor_cache('large', 1024)
+    fill(cache, 8)
+    assert get_tensor_cache('large', 1024) is cache
+    assert list(loaders._TENSOR_CACHES) == ['large']
@@ -0,0 +1,113 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.optim import SGD
+
+from minerva.backend.models.pytorch.callbacks import Callback, CallbackList, ExponentialLRScheduler, ModelCheckpoint
+from minerva.backend.models.pytorch.models import Model
+
+ARCHITECTURE_CONFIG = {'weights_init': {'function': 'normal',
+                                        'params': {'mean': 0., 'std_conv2d': 0.01, 'std_linear': 0.1}}}
+
+
+class Interrupt(Callback):
+    def __init__(self, epoch_id=None):
+        super().__init__()
+        self.interrupt_epoch_id = epoch_id
+        self.started_epoch_ids = []
+
+    def on_epoch_begin(self, *args, **kwargs):
+        if self.epoch_id == self.interrupt_epoch_id:
+            raise KeyboardInterrupt
+        self.started_epoch_ids.append(self.epoch_id)
+
+    def on_epoch_end(self, *args, **kwargs):
+        self.epoch_id += 1
+
+
+class LinearModel(Model):
+    def __init__(self, checkpoint_dir, epochs=4, resume=True, interrupt_epoch_id=None, accumulation_steps=1):
+        super().__init__(ARCHITECTURE_CONFIG,
+                         {'epochs': epochs, 'resume': resume, 'accumulation_steps': accumulation_steps},
+                         {'model_checkpoint': {'checkpoint_dir': checkpoint_dir}})
+        torch.manual_seed(0)
+        self.model = nn.Linear(4, 3)
+        self.optimizer = SGD(self.model.parameters(), lr=0.1, momentum=0.9)
+        self.loss_function = F.cross_entropy
+        self.interrupt = Interrupt(interrupt_epoch_id)
+        self.callbacks = CallbackList([ExponentialLRScheduler(gamma=0.5),
+                                       ModelCheckpoint(checkpoint_dir, epoch_every=0),
+                                       self.interrupt])
+
+
+def get_batches(batches_nr=3, batch_size=8):
+    generator = torch.Generator().manual_seed(0)
+    return [(torch.randn(batch_size, 4, generator=generator),
+             torch.randint(0, 3, (batch_size,), generator=generator))
+            for _ in range(batches_nr)]
+
+
+def fit(model, batches=None):
+    batches = get_batches() if batches is None else batches
+    return model.fit((batches, len(batches)))
+
+
+def concatenate_batches(batches):
+    return torch.cat([X for X, _ in batches]), torch.cat([y for _, y in batches])
+
+
+def assert_same_training(model, other_model):
+    for parameter, other_parameter in zip(model.model.parameters(), other_model.model.parameters()):
+        assert torch.allclose(parameter, other_parameter)
+    assert model.optimizer.param_groups[0]['lr'] == other_model.optimizer.param_groups[0]['lr']
+    for parameter, other_parameter in zip(model.model.parameters(), other_model.model.parameters()):
+        assert torch.allclose(model.optimizer.state[parameter]['momentum_buffer'],
+                              other_model.optimizer.state[other_parameter]['momentum_buffer'])
+
+
+def test_resumed_training_matches_uninterrupted(tmp_path):
+    uninterrupted = fit(LinearModel(str(tmp_path / 'uninterrupted'), resume=False))
+
+    checkpoint_dir = str(tmp_path / 'interrupted')
+    try:
+        fit(LinearModel(checkpoint_dir, interrupt_epoch_id=2))
+    except KeyboardInterrupt:
+        pass
+    resumed = fit(LinearModel(checkpoint_dir))
+
+    assert resumed.interrupt.started_epoch_ids == [2, 3]
+    assert resumed.optimizer.param_groups[0]['lr'] == 0.1 * 0.5 ** 4
+    assert_same_training(resumed, uninterrupted)
+
+
+def test_finished_training_is_not_resumed(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    finished = fit(LinearModel(checkpoint_dir))
+    retrained = fit(LinearModel(checkpoint_dir))
+
+    assert retrained.interrupt.started_epoch_ids == [0, 1, 2, 3]
+    assert_same_training(retrained, finished)
+
+
+def test_training_state_of_another_config_is_ignored(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    try:
+        fit(LinearModel(checkpoint_dir, interrupt_epoch_id=2))
+    except KeyboardInterrupt:
+        pass
+    retrained = fit(LinearModel(checkpoint_dir, epochs=3))
+
+    assert retrained.interrupt.started_epoch_ids == [0, 1, 2]
+
+
+@pytest.mark.parametrize('micro_batches_nr, accumulation_steps', [(4, 4), (5, 2)])
+def test_accumulated_micro_batches_match_full_batches(tmp_path, micro_batches_nr, accumulation_steps):
+    micro_batches = get_batches(batches_nr=micro_batches_nr, batch_size=4)
+    full_batches = [concatenate_batches(micro_batches[start:start + accumulation_steps])
+                    for start in range(0, micro_batches_nr, accumulation_steps)]
+
+    accumulated = fit(LinearModel(str(tmp_path / 'accumulated'), resume=False, accumulation_steps=accumulation_steps),
+                      micro_batches)
+    full = fit(LinearModel(str(tmp_path / 'full'), resume=False), full_batches)
+    assert_same_training(accumulated, full)
@@ -0,0 +1,50 @@
+from collections import Counter
+
+import pytest
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+from minerva.whales.preprocessing import EchoingDataset
+
+
+class EchoedRange:
+    def __init__(self, items_nr, echo_factor):
+        self.items_nr = items_nr
+        self.echo_factor = echo_factor
+
+    def __len__(self):
+        return self.items_nr
+
+    def get_echoed_items(self, index):
+        return [torch.tensor([index, echo_id]) for echo_id in range(self.echo_factor)]
+
+
+def iterate(items_nr, echo_factor, workers_nr, drop_last, shuffle=True):
+    dataset = EchoingDataset(EchoedRange(items_nr, echo_factor), batch_size=4, buffer_size=5,
+                             collate_fn=default_collate, shuffle=shuffle, drop_last=drop_last, workers_nr=workers_nr)
+    loader = DataLoader(dataset, batch_size=None, num_workers=workers_nr)
+    return dataset, list(loader)
+
+
+@pytest.mark.parametrize('workers_nr', [0, 2, 3])
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_echoing_length_matches_batches(workers_nr, drop_last):
+    dataset, batches = iterate(items_nr=11, echo_factor=3, workers_nr=workers_nr, drop_last=drop_last)
+    assert len(dataset) == len(batches)
+    if drop_last:
+        assert all(len(batch) == 4 for batch in batches)
+
+
+@pytest.mark.parametrize('workers_nr', [0, 2])
+def test_every_item_is_echoed_echo_factor_times(workers_nr):
+    _, batches = iterate(items_nr=11, echo_factor=3, workers_nr=workers_nr, drop_last=False)
+    items = Counter(tuple(item.tolist()) for batch in batches for item in batch)
+    assert items == Counter({(index, echo_id): 1 for index in range(11) for echo_id in range(3)})
+
+
+def test_echoes_are_shuffled_across_source_items():
+    _, batches = iterate(items_nr=11, echo_factor=3, workers_nr=0, drop_last=False, shuffle=False)
+    indices = [item[0].item() for batch in batches for item in batch]
+    assert indices != sorted(indices)
+    assert sorted(indices) == sorted(list(range(11)) * 3)
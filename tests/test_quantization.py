@@ -0,0 +1,36 @@
+import numpy as np
+
+from minerva.whales.quantization import quantize, dequantize, adjust
+
+
+def test_quantize_dequantize_round_trip():
+    random_state = np.random.RandomState(0)
+    shape, bins_nr = (320, 200), 64
+    coordinates = random_state.uniform(0, 1, (100, 4)) * np.tile(shape, 2)
+
+    binned_coordinates = quantize(coordinates, shape, bins_nr)
+    assert binned_coordinates.min() >= 1 and binned_coordinates.max() <= bins_nr - 1
+
+    bin_sizes = np.tile(shape, 2) / bins_nr
+    errors = np.abs(dequantize(binned_coordinates, shape, bins_nr) - coordinates)
+    assert np.all(errors <= bin_sizes + 1e-9)
+
+
+def test_quantize_image_edges():
+    shape, bins_nr = (100, 50), 11
+    binned_coordinates = quantize([[0, 0, 100, 50]], shape, bins_nr)
+    np.testing.assert_array_equal(binned_coordinates, [[1, 1, bins_nr - 1, bins_nr - 1]])
+
+
+def test_dequantize_per_row_shapes():
+    shapes = np.array([[100, 50], [200, 400]])
+    scaled_coordinates = dequantize([[5, 5, 10, 10], [5, 5, 10, 10]], shapes, 10)
+    np.testing.assert_allclose(scaled_coordinates, [[50, 25, 100, 50], [100, 200, 200, 400]])
+
+
+def test_adjust_maps_crop_corners_back():
+    shape = (256, 128)
+    crop_coordinates = np.array([[10, 20, 74, 276], [0, 0, 128, 256]])
+    coordinates = np.array([[0, 0, 128, 256], [64, 128, 64, 128]])
+    np.testing.assert_allclose(adjust(coordinates, crop_coordinates, shape),
+                               [[10, 20, 74, 276], [64, 128, 64, 128]])
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.externals import joblib
+
+from minerva.backend.storage import save_output, load_output, output_exists
+
+
+@pytest.fixture
+def filepath(tmpdir):
+    return str(tmpdir.join('output'))
+
+
+def test_array_round_trip_is_memory_mapped(filepath):
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    save_output(array, filepath)
+
+    loaded = load_output(filepath)
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, array)
+
+
+@pytest.mark.parametrize('dataframe', [
+    pd.DataFrame({'x': [1, 2, 3], 'name': ['a', 'b', None], 'score': [0.5, np.nan, 1.]}),
+    pd.DataFrame({'x': [1, 2]}, index=pd.Index(['p', 'q'], name='id')),
+    pd.DataFrame({'kind': pd.Categorical(['a', 'b', 'a'])}),
+    pd.DataFrame({'x': [1, 2]}, index=pd.MultiIndex.from_tuples([('a', 1), ('b', 2)])),
+    pd.DataFrame([[1, 2], [3, 4]], columns=['x', 'x']),
+])
+def test_dataframe_round_trip_is_exact(filepath, dataframe):
+    save_output(dataframe, filepath)
+    pd.testing.assert_frame_equal(load_output(filepath), dataframe)
+
+
+def test_dataframe_columns_subset(filepath):
+    dataframe = pd.DataFrame({'x': [1, 2], 'y': [3., 4.], 'z': ['a', 'b']})
+    save_output(dataframe, filepath)
+    pd.testing.assert_frame_equal(load_output(filepath, columns=['z', 'x']), dataframe[['z', 'x']])
+
+
+def test_dict_round_trip(filepath):
+    output = {'array': np.ones(3), 'frame': pd.DataFrame({'x': [1]}), 'other': [1, 'a']}
+    save_output(output, filepath)
+
+    loaded = load_output(filepath)
+    np.testing.assert_array_equal(loaded['array'], output['array'])
+    pd.testing.assert_frame_equal(loaded['frame'], output['frame'])
+    assert loaded['other'] == output['other']
+
+
+def test_resave_replaces_output_of_another_format(filepath):
+    save_output(pd.DataFrame({'x': [1]}), filepath)
+    save_output(np.zeros(2), filepath)
+
+    assert isinstance(load_output(filepath), np.ndarray)
+    assert sorted(os.listdir(os.path.dirname(filepath))) == ['output.npy']
+
+
+def test_legacy_pickle_is_loaded(filepath):
+    joblib.dump({'a': 1}, filepath)
+
+    assert output_exists(filepath)
+    assert load_output(filepath) == {'a': 1}
+
+
+def test_missing_output(filepath):
+    assert not output_exists(filepath)
+    with pytest.raises(FileNotFoundError):
+        load_output(filepath)
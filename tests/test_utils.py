@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from minerva import utils
+from minerva.utils import decode_roi_with_rescale, get_aligned_roi
+
+requires_roi_decoding = pytest.mark.skipif(not utils.is_roi_decoding_available(),
+                                           reason='requires TurboJPEG with crop')
+
+
+@pytest.fixture
+def jpeg_path(tmpdir):
+    random_state = np.random.RandomState(0)
+    img = random_state.randint(0, 256, (30, 40, 3), dtype=np.uint8)
+    img_path = str(tmpdir.join('img.jpg'))
+    # 4:2:0 subsampling, 16x16 MCUs, the height is not a multiple of them
+    Image.fromarray(img).resize((400, 300), Image.BILINEAR).save(img_path, quality=95, subsampling=2)
+    return img_path
+
+
+def test_get_aligned_roi():
+    assert get_aligned_roi((13, 20, 100, 71), (400, 300), (16, 16)) == (0, 16, 112, 80)
+    assert get_aligned_roi((390, 290, 500, 400), (400, 300), (16, 16)) == (384, 288, 400, 300)
+    assert get_aligned_roi((-5, 299, 3, 300), (400, 300), (16, 16)) == (0, 288, 16, 300)
+
+
+@requires_roi_decoding
+def test_decode_roi_with_rescale_picks_region_scale(jpeg_path):
+    img, (left, top, right, bottom) = decode_roi_with_rescale(jpeg_path, (0, 0, 320, 240), (80, 60),
+                                                              max_scaling_factor=8)
+    assert (right - left, bottom - top) == (320, 240)
+    assert img.shape[:2] == (60, 80)
+
+
+@requires_roi_decoding
+@pytest.mark.parametrize('roi', [(101, 53, 257, 211), (390, 290, 400, 300), (0, 0, 400, 300)])
+def test_decode_turbo_roi_crops_on_mcu_grid(jpeg_path, roi):
+    full_img = np.asarray(Image.open(jpeg_path).convert('RGB'))
+
+    img, (left, top, right, bottom) = utils._decode_turbo_roi(jpeg_path, roi)
+    assert left % 16 == 0 and top % 16 == 0
+    assert img.shape == (bottom - top, right - left, 3)
+    assert np.abs(img.astype(np.float64) - full_img[top:bottom, left:right]).mean() < 2